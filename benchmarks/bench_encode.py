@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark message construction and BSON encoding of large insert and
+delete batches (MessageFactory._generate_messages), independent of oid
+generation and repository updates, and of snapshots (MessageFactory.dump)
+without and with the fragment cache: snapshot-fill is the first snapshot
+which populates the cache, snapshot-cached a later one.
+
+Usage: python benchmarks/bench_encode.py [SIZE...]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import time
+
+from bench_message_factory import make_batch
+from spreadflow_observer_fs.protocol import MessageFactory
+
+SIZES = (100000, 1000000)
+
+
+def bench_encode(size):
+    paths, meta = make_batch(size)
+    factory = MessageFactory()
+    merged = factory._metadata_merge(meta, factory._metadata_generate_uris(paths)) #pylint: disable=protected-access
+    oids = factory._metadata_generate_oids(merged) #pylint: disable=protected-access
+    objects = tuple(zip(paths, oids))
+
+    results = []
+    for name, deleted, inserted in (('insert', (), objects), ('delete', objects, ())):
+        best = None
+        for _ in range(3):
+            start = time.time()
+            messages = 0
+            encoded = 0
+            for msg in factory._generate_messages(deleted, inserted, oids, merged): #pylint: disable=protected-access
+                messages += 1
+                encoded += len(msg)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((name, best, messages, encoded))
+
+    entries = tuple((path, oid, m['stat']) for path, oid, m in zip(paths, oids, meta))
+    for name, fragment_cache, fill in (('snapshot', False, False),
+                                       ('snapshot-fill', True, True),
+                                       ('snapshot-cached', True, False)):
+        factory = MessageFactory(fragment_cache=fragment_cache)
+        factory.restore(entries)
+        for msg in factory.dump():
+            pass
+
+        best = None
+        for _ in range(3):
+            if fill:
+                factory.restore(entries)
+            start = time.time()
+            messages = 0
+            encoded = 0
+            for msg in factory.dump():
+                messages += 1
+                encoded += len(msg)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((name, best, messages, encoded))
+
+    return results
+
+
+def main(argv):
+    sizes = tuple(int(arg) for arg in argv[1:]) or SIZES
+    print('{0:>10} {1:>16} {2:>10} {3:>10} {4:>12} {5:>10} {6:>12}'.format(
+        'entries', 'kind', 'seconds', 'messages', 'messages/s', 'MB/s', 'entries/s'))
+    for size in sizes:
+        for name, elapsed, messages, encoded in bench_encode(size):
+            print('{0:>10} {1:>16} {2:>10.3f} {3:>10} {4:>12.0f} {5:>10.1f} {6:>12.0f}'.format(
+                size, name, elapsed, messages, messages / elapsed,
+                encoded / elapsed / 1e6, size / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare event throughput and CPU time per event of the inotify engine and
+the watchdog observer.
+
+For each engine, the observer command is started on an empty tree of
+directories. Then EVENTS files are created and appended to while measuring
+the time until all of them were reported and the CPU time consumed by the
+observer process (Linux only, read from /proc).
+
+With more events than fit into the kernel event queue (see
+/proc/sys/fs/inotify/max_queued_events), the watchdog observer loses events
+and the run times out. The inotify engine resyncs instead.
+
+Usage: python benchmarks/bench_inotify.py [EVENTS]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from suite import ObserverProcess
+
+ENGINES = (('watchdog', ()), ('inotify', ('-o', 'inotify')))
+EVENTS = 5000
+TIMEOUT = 60
+DIRECTORIES = 20
+
+
+def _cpu_time(pid):
+    with open('/proc/{0:d}/stat'.format(pid)) as stream:
+        fields = stream.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf(str('SC_CLK_TCK'))
+
+
+def bench_engine(options, events):
+    directory = tempfile.mkdtemp(prefix='spreadflow-bench-')
+    try:
+        dirs = [os.path.join(directory, 'd{0:02d}'.format(i)) for i in range(DIRECTORIES)]
+        for path in dirs:
+            os.mkdir(path)
+        seed = os.path.join(directory, 'seed.txt')
+        with open(seed, 'w'):
+            pass
+
+        observer = ObserverProcess(directory, options)
+        try:
+            observer.wait(paths=[seed])
+            paths = [os.path.join(dirs[i % DIRECTORIES], '{0:08d}.txt'.format(i)) for i in range(events)]
+            cpu = _cpu_time(observer.process.pid)
+            start = time.time()
+            for path in paths:
+                with open(path, 'w') as stream:
+                    stream.write('a')
+            for path in paths:
+                with open(path, 'a') as stream:
+                    stream.write('b')
+            observer.wait(paths=paths, timeout=TIMEOUT)
+            elapsed = time.time() - start
+            cpu = _cpu_time(observer.process.pid) - cpu
+        finally:
+            observer.close()
+    finally:
+        shutil.rmtree(directory)
+
+    return elapsed, cpu
+
+
+def main(argv):
+    events = int(argv[1]) if len(argv) > 1 else EVENTS
+    print('{0:>10} {1:>10} {2:>10} {3:>12} {4:>14}'.format(
+        'engine', 'files', 'seconds', 'files/s', 'cpu us/file'))
+    for name, options in ENGINES:
+        try:
+            elapsed, cpu = bench_engine(options, events)
+        except RuntimeError as e:
+            print('{0:>10} {1:>10} {2!s}'.format(name, events, e))
+            continue
+        print('{0:>10} {1:>10} {2:>10.3f} {3:>12.0f} {4:>14.1f}'.format(
+            name, events, elapsed, events / elapsed, cpu / events * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the compiled PatternMatcher against pathtools.patterns.match_path
+on synthetic paths.
+
+Usage: python benchmarks/bench_matcher.py [COUNT]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import time
+
+from pathtools.patterns import match_path
+
+from spreadflow_observer_fs.matcher import PatternMatcher
+
+COUNT = 1000000
+EXTENSIONS = ('txt', 'jpg', 'log', 'TXT', 'dat')
+
+CASES = (
+    ('suffix', ['*/*.txt'], []),
+    ('suffix+exclude', ['*/*.txt', '*/*.jpg'], ['*/*.tmp', '*/cache/*']),
+    ('regex', ['*/file-1*.txt'], []),
+)
+
+
+def make_paths(count):
+    return ['/data/{0:03d}/{1:03d}/file-{2:d}.{3:s}'.format(
+        i % 997, i % 101, i, EXTENSIONS[i % len(EXTENSIONS)]) for i in range(count)]
+
+
+def bench(func, paths):
+    start = time.time()
+    matched = sum(1 for path in paths if func(path))
+    return time.time() - start, matched
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else COUNT
+    paths = make_paths(count)
+
+    print('{0:>16} {1:>12} {2:>12} {3:>8}'.format('case', 'pathtools s', 'compiled s', 'speedup'))
+    for name, patterns, excludes in CASES:
+        matcher = PatternMatcher(patterns, exclude_patterns=excludes)
+        reference, expected = bench(lambda path: match_path(
+            path, included_patterns=patterns, excluded_patterns=excludes,
+            case_sensitive=False), paths)
+        compiled, matched = bench(matcher.matches, paths)
+        assert matched == expected
+        print('{0:>16} {1:>12.3f} {2:>12.3f} {3:>7.1f}x'.format(
+            name, reference, compiled, reference / compiled))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
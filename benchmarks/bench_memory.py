@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark memory used by the repository of a message factory, including the
+stat fingerprints, in bytes per entry.
+
+Usage: python benchmarks/bench_memory.py (requires tracemalloc, Python 3.4+)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import hashlib
+import tracemalloc
+
+from spreadflow_observer_fs.protocol import MessageFactory
+
+SIZES = (100000, 1000000)
+FILES_PER_DIRECTORY = 100
+
+
+def _entries(size):
+    """
+    Generate (path, oid, fingerprint) tuples of a tree with 100 files per
+    directory, two levels deep.
+    """
+    for i in range(size):
+        d = i // FILES_PER_DIRECTORY
+        path = '/srv/share/projects/p{0:04d}/d{1:05d}/file_{2:08d}.dat'.format(d // 100, d, i)
+        oid = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        fingerprint = (33188, 1000000 + i, 2049, 1, 1000, 1000, 4096 + i,
+                       1500000000 + i, 1500000000 + i, 1500000000 + i)
+        yield (path, oid, fingerprint)
+
+
+def bench_memory(size):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    factory = MessageFactory(encoder=None)
+    factory.restore(_entries(size))
+
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert len(factory.paths()) == size
+    return (after - before) / size
+
+
+def main():
+    print('{0:>10} {1:>14}'.format('entries', 'bytes/entry'))
+    for size in SIZES:
+        print('{0:>10} {1:>14.1f}'.format(size, bench_memory(size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark MessageFactory.update and _construct_message on large insert
+batches.
+
+Usage: python benchmarks/bench_message_factory.py [SIZE...]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import time
+
+from spreadflow_observer_fs.protocol import MessageFactory
+
+SIZES = (10000, 100000, 1000000)
+
+
+def make_batch(size):
+    paths = tuple('/data/{0:04d}/{1:08d}.txt'.format(i // 1000, i) for i in range(size))
+    meta = tuple({'stat': (33188, i, 2049, 1, 1000, 1000, i % 4096, 1500000000, 1500000000, 1500000000)}
+                 for i in range(size))
+    return paths, meta
+
+
+def bench_update(size):
+    paths, meta = make_batch(size)
+    factory = MessageFactory()
+
+    construct_time = [0]
+    construct = factory._construct_message #pylint: disable=protected-access
+    def timed_construct(*args):
+        start = time.time()
+        try:
+            return construct(*args)
+        finally:
+            construct_time[0] += time.time() - start
+    factory._construct_message = timed_construct #pylint: disable=protected-access
+
+    start = time.time()
+    messages = 0
+    encoded = 0
+    for msg in factory.update((), paths, meta):
+        messages += 1
+        encoded += len(msg)
+    elapsed = time.time() - start
+
+    return elapsed, construct_time[0], messages, encoded
+
+
+def main(argv):
+    sizes = tuple(int(arg) for arg in argv[1:]) or SIZES
+    print('{0:>10} {1:>10} {2:>12} {3:>10} {4:>12}'.format(
+        'entries', 'update s', 'construct s', 'messages', 'entries/s'))
+    for size in sizes:
+        elapsed, construct, messages, _ = bench_update(size)
+        print('{0:>10} {1:>10.3f} {2:>12.3f} {3:>10} {4:>12.0f}'.format(
+            size, elapsed, construct, messages, size / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
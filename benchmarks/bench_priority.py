@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measure the latency of live changes while the initial scan is reported.
+
+The observer command is started on a synthetic tree (see treegen.py).
+While its initial scan is being reported, a file is created every INTERVAL
+seconds in an (empty) directory of the tree and the time until its insert
+arrives is recorded. Sampling ends once all files of the tree were
+reported. Options following the arguments are passed to the observer,
+e.g., --bulk-rate.
+
+Usage: python benchmarks/bench_priority.py [--files N] [--tree-dir DIR]
+                                           [--option=ARG ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import treegen
+from suite import ObserverProcess, TIMEOUT, _percentiles
+
+FILES = 200000
+INTERVAL = 0.01
+
+
+def _next_arrival(observer, deadline):
+    try:
+        arrival = observer.arrivals.get(timeout=max(0, deadline - time.time()))
+    except queue.Empty:
+        raise RuntimeError("Timeout waiting for inserts from the observer")
+    if arrival is None:
+        raise RuntimeError("Observer terminated unexpectedly")
+    return arrival
+
+
+def bench_priority(directory, matches, options):
+    live_dir = os.path.join(directory, 'bench-live')
+    if os.path.exists(live_dir):
+        shutil.rmtree(live_dir)
+    os.mkdir(live_dir)
+
+    latencies = []
+    start = time.time()
+    deadline = start + TIMEOUT
+    observer = ObserverProcess(directory, options)
+    try:
+        # Start sampling once the initial scan is being reported.
+        scanned = len(_next_arrival(observer, deadline)[1])
+        while scanned < matches:
+            path = os.path.join(live_dir, 'live-{0:08d}.txt'.format(len(latencies)))
+            created = time.time()
+            with open(path, 'w'):
+                pass
+
+            arrived = None
+            while arrived is None:
+                (now, inserted) = _next_arrival(observer, deadline)
+                for other in inserted:
+                    if other == path:
+                        arrived = now
+                    elif not other.startswith(live_dir):
+                        scanned += 1
+            latencies.append(arrived - created)
+            time.sleep(INTERVAL)
+        elapsed = time.time() - start
+    finally:
+        observer.close()
+        shutil.rmtree(live_dir)
+
+    return elapsed, _percentiles(latencies)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument('--files', type=int, default=FILES)
+    parser.add_argument('--tree-dir', metavar='DIR',
+                        help='Generate (or reuse) the tree in DIR instead of a temporary directory')
+    parser.add_argument('--option', metavar='ARG', action='append', default=[],
+                        help='Pass ARG to the observer command')
+    args = parser.parse_args(argv[1:])
+
+    directory = args.tree_dir or tempfile.mkdtemp(prefix='spreadflow-bench-')
+    try:
+        manifest = treegen.generate_tree(directory, args.files)
+        elapsed, latency = bench_priority(directory, manifest['matches'], args.option)
+    finally:
+        if not args.tree_dir:
+            shutil.rmtree(directory)
+
+    print('{0:>10} {1:>10} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+        'files', 'initial s', 'samples', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    print('{0:>10} {1:>10.2f} {2:>8} {3:>10.1f} {4:>10.1f} {5:>10.1f} {6:>10.1f}'.format(
+        args.files, elapsed, latency['count'], latency['p50'] * 1e3,
+        latency['p90'] * 1e3, latency['p99'] * 1e3, latency['max'] * 1e3))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
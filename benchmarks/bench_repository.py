@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark per-event cost of Repository.update with growing repository size.
+
+Usage: python benchmarks/bench_repository.py
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import timeit
+
+from spreadflow_observer_fs.protocol import Repository
+
+SIZES = (1000, 10000, 100000, 1000000)
+EVENTS = 1000
+
+
+def _oid(path, rev=0):
+    return hashlib.sha1('{0}:{1}'.format(path, rev).encode('utf-8')).hexdigest()
+
+
+def bench_update(size, events=EVENTS):
+    repo = Repository()
+    repo.update((), [('/root/{0:08d}'.format(i), _oid(i)) for i in range(size)])
+
+    paths = ['/root/{0:08d}'.format(i) for i in range(0, size, max(1, size // events))][:events]
+    state = {'rev': 0}
+
+    def modify():
+        state['rev'] += 1
+        for path in paths:
+            repo.update((path,), [(path, _oid(path, state['rev']))])
+
+    return min(timeit.repeat(modify, number=1, repeat=3)) / len(paths)
+
+
+def main():
+    print('{0:>10} {1:>14}'.format('entries', 'us/event'))
+    for size in SIZES:
+        print('{0:>10} {1:>14.2f}'.format(size, bench_update(size) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite for the scan, event and encode hot paths.
+
+For every size and layout a synthetic tree is generated (see treegen.py)
+and the following is measured:
+
+  scan        DirectoryScanner over the tree (1 and 4 workers, warm cache)
+  initial     Start of the observer command until all matching files were
+              reported as BSON messages on stdout
+  throughput  Files created in a burst until all inserts were reported
+  latency     Single file write until its insert was reported
+
+Independently of the trees, Repository.update, MessageFactory.update and
+MessageFactory._construct_message are microbenchmarked.
+
+Results are written as a JSON document to FILE (default: stdout), a
+summary is printed to stderr. With --compare, the results are compared to
+those of a previous run.
+
+Usage: python benchmarks/suite.py [--sizes N,...] [--layouts flat,deep]
+                                  [--tree-dir DIR] [--output FILE]
+                                  [--compare FILE] [--option=ARG ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import bson
+
+import bench_message_factory
+import bench_repository
+import treegen
+from spreadflow_observer_fs.matcher import PatternMatcher
+from spreadflow_observer_fs.protocol import MessageFactory
+from spreadflow_observer_fs.scanner import DirectoryScanner
+
+SIZES = (10000, 100000)
+LAYOUTS = ('flat', 'deep')
+EVENTS = 10000
+LATENCY_SAMPLES = 200
+TIMEOUT = 600
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMAND = 'from spreadflow_observer_fs.script import main; main()'
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    def rank(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+    return {
+        'count': len(samples),
+        'p50': rank(0.5),
+        'p90': rank(0.9),
+        'p99': rank(0.99),
+        'max': samples[-1],
+    }
+
+
+class ObserverProcess(object):
+    """
+    Runs the observer command on a directory and records the arrival time
+    of every reported insert.
+    """
+
+    def __init__(self, directory, options=()):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, (ROOT, env.get('PYTHONPATH'))))
+        args = [sys.executable, '-c', COMMAND] + list(options) + [directory, treegen.PATTERN]
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.arrivals = queue.Queue()
+        self.messages = 0
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _read(self):
+        for msg in bson.decode_file_iter(self.process.stdout):
+            now = time.time()
+            item = msg['item']
+            if item.get('type') == 'delta':
+                paths = [item['data'][oid]['path'] for oid in item['inserts']]
+                self.arrivals.put((now, paths))
+        self.arrivals.put(None)
+
+    def wait(self, count=None, paths=None, timeout=TIMEOUT):
+        """
+        Wait until count inserts or inserts for all of the given paths were
+        reported. Returns the arrival time of the last one.
+        """
+        pending = set(paths or ())
+        deadline = time.time() + timeout
+        last = None
+        while (count > 0) if count is not None else pending:
+            try:
+                arrival = self.arrivals.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                raise RuntimeError("Timeout waiting for inserts from the observer")
+            if arrival is None:
+                raise RuntimeError("Observer terminated unexpectedly")
+            last, inserted = arrival
+            self.messages += 1
+            if count is not None:
+                count -= len(inserted)
+            pending.difference_update(inserted)
+        return last
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.reader.join()
+
+
+def bench_scan(directory, workers):
+    scanner = DirectoryScanner(PatternMatcher([treegen.PATTERN]), workers=workers)
+    scanner.scan([directory], lambda paths, metadata: None)
+    return scanner.scan([directory], lambda paths, metadata: None)
+
+
+def _touch(path):
+    with open(path, 'w') as stream:
+        stream.write(path)
+
+
+def bench_observer(directory, matches, events, samples, options):
+    """
+    Measure initial scan, event throughput and latency of the observer
+    command. Files created by the benchmark are removed afterwards.
+    """
+    results = {}
+    events_dir = os.path.join(directory, 'bench-events')
+    latency_dir = os.path.join(directory, 'bench-latency')
+    for path in (events_dir, latency_dir):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    start = time.time()
+    observer = ObserverProcess(directory, options)
+    try:
+        elapsed = observer.wait(count=matches) - start
+        results['initial'] = {
+            'seconds': elapsed,
+            'files_per_second': matches / elapsed,
+            'messages': observer.messages,
+        }
+
+        os.mkdir(events_dir)
+        os.mkdir(latency_dir)
+        time.sleep(0.5)
+
+        paths = [os.path.join(events_dir, 'event-{0:08d}.txt'.format(i)) for i in range(events)]
+        start = time.time()
+        for path in paths:
+            _touch(path)
+        written = time.time() - start
+        elapsed = observer.wait(paths=paths) - start
+        results['throughput'] = {
+            'events': events,
+            'seconds': elapsed,
+            'write_seconds': written,
+            'events_per_second': events / elapsed,
+        }
+
+        latencies = []
+        for i in range(samples):
+            path = os.path.join(latency_dir, 'latency-{0:08d}.txt'.format(i))
+            start = time.time()
+            _touch(path)
+            latencies.append(observer.wait(paths=[path]) - start)
+        results['latency'] = _percentiles(latencies)
+    finally:
+        observer.close()
+        for path in (events_dir, latency_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    return results
+
+
+def bench_construct(size=MessageFactory.CHUNK_SIZE):
+    paths, meta = bench_message_factory.make_batch(size)
+    inserts = tuple((path, bench_repository._oid(path)) for path in paths) #pylint: disable=protected-access
+    index = dict((oid, dict(m, path=path)) for (path, oid), m in zip(inserts, meta))
+    factory = MessageFactory()
+    seconds = min(timeit.repeat(lambda: factory._construct_message((), inserts, index), #pylint: disable=protected-access
+                                number=10, repeat=3)) / 10
+    return {'entries': size, 'seconds': seconds, 'entries_per_second': size / seconds}
+
+
+def run_micro(sizes):
+    results = []
+    for size in sizes:
+        results.append(('repository_update', {'size': size},
+                        {'us_per_event': bench_repository.bench_update(size) * 1e6}))
+        elapsed, construct, messages, encoded = bench_message_factory.bench_update(size)
+        results.append(('message_factory_update', {'size': size}, {
+            'seconds': elapsed,
+            'construct_seconds': construct,
+            'messages': messages,
+            'bytes': encoded,
+            'entries_per_second': size / elapsed,
+        }))
+    results.append(('construct_message', {'size': MessageFactory.CHUNK_SIZE}, bench_construct()))
+    return results
+
+
+def run_trees(args):
+    results = []
+    for size in args.sizes:
+        for layout in args.layouts:
+            directory = os.path.join(args.tree_dir, '{0:s}-{1:d}'.format(layout, size))
+            sys.stderr.write("Generating {0:s} tree with {1:d} files in {2:s}\n".format(layout, size, directory))
+            manifest = treegen.generate_tree(directory, size, layout)
+            params = {'size': size, 'layout': layout}
+
+            for workers in (1, 4):
+                stats = bench_scan(directory, workers)
+                results.append(('scan', dict(params, workers=workers), {
+                    'seconds': stats.elapsed,
+                    'entries': stats.entries,
+                    'matches': stats.matches,
+                    'entries_per_second': stats.rate,
+                }))
+
+            observer = bench_observer(directory, manifest['matches'], args.events,
+                                      args.samples, args.option or ())
+            for name in ('initial', 'throughput', 'latency'):
+                results.append((name, params, observer[name]))
+    return results
+
+
+def _key(result):
+    return json.dumps([result['benchmark'], result['params']], sort_keys=True)
+
+
+def compare(previous, results, out):
+    """
+    Print the ratio of every numeric result to the one of a previous run.
+    """
+    old = dict((_key(result), result['results']) for result in previous['results'])
+    for result in results:
+        before = old.get(_key(result))
+        if before is None:
+            continue
+        label = ' '.join([result['benchmark']] + ['{0}={1}'.format(*p) for p in sorted(result['params'].items())])
+        for name, value in sorted(result['results'].items()):
+            if before.get(name):
+                out.write("{0:<40} {1:<20} {2:>14.6g} {3:>14.6g} {4:>8.2f}x\n".format(
+                    label, name, before[name], value, value / before[name]))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')], default=list(SIZES),
+                        help='Comma separated number of files per tree (default: 10000,100000)')
+    parser.add_argument('--layouts', type=lambda s: s.split(','), default=list(LAYOUTS),
+                        help='Comma separated tree layouts: flat, deep (default: both)')
+    parser.add_argument('--tree-dir', metavar='DIR',
+                        help='Generate (and reuse) trees in DIR (default: temporary directory)')
+    parser.add_argument('--events', type=int, default=EVENTS,
+                        help='Number of files created for the throughput benchmark')
+    parser.add_argument('--samples', type=int, default=LATENCY_SAMPLES,
+                        help='Number of latency samples')
+    parser.add_argument('--option', action='append', metavar='ARG',
+                        help='Pass ARG to the observer command (e.g. --option=--detect-renames)')
+    parser.add_argument('--skip-trees', action='store_true',
+                        help='Only run the microbenchmarks')
+    parser.add_argument('--output', metavar='FILE', help='Write results to FILE (default: stdout)')
+    parser.add_argument('--compare', metavar='FILE', help='Compare results to a previous run')
+    args = parser.parse_args(argv[1:])
+
+    results = run_micro(args.sizes)
+    if not args.skip_trees:
+        cleanup = args.tree_dir is None
+        if cleanup:
+            args.tree_dir = tempfile.mkdtemp(prefix='spreadflow-bench-')
+        try:
+            results.extend(run_trees(args))
+        finally:
+            if cleanup:
+                shutil.rmtree(args.tree_dir)
+
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    document = {
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [{'benchmark': name, 'params': params, 'results': values}
+                    for name, params, values in results],
+    }
+
+    for result in document['results']:
+        sys.stderr.write("{0:<24} {1:<40} {2:s}\n".format(
+            result['benchmark'], json.dumps(result['params'], sort_keys=True),
+            json.dumps(result['results'], sort_keys=True)))
+
+    if args.compare:
+        with open(args.compare) as stream:
+            compare(json.load(stream), document['results'], sys.stderr)
+
+    text = json.dumps(document, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as stream:
+            stream.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
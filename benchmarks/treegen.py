@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generate synthetic directory trees for the benchmarks.
+
+The flat layout puts 1000 files into each directory directly below the
+root. The deep layout arranges directories of 10 files each in a tree with
+a fanout of 4. One in ten files does not match the benchmark pattern
+(*.txt). A manifest in the root directory allows an existing tree with the
+same parameters to be reused.
+
+Usage: python benchmarks/treegen.py DIR FILES [flat|deep]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import sys
+
+LAYOUTS = {
+    # layout: (files per directory, fanout)
+    'flat': (1000, None),
+    'deep': (10, 4),
+}
+
+PATTERN = '*.txt'
+MANIFEST = '.treegen.json'
+
+
+def _directory(index, fanout):
+    """
+    Return the relative path of the directory with the given index. With a
+    fanout, directories are numbered in breadth first order.
+    """
+    if fanout is None:
+        return 'd{0:06d}'.format(index)
+
+    parts = []
+    while index > 0:
+        parts.append('d{0:d}'.format((index - 1) % fanout))
+        index = (index - 1) // fanout
+    return os.path.join(*reversed(parts)) if parts else ''
+
+
+def generate_tree(root, files, layout='flat'):
+    """
+    Create (or reuse) a tree with the given number of files and return its
+    manifest (a dict with the parameters and the number of matching files).
+    """
+    manifest_path = os.path.join(root, MANIFEST)
+    manifest = {'files': files, 'layout': layout, 'matches': files - files // 10}
+    try:
+        with open(manifest_path) as stream:
+            if json.load(stream) == manifest:
+                return manifest
+    except (IOError, OSError, ValueError):
+        pass
+
+    if os.path.exists(root) and os.listdir(root):
+        raise ValueError("Refusing to generate a tree in non-empty directory {0:s}".format(root))
+
+    per_directory, fanout = LAYOUTS[layout]
+    offset = 1 if fanout is None else 0
+    for i in range(files):
+        dirpath = os.path.join(root, _directory(i // per_directory + offset, fanout))
+        if i % per_directory == 0 and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        ext = 'dat' if i % 10 == 9 else 'txt'
+        with open(os.path.join(dirpath, 'file-{0:08d}.{1:s}'.format(i, ext)), 'w') as stream:
+            stream.write('{0:d}\n'.format(i))
+
+    with open(manifest_path, 'w') as stream:
+        json.dump(manifest, stream)
+    return manifest
+
+
+def main(argv):
+    if len(argv) < 3:
+        sys.exit(__doc__.strip())
+    layout = argv[3] if len(argv) > 3 else 'flat'
+    print(json.dumps(generate_tree(argv[1], int(argv[2]), layout)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -28,12 +28,14 @@ setup(
     entry_points={
         'console_scripts': [
             'spreadflow-observer-fs-default = spreadflow_observer_fs.script:main',
+            'spreadflow-observer-fs-inotify = spreadflow_observer_fs.script:main_inotify',
         ]
     },
     install_requires=[
         'SpreadFlowCore',
         'SpreadFlowFormatBSON',
         'pathtools',
+        'scandir; python_version < "3.5"',
         'pymongo',
         'watchdog'
     ],
@@ -0,0 +1,193 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import os
+import time
+from multiprocessing.pool import ThreadPool
+from spreadflow_observer_fs.metrics import Metrics
+
+
+class SubtreeChange(collections.namedtuple('SubtreeChange', ['deleted', 'rescan'])):
+    """
+    Queue item for a directory level event. All known paths below the deleted
+    directory are removed and the rescan directory is walked for files to
+    insert. Either one may be None.
+    """
+    __slots__ = ()
+
+
+class ScanChunk(collections.namedtuple('ScanChunk', ['paths', 'stats'])):
+    """
+    Queue item for a chunk of initial scan results. The stat results were
+    taken by the scanner at some point since the scan started and may be
+    older than live events for the same paths.
+    """
+    __slots__ = ()
+
+
+class ScanFilter(object):
+    """
+    Tracks the paths and directories changed by live events while the
+    initial scan is running. Scan results for those are stale: the live
+    event was (or will be) resolved by a fresh stat call, and any later
+    change causes another live event.
+    """
+
+    def __init__(self):
+        self.paths = set()
+        self.prefixes = set()
+
+    def live(self, paths):
+        self.paths.update(paths)
+
+    def live_subtree(self, subtree):
+        for dirpath in subtree:
+            if dirpath is not None:
+                self.prefixes.add(os.path.join(dirpath, ''))
+
+    def _stale(self, path):
+        if path in self.paths:
+            return True
+        return any(path.startswith(prefix) for prefix in self.prefixes)
+
+    def filter(self, chunk):
+        """
+        Return the (paths, stats) of a scan chunk without the stale entries.
+        """
+        if not self.paths and not self.prefixes:
+            return (chunk.paths, chunk.stats)
+
+        fresh = [(path, st) for path, st in zip(chunk.paths, chunk.stats) if not self._stale(path)]
+        return (tuple(path for path, _ in fresh), tuple(st for _, st in fresh))
+
+
+class ChangeSet(object):
+    """
+    Merges a sequence of (deletes, inserts[, stats]) queue items into the net
+    effect per path.
+
+    Directories deleted as a whole are recorded in deleted_subtrees, such
+    that known paths below them can be removed by the owner of the
+    repository.
+    """
+
+    _ABSENT = object()
+    _UNKNOWN = object()
+
+    def __init__(self):
+        self._changes = collections.OrderedDict()
+        self.deleted_subtrees = []
+
+    def __len__(self):
+        return len(self._changes)
+
+    def add(self, deletes, inserts, stats=None):
+        for path in deletes:
+            self._changes.pop(path, None)
+            self._changes[path] = self._ABSENT
+
+        if stats is None:
+            stats = (self._UNKNOWN,) * len(inserts)
+
+        for path, st in zip(inserts, stats):
+            self._changes.pop(path, None)
+            self._changes[path] = st
+
+    def entries(self):
+        """
+        Return the net changes as (path, state) tuples, where state is a stat
+        tuple, None if the path still needs to be stat'ed or False if it is
+        absent. The result can be passed to another process.
+        """
+        result = []
+        for path, st in self._changes.items():
+            if st is self._UNKNOWN:
+                result.append((path, None))
+            elif st is self._ABSENT:
+                result.append((path, False))
+            else:
+                result.append((path, tuple(st)))
+        return result
+
+    def add_entries(self, entries):
+        """
+        Add changes returned by entries().
+        """
+        for path, st in entries:
+            self._changes.pop(path, None)
+            if st is None:
+                self._changes[path] = self._UNKNOWN
+            elif st is False:
+                self._changes[path] = self._ABSENT
+            else:
+                self._changes[path] = st
+
+    def subtree(self, dirpath):
+        """
+        Return the pending paths below dirpath.
+        """
+        prefix = os.path.join(dirpath, '')
+        return [path for path in self._changes if path.startswith(prefix)]
+
+    def resolve(self, stat_pool):
+        """
+        Stat all paths without a known stat result and return the merged
+        (deletable_paths, insertable_paths, insertable_meta) batch.
+        """
+        unknown = [path for path, st in self._changes.items() if st is self._UNKNOWN]
+        for path, st in zip(unknown, stat_pool.stat(unknown)):
+            self._changes[path] = self._ABSENT if st is None else st
+
+        deletable_paths = tuple(self._changes)
+        insertable_paths = []
+        insertable_meta = []
+        for path, st in self._changes.items():
+            if st is not self._ABSENT:
+                insertable_paths.append(path)
+                insertable_meta.append({'stat': tuple(st)})
+
+        return (deletable_paths, tuple(insertable_paths), tuple(insertable_meta))
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+class StatPool(object):
+    """
+    Performs stat calls on a bounded pool of threads. Returns None for paths
+    which cannot be stat'ed.
+    """
+
+    def __init__(self, workers=1, metrics=None):
+        self.workers = max(1, workers)
+        self.metrics = Metrics() if metrics is None else metrics
+        self._pool = ThreadPool(self.workers) if self.workers > 1 else None
+
+    def _timed_stat(self, path):
+        start = time.time()
+        try:
+            return _stat(path)
+        finally:
+            self.metrics.observe('stat', time.time() - start)
+
+    def stat(self, paths):
+        if self._pool is None or len(paths) < 2:
+            results = [self._timed_stat(path) for path in paths]
+        else:
+            chunksize = max(1, len(paths) // (self.workers * 4))
+            results = self._pool.map(self._timed_stat, paths, chunksize)
+
+        self.metrics.incr('stat_calls', len(paths))
+        self.metrics.incr('stat_errors', results.count(None))
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
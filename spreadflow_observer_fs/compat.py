@@ -5,6 +5,8 @@ from __future__ import unicode_literals
 import sys
 import codecs
 
+__all__ = ['fsdecode', 'fsencode', 'scandir']
+
 
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
@@ -30,6 +32,23 @@ def _fscodec():
         else:
             return filename.encode(encoding, errors)
 
-    return fsencode
-fsencode = _fscodec()
+    def fsdecode(filename):
+        """
+        Decode filename from the filesystem encoding with 'surrogateescape'
+        error handler, return str unchanged. On Windows, use 'strict' error
+        handler if the file system encoding is 'mbcs' (which is the default
+        encoding).
+        """
+        if isinstance(filename, bytes):
+            return filename.decode(encoding, errors)
+        else:
+            return filename
+
+    return fsencode, fsdecode
+fsencode, fsdecode = _fscodec()
 del _fscodec
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
@@ -0,0 +1,121 @@
+"""
+Control channel of the observer command.
+
+The observer reads commands from stdin as a stream of BSON documents, each
+of the form {'command': NAME, ...}:
+
+{'command': 'snapshot'}
+    Emit all known objects of all ports as messages of type 'snapshot',
+    after the changes queued before the request.
+{'command': 'rescan', 'path': DIR}
+    Reconcile the known objects below DIR, a string naming a watched
+    directory or one below it, with the filesystem.
+{'command': 'pause'} / {'command': 'resume'}
+    Withhold messages (changes keep being collected) / continue.
+
+Invalid commands are logged and skipped, after a malformed document (e.g.,
+larger than MAX_COMMAND_SIZE) further input is discarded. The observer
+stops on EOF, i.e., when the parent closes stdin or terminates.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import struct
+from bson import BSON
+from bson.errors import InvalidBSON
+
+# Commands are small documents, anything larger is a framing error.
+MAX_COMMAND_SIZE = 1 << 16
+
+_SIZE = struct.Struct('<i')
+
+
+def _read(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_commands(stream):
+    """
+    Iterate over the command documents read from a binary stream of BSON
+    documents until EOF. Raises a ValueError if the stream is malformed.
+    """
+    while True:
+        header = _read(stream, _SIZE.size)
+        if not header:
+            return
+        if len(header) < _SIZE.size:
+            raise ValueError("Truncated command")
+
+        (size,) = _SIZE.unpack(header)
+        if size <= _SIZE.size or size > MAX_COMMAND_SIZE:
+            raise ValueError("Invalid command size {:d}".format(size))
+
+        body = _read(stream, size - _SIZE.size)
+        if len(body) < size - _SIZE.size:
+            raise ValueError("Truncated command")
+
+        try:
+            yield BSON(header + body).decode()
+        except InvalidBSON as e:
+            raise ValueError("Invalid command: {!s}".format(e))
+
+
+def execute(pipeline, command):
+    """
+    Execute a command document on an observer pipeline:
+
+    {'command': 'snapshot'}
+        Emit the known objects of all ports as snapshot messages.
+    {'command': 'rescan', 'path': DIR}
+        Reconcile the known objects below DIR with the filesystem.
+    {'command': 'pause'} / {'command': 'resume'}
+        Withhold messages (changes keep being collected) / continue.
+
+    Raises a ValueError for unknown or invalid commands.
+    """
+    name = command.get('command')
+    if name == 'snapshot':
+        pipeline.snapshot()
+    elif name == 'rescan':
+        path = command.get('path')
+        if not path:
+            raise ValueError("The rescan command requires a path")
+        # Text literals are unicode on Python 2 as well.
+        if not isinstance(path, type('')):
+            raise ValueError("The rescan path must be a string, got {!r}".format(path))
+        pipeline.rescan(path)
+    elif name == 'pause':
+        pipeline.pause()
+    elif name == 'resume':
+        pipeline.resume()
+    else:
+        raise ValueError("Unknown command {!r}".format(name))
+
+
+def serve(stream, pipeline, log):
+    """
+    Execute the commands read from stream until EOF, then stop the pipeline.
+    Invalid commands are logged and skipped. If the stream is malformed,
+    further input is ignored. The pipeline is stopped in any case, also if
+    an unexpected exception terminates the loop.
+    """
+    try:
+        for command in read_commands(stream):
+            try:
+                execute(pipeline, command)
+            except ValueError as e:
+                log("Control: {!s}".format(e))
+    except ValueError as e:
+        log("Control: {!s}, ignoring further input".format(e))
+        while stream.read(65536):
+            pass
+    finally:
+        pipeline.stop()
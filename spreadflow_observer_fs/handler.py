@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import threading
+from watchdog.events import FileSystemEventHandler, EVENT_TYPE_CREATED, \
+    EVENT_TYPE_DELETED, EVENT_TYPE_MOVED
+from spreadflow_observer_fs.batch import SubtreeChange
+from spreadflow_observer_fs.metrics import Metrics
+
+
+class EventHandler(FileSystemEventHandler):
+    """
+    Collects file events matching the given matcher and hands them over to
+    the changes queue.
+
+    Events are coalesced per path into their net effect (present or absent).
+    If a debounce interval is given, changes are accumulated for that amount
+    of time (or until max_batch paths are pending) before a single delta is
+    put onto the queue.
+
+    Directory events are reported as a single SubtreeChange instead of one
+    change per contained file. The per-file events synthesized by watchdog for
+    the contents of a moved or created directory are therefore ignored.
+    """
+
+    def __init__(self, matcher, changes_queue, debounce=0, max_batch=None, metrics=None):
+        super(EventHandler, self).__init__()
+        self._metrics = Metrics() if metrics is None else metrics
+        self._matcher = matcher
+        self._changes_queue = changes_queue
+        self._debounce = debounce
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._timer = None
+        self._changes = collections.OrderedDict()
+
+    def _record(self, path, exists):
+        self._changes.pop(path, None)
+        self._changes[path] = exists
+
+    def _schedule(self):
+        if not self._debounce or (self._max_batch and len(self._changes) >= self._max_batch):
+            self._flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(self._debounce, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def dispatch(self, event):
+        if getattr(event, 'is_synthetic', False):
+            self._metrics.incr('events_synthetic')
+            return
+        self._metrics.incr('events_' + event.event_type)
+        if event.is_directory:
+            self.on_directory(event)
+        else:
+            super(EventHandler, self).dispatch(event)
+
+    def _wants(self, dirpath):
+        return bool(dirpath) and not self._matcher.prune(dirpath)
+
+    def on_directory(self, event):
+        deleted = None
+        rescan = None
+        if event.event_type == EVENT_TYPE_MOVED:
+            deleted = event.src_path
+            if self._wants(event.dest_path):
+                rescan = event.dest_path
+        elif event.event_type == EVENT_TYPE_DELETED:
+            deleted = event.src_path
+        elif event.event_type == EVENT_TYPE_CREATED and self._wants(event.src_path):
+            rescan = event.src_path
+
+        if deleted or rescan:
+            with self._lock:
+                # Keep the order of pending file changes and the subtree.
+                self._flush()
+                self._changes_queue.put(SubtreeChange(deleted, rescan))
+
+    def on_moved(self, event):
+        with self._lock:
+            if event.src_path and self._matcher.matches(event.src_path):
+                self._record(event.src_path, False)
+            if event.dest_path and self._matcher.matches(event.dest_path):
+                self._record(event.dest_path, True)
+            self._schedule()
+
+    def on_created(self, event):
+        if self._matcher.matches(event.src_path):
+            with self._lock:
+                self._record(event.src_path, True)
+                self._schedule()
+
+    def on_deleted(self, event):
+        if self._matcher.matches(event.src_path):
+            with self._lock:
+                self._record(event.src_path, False)
+                self._schedule()
+
+    def on_modified(self, event):
+        if self._matcher.matches(event.src_path):
+            with self._lock:
+                self._record(event.src_path, True)
+                self._schedule()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if len(self._changes):
+            self._metrics.incr('handler_flushes')
+            deletes = tuple(self._changes)
+            inserts = tuple(path for path, exists in self._changes.items() if exists)
+            self._changes_queue.put((deletes, inserts))
+
+        self._changes = collections.OrderedDict()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
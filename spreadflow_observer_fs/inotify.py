@@ -0,0 +1,294 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from spreadflow_observer_fs.batch import SubtreeChange
+from spreadflow_observer_fs.compat import fsdecode, fsencode
+from spreadflow_observer_fs.metrics import Metrics
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_EVENT = struct.Struct(str('iIII'))
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+def _check(result):
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+
+def parse_events(buf):
+    """
+    Yield (wd, mask, cookie, name) tuples for the raw inotify events in buf.
+    Names are returned as bytes without padding.
+    """
+    offset = 0
+    end = len(buf)
+    while offset < end:
+        (wd, mask, cookie, length) = _EVENT.unpack_from(buf, offset)
+        offset += _EVENT.size
+        yield (wd, mask, cookie, buf[offset:offset + length].rstrip(b'\0'))
+        offset += length
+
+
+class Inotify(object):
+    """
+    Thin wrapper around a non-blocking inotify file descriptor.
+    """
+
+    def __init__(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self.fd = _check(_libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK))
+
+    def add_watch(self, path, mask):
+        return _check(_libc.inotify_add_watch(self.fd, fsencode(path), mask))
+
+    def rm_watch(self, wd):
+        _libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, size):
+        try:
+            return os.read(self.fd, size)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return b''
+            raise
+
+    def close(self):
+        os.close(self.fd)
+
+
+class InotifyObserver(object):
+    """
+    Observes directory trees with inotify (Linux only), as a lightweight
+    alternative to the watchdog observer.
+
+    A single thread reads raw events in large buffers, parses them in bulk
+    and applies the matcher. File changes are coalesced per path exactly like
+    in the EventHandler and put onto the changes queue once per read buffer
+    (or after debounce seconds, or once max_batch paths are pending).
+    Directory events are reported as SubtreeChange items.
+
+    The observer does not walk the tree itself. Instead, watch() is meant to
+    be passed to the DirectoryScanner as directory callback, such that the
+    initial scan and every subtree rescan add watches for the directories
+    they list. If the kernel event queue overflows, resync() is called. Roots
+    which are deleted are resynced once they reappear.
+    """
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+            IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+    # Size of the read buffer. Large enough for thousands of events.
+    BUFFER_SIZE = 1 << 18
+
+    # Interval in seconds between checks for lost roots.
+    TICK = 1.0
+
+    def __init__(self, matcher, roots, put, resync, debounce=0, max_batch=None,
+                 metrics=None, log=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self._matcher = matcher
+        self._put = put
+        self._resync = resync
+        self._debounce = debounce
+        self._max_batch = max_batch
+        self._metrics = Metrics() if metrics is None else metrics
+        self._log = log or (lambda message: None)
+        self._inotify = Inotify()
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._wds = {}
+        self._lost = set()
+        self._watch_failed = False
+        self._changes = collections.OrderedDict()
+        self._deadline = None
+        self._stopped = threading.Event()
+        self._wakeup = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._wds)
+
+    def watch(self, dirpath):
+        """
+        Add a watch for dirpath. Failures other than a missing directory are
+        counted (inotify_watch_errors) and logged once.
+        """
+        try:
+            wd = self._inotify.add_watch(dirpath, self.MASK)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            self._metrics.incr('inotify_watch_errors')
+            if not self._watch_failed:
+                self._watch_failed = True
+                self._log("Failed to watch {:s}: {!s} (changes below are not reported,"
+                          " check fs.inotify.max_user_watches)".format(dirpath, e))
+            return
+
+        with self._lock:
+            previous = self._paths.get(wd)
+            if previous is not None and previous != dirpath:
+                self._wds.pop(previous, None)
+            self._paths[wd] = dirpath
+            self._wds[dirpath] = wd
+
+    def _forget(self, dirpath):
+        """
+        Remove the watches of dirpath and all directories below.
+        """
+        prefix = os.path.join(dirpath, '')
+        with self._lock:
+            paths = [path for path in self._wds if path == dirpath or path.startswith(prefix)]
+            wds = [self._wds.pop(path) for path in paths]
+            for wd in wds:
+                self._paths.pop(wd, None)
+        for wd in wds:
+            self._inotify.rm_watch(wd)
+
+    def _wants(self, dirpath):
+        return not self._matcher.prune(dirpath)
+
+    def _record(self, path, exists):
+        self._changes.pop(path, None)
+        self._changes[path] = exists
+        if self._deadline is None:
+            self._deadline = time.time() + self._debounce
+
+    def _subtree(self, deleted, rescan):
+        # Keep the order of pending file changes and the subtree.
+        self._flush()
+        self._put(SubtreeChange(deleted, rescan))
+
+    def _process(self, buf):
+        count = 0
+        paths = self._paths
+        matches = self._matcher.matches
+        for (wd, mask, _, name) in parse_events(buf):
+            count += 1
+            dirpath = paths.get(wd)
+            if dirpath is None:
+                if mask & IN_Q_OVERFLOW:
+                    self._metrics.incr('inotify_overflows')
+                    self._flush()
+                    self._resync(None, "inotify event queue overflow")
+                continue
+
+            if not name:
+                if mask & IN_IGNORED:
+                    with self._lock:
+                        if self._paths.pop(wd, None) is not None:
+                            self._wds.pop(dirpath, None)
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF) and dirpath in self.roots:
+                    self._forget(dirpath)
+                    self._lost.add(dirpath)
+                    self._subtree(dirpath, None)
+                continue
+
+            path = dirpath + os.sep + fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_MOVED_FROM | IN_DELETE):
+                    self._forget(path)
+                    self._subtree(path, None)
+                elif mask & (IN_MOVED_TO | IN_CREATE) and self._wants(path):
+                    self._subtree(None, path)
+            elif matches(path):
+                self._record(path, not mask & (IN_MOVED_FROM | IN_DELETE))
+
+        self._metrics.incr('inotify_reads')
+        self._metrics.incr('inotify_events', count)
+
+    def _flush(self):
+        self._deadline = None
+        if len(self._changes):
+            self._metrics.incr('handler_flushes')
+            deletes = tuple(self._changes)
+            inserts = tuple(path for path, exists in self._changes.items() if exists)
+            self._put((deletes, inserts))
+            self._changes = collections.OrderedDict()
+
+    def _restore(self):
+        for root in sorted(self._lost):
+            if os.path.isdir(root):
+                self._lost.discard(root)
+                self._resync(root, "watched directory restored")
+
+    def _run(self):
+        fd = self._inotify.fd
+        checked = time.time()
+        while not self._stopped.is_set():
+            now = time.time()
+            timeout = self.TICK if self._deadline is None else max(0, self._deadline - now)
+            readable = select.select([fd, self._wakeup[0]], [], [], timeout)[0]
+            if fd in readable:
+                self._process(self._inotify.read(self.BUFFER_SIZE))
+
+            now = time.time()
+            if self._changes and (now >= self._deadline or
+                                  (self._max_batch and len(self._changes) >= self._max_batch)):
+                self._flush()
+
+            if self._lost and now - checked >= self.TICK:
+                checked = now
+                self._restore()
+
+        self._flush()
+
+    def start(self):
+        self._wakeup = os.pipe()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            os.write(self._wakeup[1], b'\0')
+            self._thread.join()
+            self._thread = None
+            for fd in self._wakeup:
+                os.close(fd)
+        self._inotify.close()
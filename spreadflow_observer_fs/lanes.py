@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import collections
+import threading
+import time
+
+
+class Lanes(object):
+    """
+    Queue with one FIFO lane per priority. get() returns the oldest item of
+    the first non-empty lane, such that items of a lane are never delayed by
+    items queued later on a lower priority lane.
+
+    Live changes reported by the observer go to the LIVE lane (the default
+    of put()), resyncs to the RESYNC lane and the initial scan to the BULK
+    lane.
+    """
+
+    LIVE = 0
+    RESYNC = 1
+    BULK = 2
+
+    NAMES = ('live', 'resync', 'bulk')
+    ALL = (LIVE, RESYNC, BULK)
+
+    def __init__(self):
+        self._lanes = [collections.deque() for _ in self.NAMES]
+        self._cond = threading.Condition()
+
+    def put(self, item, lane=LIVE):
+        with self._cond:
+            self._lanes[lane].append(item)
+            self._cond.notify()
+
+    def _pop(self, lanes):
+        for lane in lanes:
+            if self._lanes[lane]:
+                return (lane, self._lanes[lane].popleft())
+        return None
+
+    def get(self, lanes=ALL, timeout=None):
+        """
+        Remove and return a (lane, item) tuple from the first non-empty lane
+        among lanes. Raises queue.Empty if none becomes available within
+        timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                result = self._pop(lanes)
+                if result is not None:
+                    return result
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+
+    def get_nowait(self, lanes=ALL):
+        with self._cond:
+            result = self._pop(lanes)
+        if result is None:
+            raise queue.Empty
+        return result
+
+    def qsize(self, lane=None):
+        if lane is None:
+            return sum(len(items) for items in self._lanes)
+        return len(self._lanes[lane])
@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import fnmatch
+import re
+
+# Patterns of the form '*<literal>' or '*/*<literal>' are evaluated with a
+# plain suffix comparison instead of a regular expression.
+_SUFFIX_PATTERN = re.compile(r'^\*(/\*)?([^*?\[\]]+)$')
+
+
+def _compile(patterns, case_sensitive):
+    if not patterns:
+        return None
+    flags = 0 if case_sensitive else re.IGNORECASE
+    return re.compile('|'.join('(?:{:s})'.format(fnmatch.translate(p)) for p in patterns), flags)
+
+
+class PatternMatcher(object):
+    """
+    Matches file paths against include and exclude patterns and decides
+    whether a directory can be skipped entirely.
+
+    Patterns use the same fnmatch semantics as pathtools.patterns.match_path
+    (i.e., '*' also matches '/'). All patterns of a set are compiled once
+    into a single regular expression, simple suffix patterns like '*/*.txt'
+    are checked without regular expressions at all.
+    """
+
+    def __init__(self, patterns, exclude_dirs=None, exclude_patterns=None, case_sensitive=False):
+        self.patterns = list(patterns)
+        self.exclude_dirs = list(exclude_dirs or [])
+        self.exclude_patterns = list(exclude_patterns or [])
+        self.case_sensitive = case_sensitive
+
+        self._suffixes = []
+        self._slash_suffixes = []
+        regex_patterns = []
+        for pattern in self.patterns:
+            m = _SUFFIX_PATTERN.match(pattern)
+            if m is None:
+                regex_patterns.append(pattern)
+            else:
+                suffix = m.group(2) if case_sensitive else m.group(2).lower()
+                (self._slash_suffixes if m.group(1) else self._suffixes).append(suffix)
+
+        self._suffixes = tuple(self._suffixes)
+        self._slash_suffixes = tuple(self._slash_suffixes)
+        self._include = _compile(regex_patterns, case_sensitive)
+        self._exclude = _compile(self.exclude_patterns + [d + '/*' for d in self.exclude_dirs], case_sensitive)
+        self._prune = _compile(self.exclude_dirs, case_sensitive)
+
+    def _included(self, path):
+        if self._suffixes or self._slash_suffixes:
+            folded = path if self.case_sensitive else path.lower()
+            if self._suffixes and folded.endswith(self._suffixes):
+                return True
+            if self._slash_suffixes and folded.endswith(self._slash_suffixes):
+                for suffix in self._slash_suffixes:
+                    if folded.endswith(suffix) and folded.rfind('/', 0, len(folded) - len(suffix)) >= 0:
+                        return True
+
+        return self._include is not None and self._include.match(path) is not None
+
+    def matches(self, path):
+        return self._included(path) and (self._exclude is None or self._exclude.match(path) is None)
+
+    def prune(self, dirpath):
+        return self._prune is not None and self._prune.match(dirpath) is not None
@@ -0,0 +1,171 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import contextlib
+import threading
+import time
+
+
+class Histogram(object):
+    """
+    Latency histogram with power of two buckets (in microseconds). Bucket i
+    counts observations below 2**i microseconds.
+    """
+
+    BUCKETS = 40
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.BUCKETS
+
+    def observe(self, seconds):
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        Return an upper bound for the given percentile (0..1) in seconds.
+        """
+        rank = fraction * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self.buckets):
+            cumulative += count
+            if count and cumulative >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class Metrics(object):
+    """
+    Counters, gauges and latency histograms of the observer stages.
+
+    Counters are incremented with incr(), latencies recorded with observe()
+    or the timer() context manager. Gauges are callables evaluated when a
+    snapshot is taken. All methods may be called from any thread. Signal
+    handlers should use MetricsDump instead of calling them directly.
+    """
+
+    def __init__(self):
+        # Reentrant, such that code interrupted by a signal handler on the
+        # same thread cannot deadlock it.
+        self._lock = threading.RLock()
+        self._started = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def gauge(self, name, func):
+        with self._lock:
+            self._gauges[name] = func
+
+    def snapshot(self):
+        """
+        Return a dict with the current value of all counters, gauges and
+        histograms.
+        """
+        with self._lock:
+            gauges = list(self._gauges.items())
+            snapshot = {
+                'uptime': time.time() - self._started,
+                'counters': dict(self._counters),
+                'histograms': dict((name, histogram.snapshot())
+                                   for name, histogram in self._histograms.items()),
+            }
+
+        snapshot['gauges'] = dict((name, func()) for name, func in gauges)
+        return snapshot
+
+    def format(self):
+        """
+        Return the current values as human readable text.
+        """
+        snapshot = self.snapshot()
+        lines = ["Metrics after {:.0f}s".format(snapshot['uptime'])]
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append("  {:s}: {:d}".format(name, value))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append("  {:s}: {!s}".format(name, value))
+        for name, h in sorted(snapshot['histograms'].items()):
+            lines.append("  {:s}: count={:d} avg={:.6f}s p50<={:.6f}s p90<={:.6f}s p99<={:.6f}s max={:.6f}s".format(
+                name, h['count'], h['sum'] / h['count'] if h['count'] else 0,
+                h['p50'], h['p90'], h['p99'], h['max']))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsDump(object):
+    """
+    Writes the formatted metrics to a stream from a separate thread each
+    time request() is called.
+
+    request() only sets an event and may be called from a signal handler.
+    Signal handlers run on the main thread between bytecodes, possibly while
+    it is updating the metrics, and must not format them directly.
+    """
+
+    def __init__(self, metrics, out):
+        self.metrics = metrics
+        self._out = out
+        self._requested = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def request(self, *args):
+        self._requested.set()
+
+    def _run(self):
+        while True:
+            self._requested.wait()
+            self._requested.clear()
+            if self._closed:
+                return
+            self._out.write(self.metrics.format())
+            self._out.flush()
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._closed = True
+        self._requested.set()
+        self._thread.join()
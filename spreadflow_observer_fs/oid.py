@@ -0,0 +1,165 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import hashlib
+import struct
+from multiprocessing.pool import ThreadPool
+from spreadflow_observer_fs.compat import fsencode
+
+try:
+    _blake2b = hashlib.blake2b #pylint: disable=no-member
+except AttributeError:
+    _blake2b = None
+
+
+def _digest(data):
+    if _blake2b is not None:
+        return _blake2b(data, digest_size=20).hexdigest()
+    else:
+        return hashlib.sha1(data).hexdigest()
+
+
+# Fields of tuple(os.stat(...)) which go into the stat based oid: mode, ino,
+# dev, nlink, uid, gid, size, mtime and ctime. The access time is left out on
+# purpose, reading a file must not change its oid.
+_STAT_STRUCT = struct.Struct('<I7Q2q')
+_PATH_STRUCT = struct.Struct('<I')
+
+
+def _pack(meta):
+    path = fsencode(meta['path'])
+    stat = meta.get('stat')
+    if stat is None or len(stat) < 10:
+        return _PATH_STRUCT.pack(len(path)) + path + repr(stat).encode('utf-8')
+    (mode, ino, dev, nlink, uid, gid, size, _, mtime, ctime) = stat[:10]
+    return _STAT_STRUCT.pack(len(path), mode, ino, dev, nlink, uid, gid,
+                             size, mtime, ctime) + path
+
+
+class LegacyOidGenerator(object):
+    """
+    SHA1 over the repr of the metadata dict (oids of previous releases).
+    """
+
+    name = 'legacy'
+
+    def __call__(self, metadata):
+        return tuple(hashlib.sha1(repr(meta).encode('utf-8')).hexdigest() for meta in metadata)
+
+    def close(self):
+        pass
+
+
+class StatOidGenerator(object):
+    """
+    Hash over a fixed-layout packing of the path and selected stat fields.
+    """
+
+    name = 'stat'
+
+    def __call__(self, metadata):
+        return tuple(_digest(_pack(meta)) for meta in metadata)
+
+    def close(self):
+        pass
+
+
+class ContentOidGenerator(object):
+    """
+    Hash over the path and the file contents.
+
+    Contents are read in large blocks on a pool of worker threads. Content
+    digests are cached by (dev, ino, mtime, size), such that files which are
+    touched but not changed retain their oid without being read again. Files
+    which cannot be read fall back to the stat based oid.
+    """
+
+    name = 'content'
+
+    def __init__(self, workers=4, cache_size=100000, block_size=1 << 20):
+        self.workers = max(1, workers)
+        self.cache_size = cache_size
+        self.block_size = block_size
+        self._cache = collections.OrderedDict()
+        self._pool = ThreadPool(self.workers) if self.workers > 1 else None
+
+    def _cache_key(self, meta):
+        stat = meta.get('stat')
+        if not stat or len(stat) < 9:
+            return None
+        return (stat[2], stat[1], stat[8], stat[6])
+
+    def _hash_file(self, path):
+        if _blake2b is not None:
+            h = _blake2b(digest_size=20)
+        else:
+            h = hashlib.sha1()
+        try:
+            with open(path, 'rb') as stream:
+                while True:
+                    block = stream.read(self.block_size)
+                    if not block:
+                        break
+                    h.update(block)
+        except (IOError, OSError):
+            return None
+        return h.digest()
+
+    def _content_digests(self, metadata):
+        digests = [None] * len(metadata)
+        missing = []
+        for i, meta in enumerate(metadata):
+            key = self._cache_key(meta)
+            digest = self._cache.get(key) if key is not None else None
+            if digest is None:
+                missing.append(i)
+            else:
+                self._cache.pop(key)
+                self._cache[key] = digest
+                digests[i] = digest
+
+        paths = [metadata[i]['path'] for i in missing]
+        if self._pool is not None and len(paths) > 1:
+            results = self._pool.map(self._hash_file, paths)
+        else:
+            results = [self._hash_file(path) for path in paths]
+
+        for i, digest in zip(missing, results):
+            digests[i] = digest
+            key = self._cache_key(metadata[i])
+            if digest is not None and key is not None and self.cache_size:
+                self._cache[key] = digest
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return digests
+
+    def __call__(self, metadata):
+        oids = []
+        for meta, digest in zip(metadata, self._content_digests(metadata)):
+            if digest is None:
+                oids.append(_digest(_pack(meta)))
+            else:
+                path = fsencode(meta['path'])
+                oids.append(_digest(_PATH_STRUCT.pack(len(path)) + path + digest))
+        return tuple(oids)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+
+OID_GENERATORS = {
+    'legacy': LegacyOidGenerator,
+    'stat': StatOidGenerator,
+    'content': ContentOidGenerator,
+}
+
+
+def create_oid_generator(name, hash_workers=4, hash_cache=100000):
+    if name == 'content':
+        return ContentOidGenerator(workers=hash_workers, cache_size=hash_cache)
+    return OID_GENERATORS[name]()
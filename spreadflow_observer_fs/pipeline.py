@@ -0,0 +1,641 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import collections
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from bson import BSON
+from spreadflow_observer_fs.batch import ChangeSet, ScanChunk, ScanFilter, StatPool, SubtreeChange
+from spreadflow_observer_fs.handler import EventHandler
+from spreadflow_observer_fs.inotify import InotifyObserver
+from spreadflow_observer_fs.lanes import Lanes
+from spreadflow_observer_fs.metrics import Metrics
+from spreadflow_observer_fs.oid import create_oid_generator
+from spreadflow_observer_fs.poller import DirectoryPoller, RateLimiter
+from spreadflow_observer_fs.protocol import MessageFactory
+from spreadflow_observer_fs.scanner import DirectoryScanner
+from spreadflow_observer_fs.shard import ShardPool
+from spreadflow_observer_fs.state import StateFile
+
+
+def _log_stderr(message):
+    sys.stderr.write(message + '\n')
+    sys.stderr.flush()
+
+
+class ObserverPipeline(object):
+    """
+    Observes the directories of a watch set and emits delta messages.
+
+    Runs the watchdog observer (or the directory poller if a poll interval is
+    set), the initial scan, the stat stage and one message factory per port.
+    The initial scan runs in a separate thread and streams its results in
+    chunks of at most stat_batch paths, with at most scan_queue chunks
+    waiting. Scan results for paths changed by live events in the meantime
+    are dropped. The poller is started once the initial scan completed.
+
+    Queue items are scheduled by priority (see Lanes): live changes first,
+    then resyncs, then the initial scan. A batch holds the pending live
+    changes (up to stat_batch paths) and at most one resync or scan chunk,
+    such that a live change waits for at most one chunk of backlog work.
+    Reporting of the initial scan can be limited to bulk_rate paths per
+    second.
+    Messages are passed to the emit callable, encoded with the given encoder
+    (BSON by default, None for plain dicts). The run() method blocks until
+    stop() is called from another thread.
+
+    Options correspond to the command line arguments of the observer script
+    and may be passed as keyword arguments. Options set to None keep their
+    default value.
+
+    With the inotify engine, the built-in InotifyObserver replaces the
+    watchdog observer (Linux only). Its watches are added by the initial scan
+    and by subtree rescans.
+
+    With more than one shard, stat calls, oid generation, repository updates
+    and message encoding are distributed over a pool of worker processes,
+    each owning a slice of the repositories (see ShardPool). The state file
+    and the poller rely on the repositories of the pipeline process and are
+    not available in this mode.
+
+    The pipeline can be controlled while running (see control.py): snapshot()
+    emits all known objects as messages of type 'snapshot', rescan()
+    resyncs a subtree and pause() withholds messages until resume() is
+    called. Snapshots are emitted in order with the deltas, after the live
+    changes queued before the request. They are not available with multiple
+    shards.
+
+    Event emitters of the observer which stopped unexpectedly (e.g., due to
+    an error) are restarted and their directory is resynced. The number of
+    resyncs is available in the resyncs attribute.
+
+    Counters, gauges and latency histograms of all stages are collected in
+    the metrics attribute. If a metrics interval is set, a snapshot is
+    emitted as a message of type 'metrics' on the metrics port, written to
+    the metrics file (as JSON) or logged.
+    """
+
+    # Interval in seconds between checks for stopped event emitters.
+    MONITOR_INTERVAL = 1.0
+
+    ENGINES = ('watchdog', 'inotify')
+
+    engine = 'watchdog'
+    observer_class = None
+    debounce_ms = 0
+    max_batch = 1000
+    scan_workers = 1
+    scan_queue = 16
+    bulk_rate = 0
+    state_file = None
+    state_interval = 300
+    stat_workers = 1
+    stat_batch = 1000
+    chunk_size = MessageFactory.CHUNK_SIZE
+    chunk_bytes = MessageFactory.CHUNK_BYTES
+    oid = 'stat'
+    hash_workers = 4
+    hash_cache = 100000
+    detect_renames = False
+    fragment_cache = False
+    poll_interval = 0
+    poll_rate = 0
+    poll_workers = 1
+    metrics_interval = 0
+    metrics_port = None
+    metrics_file = None
+    shards = 1
+    shard_key = 'path'
+
+    def __init__(self, watch_set, emit, encoder=BSON.encode, log=_log_stderr, **options):
+        for key, value in options.items():
+            if not hasattr(type(self), key):
+                raise TypeError("Unknown option {!r}".format(key))
+            if value is not None:
+                setattr(self, key, value)
+
+        if self.engine not in self.ENGINES:
+            raise ValueError("Unknown engine {!r}".format(self.engine))
+        if self.shards > 1 and (self.state_file or self.poll_interval):
+            raise ValueError("The state file and polling are not supported with multiple shards")
+
+        self.watch_set = watch_set
+        self.encoder = encoder
+        self._emit = emit
+        self._log = log
+        self._changes_queue = Lanes()
+        self._stop_sentinel = object()
+        self._scan_done_sentinel = object()
+        self._snapshot_sentinel = object()
+        self._snapshot_pending = False
+        self._stopping = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        # Holds one token per scan chunk waiting in the changes queue.
+        self._scan_slots = queue.Queue(maxsize=max(1, self.scan_queue))
+        self._scan_filter = None
+        self._bulk_limiter = RateLimiter(self.bulk_rate)
+        self._watch_directory = None
+        self.metrics = Metrics()
+        self.metrics.gauge('queue_depth', self._changes_queue.qsize)
+        for lane, name in enumerate(Lanes.NAMES):
+            self.metrics.gauge('queue_depth_' + name, lambda lane=lane: self._changes_queue.qsize(lane))
+        self.metrics.gauge('scan_queue_depth', self._scan_slots.qsize)
+        self.metrics.gauge('paused', lambda: self.paused)
+
+    @property
+    def resyncs(self):
+        return self.metrics.counter('resyncs')
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def stop(self):
+        self._stopping.set()
+        self._changes_queue.put(self._stop_sentinel)
+
+    def pause(self):
+        """
+        Withhold messages until resume() is called. Changes are queued in
+        the meantime, the initial scan blocks once its queue is full.
+        """
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def snapshot(self):
+        """
+        Request a snapshot of the known objects of all ports. Emitted after
+        the changes queued so far.
+        """
+        if self.shards > 1:
+            raise ValueError("Snapshots are not supported with multiple shards")
+        self._changes_queue.put(self._snapshot_sentinel)
+
+    def rescan(self, dirpath):
+        """
+        Resync the directory dirpath, which must be one of the roots or below
+        one of them.
+        """
+        dirpath = os.path.abspath(dirpath)
+        for root in self.watch_set.roots():
+            if dirpath == root or dirpath.startswith(os.path.join(root, '')):
+                self.resync(dirpath, "requested")
+                return
+        raise ValueError("Not below a watched directory: {:s}".format(dirpath))
+
+    def resync(self, dirpath=None, reason=None):
+        """
+        Reconcile the known entries below dirpath (all roots if None) with
+        the current contents of the directory, e.g., after events were lost.
+        Only the actual differences are reported.
+        """
+        directories = self.watch_set.roots() if dirpath is None else [dirpath]
+        self.metrics.incr('resyncs')
+        self._log("Resync of {:s}{:s}".format(", ".join(directories),
+                                              " ({:s})".format(reason) if reason else ""))
+        for directory in directories:
+            self._changes_queue.put(SubtreeChange(directory, directory), Lanes.RESYNC)
+
+    def _monitor(self, observer, event_handler, stopped):
+        """
+        Restart the watches of event emitters which are no longer running and
+        resync their directories. Watches which cannot be scheduled again
+        (e.g., because the directory is gone) are retried periodically.
+        """
+        lost = set()
+        while not stopped.wait(self.MONITOR_INTERVAL):
+            for emitter in list(observer.emitters):
+                if emitter.is_alive():
+                    continue
+                path = emitter.watch.path
+                self._log("Event emitter for {:s} stopped".format(path))
+                lost.add(path)
+                try:
+                    observer.unschedule(emitter.watch)
+                except (KeyError, OSError):
+                    pass
+
+            for path in sorted(lost):
+                try:
+                    observer.schedule(event_handler, path, recursive=True)
+                except OSError:
+                    continue
+                lost.discard(path)
+                self.resync(path, "event emitter restarted")
+
+    def _create_observer(self):
+        observer_class = self.observer_class
+        if observer_class is None:
+            from watchdog.observers import Observer as observer_class
+        return observer_class()
+
+    def _start_observer(self):
+        """
+        Start the watchdog observer and the emitter monitor. Returns a
+        function which stops both.
+        """
+        event_handler = EventHandler(self.watch_set, self._changes_queue,
+                                     debounce=self.debounce_ms / 1000,
+                                     max_batch=self.max_batch,
+                                     metrics=self.metrics)
+
+        observer = self._create_observer()
+        for root in self.watch_set.roots():
+            observer.schedule(event_handler, root, recursive=True)
+        observer.start()
+
+        monitor_stopped = threading.Event()
+        monitor_thread = threading.Thread(target=self._monitor,
+                                          args=(observer, event_handler, monitor_stopped))
+        monitor_thread.daemon = True
+        monitor_thread.start()
+
+        def stop():
+            monitor_stopped.set()
+            monitor_thread.join()
+            observer.stop()
+            observer.join()
+            event_handler.flush()
+
+        return stop
+
+    def _start_inotify(self):
+        """
+        Start the inotify engine. Returns a function which stops it.
+        """
+        observer = InotifyObserver(self.watch_set, self.watch_set.roots(),
+                                   self._changes_queue.put, self.resync,
+                                   debounce=self.debounce_ms / 1000,
+                                   max_batch=self.max_batch,
+                                   metrics=self.metrics, log=self._log)
+        self._watch_directory = observer.watch
+        self.metrics.gauge('inotify_watches', lambda: len(observer))
+        observer.start()
+        return observer.stop
+
+    def _start_poller(self, factories):
+        """
+        Start the directory poller on top of the repositories of the given
+        factories. Returns a function which stops it.
+        """
+        def lookup(dirpath):
+            known = {}
+            known_subdirs = set()
+            for factory in factories.values():
+                known.update(factory.fingerprints(dirpath))
+                known_subdirs.update(factory.subdirs(dirpath))
+            return (known, known_subdirs)
+
+        poller = DirectoryPoller(self.watch_set, self.watch_set.roots(), lookup,
+                                 self._changes_queue.put, self.poll_interval,
+                                 rate=self.poll_rate, workers=self.poll_workers,
+                                 log=self._log)
+        self.metrics.gauge('poll_passes', lambda: poller.passes)
+        self.metrics.gauge('poll_last', lambda: str(poller.stats) if poller.stats else None)
+        poller.start()
+        return poller.stop
+
+    def _metrics_message(self):
+        msg = {
+            'port': self.metrics_port,
+            'item': {
+                'type': 'metrics',
+                'date': datetime.datetime.now(),
+                'metrics': self.metrics.snapshot(),
+            }
+        }
+        return self.encoder(msg) if self.encoder else msg
+
+    def _write_metrics(self):
+        tmppath = self.metrics_file + '.tmp'
+        with open(tmppath, 'w') as stream:
+            json.dump(self.metrics.snapshot(), stream, sort_keys=True)
+        os.rename(tmppath, self.metrics_file)
+
+    def report_metrics(self):
+        """
+        Emit a metrics message on the metrics port and/or write the metrics
+        file. If neither is configured, the metrics are logged.
+        """
+        if self.metrics_port:
+            self._emit(self._metrics_message())
+        if self.metrics_file:
+            try:
+                self._write_metrics()
+            except (IOError, OSError) as e:
+                self._log("Failed to write metrics file: {!s}".format(e))
+        if not self.metrics_port and not self.metrics_file:
+            self._log(self.metrics.format().rstrip())
+
+    def _start_metrics(self):
+        """
+        Start reporting metrics every metrics_interval seconds. Returns a
+        function which stops it.
+        """
+        stopped = threading.Event()
+
+        def report():
+            while not stopped.wait(self.metrics_interval):
+                self.report_metrics()
+
+        thread = threading.Thread(target=report)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            stopped.set()
+            thread.join()
+
+        return stop
+
+    def _start_shards(self):
+        """
+        Start the shard worker processes. Returns the pool.
+        """
+        def on_failure(index):
+            self._log("Shard worker {:d} terminated unexpectedly".format(index))
+            self.stop()
+
+        options = {
+            'chunk_size': self.chunk_size,
+            'chunk_bytes': self.chunk_bytes,
+            'oid': self.oid,
+            'hash_workers': self.hash_workers,
+            'hash_cache': self.hash_cache,
+            'detect_renames': self.detect_renames,
+            'stat_workers': self.stat_workers,
+        }
+        pool = ShardPool(self.shards, self.watch_set, self._emit, self.encoder, options,
+                         key=self.shard_key, on_failure=on_failure)
+        pool.start()
+        return pool
+
+    def _create_oid_generator(self):
+        return create_oid_generator(self.oid, self.hash_workers, self.hash_cache)
+
+    def _create_state(self, oid_generator):
+        if not self.state_file:
+            return None
+        return StateFile(self.state_file,
+                         [(w.port, w.directory, w.matcher.patterns, w.matcher.exclude_patterns, w.matcher.exclude_dirs)
+                          for w in self.watch_set.watches],
+                         oid=oid_generator.name)
+
+    def _save_state(self, state, factories):
+        state.save(dict((port, factory.snapshot()) for port, factory in factories.items()))
+
+    def _start_scan(self, known_paths):
+        """
+        Start the initial scan in a separate thread. Returns a function which
+        stops it.
+        """
+        stopped = threading.Event()
+        scanner = DirectoryScanner(self.watch_set, workers=self.scan_workers,
+                                   directory_callback=self._watch_directory)
+        seen_lock = threading.Lock()
+
+        def put_chunk(paths, stats):
+            while True:
+                try:
+                    self._scan_slots.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    if stopped.is_set():
+                        return
+            self._changes_queue.put(ScanChunk(paths, stats), Lanes.BULK)
+
+        def scan_callback(paths, stats):
+            if known_paths:
+                with seen_lock:
+                    known_paths.difference_update(paths)
+            for i in range(0, len(paths), self.stat_batch):
+                put_chunk(paths[i:i + self.stat_batch], stats[i:i + self.stat_batch])
+
+        def scan():
+            scan_stats = scanner.scan(self.watch_set.roots(), scan_callback)
+            if stopped.is_set():
+                return
+
+            self._log("Initial scan: {!s}".format(scan_stats))
+            self.metrics.incr('scan_entries', scan_stats.entries)
+            self.metrics.observe('scan', scan_stats.elapsed)
+
+            # Paths restored from the state file but not seen during the scan
+            # are checked again by the consumer. Those still missing get
+            # deleted.
+            if known_paths:
+                stale_paths = tuple(known_paths)
+                self._changes_queue.put((stale_paths, stale_paths), Lanes.BULK)
+            self._changes_queue.put(self._scan_done_sentinel, Lanes.BULK)
+
+        thread = threading.Thread(target=scan)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            stopped.set()
+            scanner.cancel()
+            thread.join()
+
+        return stop
+
+    def _add_subtree(self, changes, subtree, factories):
+        """
+        Expand a subtree change: delete all known and pending paths below the
+        removed directory and rescan the new one in a single pass.
+        """
+        if subtree.deleted:
+            deletes = set(changes.subtree(subtree.deleted))
+            for factory in factories.values():
+                deletes.update(factory.subtree(subtree.deleted))
+            changes.add(tuple(deletes), ())
+            changes.deleted_subtrees.append(subtree.deleted)
+
+        if subtree.rescan:
+            results = []
+            def scan_callback(paths, stats):
+                results.append((paths, stats))
+
+            scanner = DirectoryScanner(self.watch_set, workers=self.scan_workers,
+                                       directory_callback=self._watch_directory)
+            with self.metrics.timer('subtree_rescan'):
+                scanner.scan([subtree.rescan], scan_callback)
+            for paths, stats in results:
+                changes.add((), paths, stats)
+
+    def _next_batch(self, factories):
+        """
+        Drain pending queue items into one batch. Queue items are tuples of
+        (deletes, inserts) and optionally a tuple of stat results for the
+        inserts (from the poller), chunks of initial scan results, or subtree
+        changes for directory events. Returns a (changes, stop) tuple.
+        """
+        delay = self._bulk_limiter.delay()
+        lanes = (Lanes.LIVE, Lanes.RESYNC) if delay else Lanes.ALL
+        (lane, item) = self._changes_queue.get(lanes, timeout=delay or 1000)
+
+        changes = ChangeSet()
+        while True:
+            if item is self._stop_sentinel:
+                return (changes, True)
+
+            if item is self._snapshot_sentinel:
+                # Emit the batch collected so far before the snapshot.
+                self._snapshot_pending = True
+                return (changes, False)
+
+            if item is self._scan_done_sentinel:
+                self._scan_filter = None
+            elif isinstance(item, ScanChunk):
+                self._scan_slots.get_nowait()
+                (paths, stats) = self._scan_filter.filter(item)
+                self.metrics.incr('scan_stale', len(item.paths) - len(paths))
+                changes.add((), paths, stats)
+            elif isinstance(item, SubtreeChange):
+                if self._scan_filter is not None:
+                    self._scan_filter.live_subtree(item)
+                self._add_subtree(changes, item, factories)
+            else:
+                if self._scan_filter is not None:
+                    self._scan_filter.live(item[0])
+                    self._scan_filter.live(item[1])
+                changes.add(*item)
+
+            if lane == Lanes.BULK and isinstance(item, ScanChunk):
+                self._bulk_limiter.reserve(len(item.paths))
+            if lane != Lanes.LIVE:
+                # At most one item of backlog work per batch.
+                self.metrics.incr('batch_backlog_items')
+                lanes = (Lanes.LIVE,)
+
+            if len(changes) >= self.stat_batch:
+                return (changes, False)
+            try:
+                (lane, item) = self._changes_queue.get_nowait(lanes)
+            except queue.Empty:
+                return (changes, False)
+
+    def _wait_resumed(self):
+        """
+        Block while paused. Returns False if the pipeline is stopped in the
+        meantime.
+        """
+        self.metrics.incr('pauses')
+        with self.metrics.timer('paused_time'):
+            while not self._resumed.wait(0.1):
+                if self._stopping.is_set():
+                    return False
+        return True
+
+    def _emit_snapshot(self, factories):
+        self._snapshot_pending = False
+        self.metrics.incr('snapshots')
+        with self.metrics.timer('snapshot'):
+            for factory in factories.values():
+                for msg in factory.dump():
+                    self._emit(msg)
+
+    def run(self):
+        stop_watching = None
+        if self.engine == 'inotify' and not self.poll_interval:
+            stop_watching = self._start_inotify()
+        elif not self.poll_interval:
+            stop_watching = self._start_observer()
+
+        # With multiple shards, the repositories live in the worker processes.
+        shard_pool = None
+        oid_generator = None
+        factories = collections.OrderedDict()
+        if self.shards > 1:
+            shard_pool = self._start_shards()
+            self.metrics.gauge('repository_entries', lambda: len(shard_pool))
+        else:
+            oid_generator = self._create_oid_generator()
+            factories.update(
+                (port, MessageFactory(port, chunk_size=self.chunk_size,
+                                      chunk_bytes=self.chunk_bytes,
+                                      oid_generator=oid_generator,
+                                      encoder=self.encoder,
+                                      detect_renames=self.detect_renames,
+                                      metrics=self.metrics,
+                                      fragment_cache=self.fragment_cache))
+                for port in self.watch_set.ports)
+            self.metrics.gauge('repository_entries', lambda: sum(len(f) for f in factories.values()))
+
+        state = self._create_state(oid_generator)
+        known_paths = set()
+        if state:
+            snapshots = state.load()
+            for port, factory in factories.items():
+                factory.restore(snapshots.get(port, ()))
+                known_paths.update(factory.paths())
+
+        self._scan_filter = ScanFilter()
+        stop_scan = self._start_scan(known_paths)
+
+        state_saved = time.time()
+
+        stat_pool = StatPool(self.stat_workers, metrics=self.metrics)
+        stop_metrics = self._start_metrics() if self.metrics_interval else None
+
+        try:
+            stop = False
+            while not stop:
+                try:
+                    (changes, stop) = self._next_batch(factories)
+                    if self.paused and not self._wait_resumed():
+                        break
+                    self.metrics.incr('batches')
+                    self.metrics.incr('batch_paths', len(changes))
+                    if shard_pool is not None:
+                        with self.metrics.timer('batch_submit'):
+                            shard_pool.submit(changes)
+                        continue
+
+                    with self.metrics.timer('batch_resolve'):
+                        (deletable_paths, insertable_paths, insertable_meta) = changes.resolve(stat_pool)
+
+                    with self.metrics.timer('batch_update'):
+                        for port, deletes, inserts, meta in self.watch_set.route(deletable_paths, insertable_paths, insertable_meta):
+                            for msg in factories[port].update(deletes, inserts, meta):
+                                self._emit(msg)
+
+                    if self._snapshot_pending:
+                        self._emit_snapshot(factories)
+
+                    if state and time.time() - state_saved > self.state_interval:
+                        self._save_state(state, factories)
+                        state_saved = time.time()
+
+                    if self.poll_interval and stop_watching is None and self._scan_filter is None:
+                        stop_watching = self._start_poller(factories)
+                except queue.Empty:
+                    pass
+                except KeyboardInterrupt:
+                    break
+        finally:
+            stop_scan()
+            if shard_pool is not None:
+                shard_pool.close()
+            if stop_metrics:
+                stop_metrics()
+            stat_pool.close()
+            if oid_generator is not None:
+                oid_generator.close()
+            if stop_watching:
+                stop_watching()
+
+        if state:
+            self._save_state(state, factories)
@@ -0,0 +1,294 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import os
+import threading
+import time
+from spreadflow_observer_fs.batch import SubtreeChange
+from spreadflow_observer_fs.compat import scandir
+
+
+def _fingerprint_changed(fingerprint, st):
+    """
+    Compare a stat result to a stat fingerprint, ignoring the access time.
+    """
+    if fingerprint is None:
+        return True
+    current = tuple(st)
+    return current[:7] != tuple(fingerprint[:7]) or current[8:] != tuple(fingerprint[8:])
+
+
+class RateLimiter(object):
+    """
+    Spaces out operations such that no more than rate operations per second
+    are performed on average. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def reserve(self, count=1):
+        """
+        Reserve count operations and return the number of seconds to wait
+        before performing them.
+        """
+        if not self.rate or not count:
+            return 0
+        with self._lock:
+            now = time.time()
+            start = max(self._next, now)
+            self._next = start + count / self.rate
+        return start - now
+
+    def delay(self):
+        """
+        Return the number of seconds until operations may be performed
+        again without waiting.
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            return max(0, self._next - time.time())
+
+
+class PollStatistics(object):
+
+    def __init__(self):
+        self.directories = 0
+        self.unchanged = 0
+        self.stats = 0
+        self.changes = 0
+        self.errors = 0
+        self.elapsed = 0
+
+    def __str__(self):
+        return "{:d} directories ({:d} unchanged), {:d} stat calls, {:d} changes, {:d} errors in {:.2f}s".format(
+            self.directories, self.unchanged, self.stats, self.changes, self.errors, self.elapsed)
+
+
+class DirectoryPoller(object):
+    """
+    Periodically detects changes below the given roots without relying on
+    filesystem events, e.g., on network filesystems.
+
+    The known files of a directory with their stat fingerprints and the known
+    subdirectories are obtained from lookup(dirpath), which returns a tuple of
+    (dict, set), i.e., from the repository. The poller itself only
+    remembers the modification time and the subdirectories of each directory.
+    Directories whose modification time did not change are not listed again,
+    only their known files are stat'ed. Subdirectories are distributed over a
+    pool of worker threads and stat calls are limited to rate per second.
+
+    Changes are reported as queue items via put(). Unexpected errors while
+    polling a directory are logged and the directory is retried on the next
+    pass.
+    """
+
+    def __init__(self, matcher, roots, lookup, put, interval, rate=0, workers=1,
+                 log=None):
+        self.matcher = matcher
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.interval = interval
+        self.workers = max(1, workers)
+        self.passes = 0
+        self.stats = None
+        self._lookup = lookup
+        self._put = put
+        self._log = log or (lambda message: None)
+        self._limiter = RateLimiter(rate)
+        self._lock = threading.Lock()
+        self._dirs = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _stat(self, path):
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+
+    def _wait(self, count):
+        delay = self._limiter.reserve(count)
+        return delay > 0 and self._stopped.wait(delay)
+
+    def _forget(self, dirpath):
+        with self._lock:
+            pending = [dirpath]
+            while pending:
+                entry = self._dirs.pop(pending.pop(), None)
+                if entry is not None:
+                    pending.extend(entry[1])
+
+    def _list(self, dirpath):
+        """
+        Return the matching files and the subdirectories of dirpath.
+        """
+        files = []
+        subdirs = []
+        entries_it = scandir(dirpath)
+        try:
+            for entry in entries_it:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink() and not self.matcher.prune(entry.path):
+                            subdirs.append(entry.path)
+                        continue
+                except OSError:
+                    continue
+
+                if self.matcher.matches(entry.path):
+                    files.append(entry.path)
+        finally:
+            if hasattr(entries_it, 'close'):
+                entries_it.close()
+
+        return files, tuple(subdirs)
+
+    def _poll_directory(self, dirpath, pending, stats):
+        if self._wait(1):
+            return
+
+        st = self._stat(dirpath)
+        with self._lock:
+            entry = self._dirs.get(dirpath)
+            stats.directories += 1
+            stats.stats += 1
+
+        if st is None:
+            self._forget(dirpath)
+            self._put(SubtreeChange(dirpath, None))
+            return
+
+        (known, known_subdirs) = self._lookup(dirpath)
+        mtime = st.st_mtime
+        deletes = []
+
+        if entry is not None and entry[0] == mtime and entry[2]:
+            candidates = list(known)
+            subdirs = entry[1]
+            with self._lock:
+                stats.unchanged += 1
+        else:
+            try:
+                candidates, subdirs = self._list(dirpath)
+            except OSError:
+                return
+            listed = set(candidates)
+            deletes.extend(path for path in known if path not in listed)
+
+            # The modification time is only trusted once it was seen unchanged
+            # by two consecutive listings. Otherwise changes happening within
+            # the timestamp resolution right after a listing could be missed.
+            trusted = entry is not None and entry[0] == mtime
+            with self._lock:
+                self._dirs[dirpath] = (mtime, subdirs, trusted)
+
+            listed = set(subdirs)
+            if entry is not None:
+                for subdir in entry[1]:
+                    if subdir not in listed:
+                        self._forget(subdir)
+            for subdir in known_subdirs:
+                if subdir not in listed:
+                    self._put(SubtreeChange(subdir, None))
+
+        for subdir in subdirs:
+            pending.put(subdir)
+
+        if self._wait(len(candidates)):
+            return
+
+        inserts = []
+        metadata = []
+        for path in candidates:
+            st = self._stat(path)
+            if st is None:
+                if path in known:
+                    deletes.append(path)
+            elif _fingerprint_changed(known.get(path), st):
+                inserts.append(path)
+                metadata.append(st)
+
+        with self._lock:
+            stats.stats += len(candidates)
+            stats.changes += len(deletes) + len(inserts)
+
+        if deletes or inserts:
+            self._put((tuple(deletes), tuple(inserts), tuple(metadata)))
+
+    def _try_poll_directory(self, dirpath, pending, stats):
+        try:
+            self._poll_directory(dirpath, pending, stats)
+        except Exception as e: #pylint: disable=broad-except
+            with self._lock:
+                stats.errors += 1
+            self._log("Failed to poll {:s}: {!r}".format(dirpath, e))
+
+    def _worker(self, pending, stats):
+        while True:
+            dirpath = pending.get()
+            try:
+                if dirpath is None:
+                    break
+                if not self._stopped.is_set():
+                    self._try_poll_directory(dirpath, pending, stats)
+            finally:
+                pending.task_done()
+
+    def poll(self):
+        """
+        Check all directories once. Returns a PollStatistics instance.
+        """
+        stats = PollStatistics()
+        pending = queue.Queue()
+        start = time.time()
+
+        for root in self.roots:
+            pending.put(root)
+
+        if self.workers == 1:
+            while not pending.empty() and not self._stopped.is_set():
+                self._try_poll_directory(pending.get(), pending, stats)
+        else:
+            threads = [threading.Thread(target=self._worker, args=(pending, stats))
+                       for _ in range(self.workers)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            pending.join()
+            for thread in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+
+        stats.elapsed = time.time() - start
+        return stats
+
+    def _run(self):
+        elapsed = 0
+        while not self._stopped.wait(max(0, self.interval - elapsed)):
+            start = time.time()
+            try:
+                self.stats = self.poll()
+            except Exception as e: #pylint: disable=broad-except
+                self._log("Poll pass failed: {!r}".format(e))
+            self.passes += 1
+            elapsed = time.time() - start
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -2,43 +2,521 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import binascii
+import collections
 import datetime
-import functools
-import hashlib
+import os
+import struct
+import threading
 from bson import BSON
+from bson.raw_bson import RawBSONDocument
+from spreadflow_observer_fs.metrics import Metrics
+from spreadflow_observer_fs.oid import StatOidGenerator
+
+
+# Stat fingerprints (mode, ino, dev, nlink, uid, gid, size, atime, mtime,
+# ctime) packed into a fixed size record.
+_FINGERPRINT = struct.Struct('<7Q3q')
+_OID_SIZE = 20
+_EMPTY_OID = b'\0' * _OID_SIZE
+_EMPTY_FINGERPRINT = b'\0' * _FINGERPRINT.size
+_INT32 = struct.Struct('<i')
+
+if os.altsep:
+    _split = os.path.split #pylint: disable=invalid-name
+else:
+    def _split(path):
+        (dirpath, sep, name) = path.rpartition(os.sep)
+        return (dirpath or sep, name)
+
+_NO_FINGERPRINT = 0
+_PACKED_FINGERPRINT = 1
+_OTHER_FINGERPRINT = 2
+
+
+def _split_elements(document):
+    """
+    Iterate over the (key, element) tuples of an encoded BSON document whose
+    values are all documents. Elements include type byte and key.
+    """
+    pos = 4
+    end = len(document) - 1
+    while pos < end:
+        key_end = document.index(b'\0', pos + 1)
+        size = _INT32.unpack_from(document, key_end + 1)[0]
+        yield (document[pos + 1:key_end].decode('utf-8'), document[pos:key_end + 1 + size])
+        pos = key_end + 1 + size
+
+
+class _Directory(object):
+    """
+    Entries of a single directory. File names map to record numbers into
+    arrays holding the binary oids and packed stat fingerprints. Oids and
+    fingerprints which cannot be packed are kept in dictionaries, as well as
+    cached encoded snapshot fragments, which are dropped when the entry
+    changes.
+    """
+
+    __slots__ = ('path', 'names', 'subdirs', 'oids', 'fingerprints', 'flags',
+                 'free', 'other_oids', 'other_fingerprints', 'fragments')
+
+    def __init__(self, path):
+        self.path = path
+        self.names = {}
+        self.subdirs = set()
+        self.oids = bytearray()
+        self.fingerprints = bytearray()
+        self.flags = bytearray()
+        self.free = []
+        self.other_oids = None
+        self.other_fingerprints = None
+        self.fragments = None
+
+
+    def __bool__(self):
+        return bool(self.names or self.subdirs)
+    __nonzero__ = __bool__
+
+
+    def allocate(self, name):
+        if self.free:
+            record = self.free.pop()
+        else:
+            record = len(self.flags)
+            self.oids += _EMPTY_OID
+            self.fingerprints += _EMPTY_FINGERPRINT
+            self.flags.append(_NO_FINGERPRINT)
+        self.names[name] = record
+        return record
+
+
+    def release(self, name):
+        record = self.names.pop(name)
+        self.flags[record] = _NO_FINGERPRINT
+        if self.other_oids:
+            self.other_oids.pop(record, None)
+        if self.other_fingerprints:
+            self.other_fingerprints.pop(record, None)
+        if self.fragments:
+            self.fragments.pop(record, None)
+        if self.names:
+            self.free.append(record)
+        else:
+            self.oids = bytearray()
+            self.fingerprints = bytearray()
+            self.flags = bytearray()
+            self.free = []
+            self.fragments = None
+
+
+    def get_oid(self, record):
+        if self.other_oids and record in self.other_oids:
+            return self.other_oids[record]
+        offset = record * _OID_SIZE
+        return binascii.hexlify(self.oids[offset:offset + _OID_SIZE]).decode('ascii')
+
+
+    def set_oid(self, record, oid):
+        if self.fragments:
+            self.fragments.pop(record, None)
+        if len(oid) == 2 * _OID_SIZE and oid == oid.lower():
+            try:
+                digest = binascii.unhexlify(oid)
+            except (TypeError, ValueError):
+                pass
+            else:
+                offset = record * _OID_SIZE
+                self.oids[offset:offset + _OID_SIZE] = digest
+                if self.other_oids:
+                    self.other_oids.pop(record, None)
+                return
+
+        if self.other_oids is None:
+            self.other_oids = {}
+        self.other_oids[record] = oid
+
+
+    def get_fingerprint(self, record):
+        flag = self.flags[record]
+        if flag == _PACKED_FINGERPRINT:
+            return _FINGERPRINT.unpack_from(self.fingerprints, record * _FINGERPRINT.size)
+        elif flag == _OTHER_FINGERPRINT:
+            return self.other_fingerprints[record]
+        return None
+
+
+    def get_fragment(self, record):
+        return self.fragments.get(record) if self.fragments else None
+
+
+    def set_fragment(self, record, fragment):
+        if self.fragments is None:
+            self.fragments = {}
+        self.fragments[record] = fragment
+
+
+    def set_fingerprint(self, record, fingerprint):
+        if self.fragments:
+            self.fragments.pop(record, None)
+        if self.other_fingerprints:
+            self.other_fingerprints.pop(record, None)
+
+        if fingerprint is None:
+            self.flags[record] = _NO_FINGERPRINT
+            return
+
+        try:
+            _FINGERPRINT.pack_into(self.fingerprints, record * _FINGERPRINT.size, *fingerprint)
+        except (struct.error, TypeError):
+            if self.other_fingerprints is None:
+                self.other_fingerprints = {}
+            self.other_fingerprints[record] = tuple(fingerprint)
+            self.flags[record] = _OTHER_FINGERPRINT
+        else:
+            self.flags[record] = _PACKED_FINGERPRINT
 
 
 class Repository(object):
+    """
+    Index of the objects currently known to the observer.
+
+    Entries are grouped by their parent directory, such that incremental
+    updates only have to look at the paths touched by an event instead of
+    scanning the whole repository, and all entries below a directory can be
+    found without visiting unrelated ones (e.g., when a directory is moved or
+    removed). Directory paths are stored once, entries only keep their file
+    name. Oids (hex digests) are stored in binary form and stat fingerprints
+    as packed records.
+
+    Updates and the per-directory queries (fingerprints(), subdirs() and
+    subtree()) are serialized by a lock, such that the latter may be called
+    from other threads (e.g., the poller) while updates are applied.
+    Removing entries releases and reuses records, unsynchronized readers
+    could see those of another file.
+    """
 
     def __init__(self):
-        self._repo = set()
+        self._lock = threading.Lock()
+        self._dirs = {}
+        self._size = 0
+
+
+    def __len__(self):
+        return self._size
+
+
+    def _lookup(self, path):
+        (dirpath, name) = _split(path)
+        directory = self._dirs.get(dirpath)
+        if directory is None:
+            return (dirpath, None, name, None)
+        return (dirpath, directory, name, directory.names.get(name))
+
+
+    def _directory(self, dirpath):
+        directory = self._dirs.get(dirpath)
+        if directory is not None:
+            return directory
+
+        directory = self._dirs[dirpath] = _Directory(dirpath)
+        while True:
+            parent_path = os.path.dirname(dirpath)
+            if parent_path == dirpath:
+                break
+            parent = self._dirs.get(parent_path)
+            known = parent is not None
+            if not known:
+                parent = self._dirs[parent_path] = _Directory(parent_path)
+            parent.subdirs.add(dirpath)
+            if known:
+                break
+            dirpath = parent_path
+
+        return directory
+
+
+    def _prune(self, directory):
+        while not directory:
+            del self._dirs[directory.path]
+            parent_path = os.path.dirname(directory.path)
+            parent = self._dirs.get(parent_path)
+            if parent_path == directory.path or parent is None:
+                break
+            parent.subdirs.discard(directory.path)
+            directory = parent
+
+
+    def get(self, path):
+        (dirpath, directory, name, record) = self._lookup(path)
+        return None if record is None else directory.get_oid(record)
+
+
+    def lookup(self, path):
+        """
+        Return the (oid, fingerprint) tuple of path or None if it is unknown.
+        """
+        (dirpath, directory, name, record) = self._lookup(path)
+        if record is None:
+            return None
+        return (directory.get_oid(record), directory.get_fingerprint(record))
+
+
+    def entries(self):
+        """
+        Iterate over (path, oid, fingerprint) tuples of all entries.
+        """
+        for dirpath, directory in list(self._dirs.items()):
+            prefix = os.path.join(dirpath, '')
+            for name, record in list(directory.names.items()):
+                yield (prefix + name, directory.get_oid(record),
+                       directory.get_fingerprint(record))
+
+
+    def items(self):
+        return [(path, oid) for path, oid, fingerprint in self.entries()]
+
+
+    def fragment_entries(self):
+        """
+        Iterate over (path, oid, fingerprint, fragment) tuples of all
+        entries, where fragment is the cached snapshot fragment or None. The
+        fingerprint is only looked up for entries without fragment.
+        """
+        for dirpath, directory in list(self._dirs.items()):
+            prefix = os.path.join(dirpath, '')
+            for name, record in list(directory.names.items()):
+                fragment = directory.get_fragment(record)
+                fingerprint = directory.get_fingerprint(record) if fragment is None else None
+                yield (prefix + name, directory.get_oid(record), fingerprint, fragment)
+
+
+    def set_fragments(self, fragments):
+        """
+        Cache snapshot fragments given as (path, fragment) tuples.
+        """
+        with self._lock:
+            for path, fragment in fragments:
+                (dirpath, directory, name, record) = self._lookup(path)
+                if record is not None:
+                    directory.set_fragment(record, fragment)
+
+
+    def fingerprints(self, dirpath):
+        """
+        Return a dict mapping the paths directly within dirpath to their
+        stat fingerprint.
+        """
+        with self._lock:
+            directory = self._dirs.get(os.path.normpath(dirpath))
+            if directory is None:
+                return {}
+            return dict((os.path.join(directory.path, name), directory.get_fingerprint(record))
+                        for name, record in directory.names.items())
+
+
+    def subdirs(self, dirpath):
+        """
+        Return a list of the subdirectories of dirpath containing entries.
+        """
+        with self._lock:
+            directory = self._dirs.get(os.path.normpath(dirpath))
+            return [] if directory is None else list(directory.subdirs)
+
+
+    def subtree(self, dirpath):
+        """
+        Return a list of all paths below dirpath.
+        """
+        paths = []
+        pending = [os.path.normpath(dirpath)]
+        with self._lock:
+            while pending:
+                directory = self._dirs.get(pending.pop())
+                if directory is not None:
+                    paths.extend(os.path.join(directory.path, name) for name in directory.names)
+                    pending.extend(directory.subdirs)
+        return paths
+
+
+    def restore(self, entries):
+        """
+        Replace the contents with the given (path, oid, fingerprint) tuples.
+        """
+        with self._lock:
+            self._dirs = {}
+            self._size = 0
+            for path, oid, fingerprint in entries:
+                (dirpath, name) = _split(path)
+                directory = self._directory(dirpath)
+                record = directory.names.get(name)
+                if record is None:
+                    record = directory.allocate(name)
+                    self._size += 1
+                directory.set_oid(record, oid)
+                directory.set_fingerprint(record, fingerprint)
+
+
+    def _apply(self, changes, fingerprints=None):
+        """
+        Apply a mapping of path -> oid (None meaning removal) and return the
+        resulting (deleted, inserted) sets of (path, oid) tuples. If given,
+        the fingerprints of the remaining paths are set from the
+        fingerprints mapping (missing ones are cleared).
+        """
+        deleted = set()
+        inserted = set()
+
+        for path, oid in changes.items():
+            (dirpath, directory, name, record) = self._lookup(path)
+            old_oid = None if record is None else directory.get_oid(record)
+
+            if old_oid != oid:
+                if old_oid is not None:
+                    deleted.add((path, old_oid))
+                if oid is None:
+                    directory.release(name)
+                    self._size -= 1
+                    self._prune(directory)
+                    continue
+
+                inserted.add((path, oid))
+                if record is None:
+                    directory = self._directory(dirpath)
+                    record = directory.allocate(name)
+                    self._size += 1
+                directory.set_oid(record, oid)
+
+            if fingerprints is not None and record is not None:
+                directory.set_fingerprint(record, fingerprints.get(path))
 
+        return (deleted, inserted)
 
-    def replace(self, repo):
-        inserted = repo - self._repo
-        deleted = self._repo - repo
-        self._repo = repo
 
-        return (deleted, inserted)
+    def replace(self, repo, fingerprints=None):
+        repo = dict(repo)
+        changes = dict.fromkeys(set(path for path, oid in self.items()) - set(repo))
+        changes.update(repo)
+        with self._lock:
+            return self._apply(changes, fingerprints)
 
 
-    def update(self, deletes, inserts):
-        masked_paths = set(deletes + tuple(path for path, oid in inserts))
-        repo = set([(path, oid) for path, oid in self._repo if path not in masked_paths] + inserts)
-        return self.replace(repo)
+    def update(self, deletes, inserts, fingerprints=None):
+        changes = dict.fromkeys(deletes)
+        changes.update(inserts)
+        with self._lock:
+            return self._apply(changes, fingerprints)
 
 
 class MessageFactory(object):
 
-    CHUNK_SIZE = 8
+    # Default upper bounds for the number of entries and the estimated size
+    # in bytes of a single message. A value of 0 disables the limit.
+    CHUNK_SIZE = 1000
+    CHUNK_BYTES = 1 << 20
 
-    def __init__(self, port_name = 'default'):
+    # Rough estimate of the encoded size of an entry without path and oid.
+    ENTRY_OVERHEAD = 32
+    INSERT_OVERHEAD = 128
+
+    def __init__(self, port_name = 'default', chunk_size=None, chunk_bytes=None,
+                 oid_generator=None, encoder=BSON.encode, detect_renames=False,
+                 metrics=None, fragment_cache=False):
         self.port_name = port_name
+        # Only applies to the BSON encoder and to snapshots: change messages
+        # carry new or modified entries only, which have no cached fragment.
+        self.fragment_cache = fragment_cache and encoder == BSON.encode
+        self.metrics = Metrics() if metrics is None else metrics
+        self.encoder = encoder
+        self.detect_renames = detect_renames
+        self.oid_generator = StatOidGenerator() if oid_generator is None else oid_generator
+        self.chunk_size = self.CHUNK_SIZE if chunk_size is None else chunk_size
+        self.chunk_bytes = self.CHUNK_BYTES if chunk_bytes is None else chunk_bytes
         self._repository = Repository()
 
 
     def _metadata_generate_oids(self, metadata):
-        return tuple(hashlib.sha1(repr(meta).encode('utf-8')).hexdigest() for meta in metadata)
+        if not metadata:
+            return ()
+        with self.metrics.timer('oid_generate'):
+            oids = self.oid_generator(metadata)
+        self.metrics.incr('oids_generated', len(metadata))
+        return oids
+
+
+    def _metadata_fingerprint(self, meta):
+        stat = meta.get('stat')
+        return tuple(stat) if stat is not None else None
+
+
+    def _metadata_inode(self, fingerprint):
+        """
+        Return a key identifying the file behind a stat fingerprint: device,
+        inode, size and modification time.
+        """
+        if fingerprint is None or len(fingerprint) < 9:
+            return None
+        return (fingerprint[2], fingerprint[1], fingerprint[6], fingerprint[8])
+
+
+    def _metadata_lookup_renamed(self, deletable_paths, paths):
+        """
+        Return a dict mapping inode keys of deleted paths (which are not
+        reinserted) to their oids.
+        """
+        renamed = {}
+        reinserted = set(paths)
+        for path in deletable_paths:
+            if path in reinserted:
+                continue
+            entry = self._repository.lookup(path)
+            key = self._metadata_inode(entry[1]) if entry is not None else None
+            if key is not None:
+                renamed[key] = entry[0]
+        return renamed
+
+
+    def _metadata_lookup_oids(self, paths, metadata, merged_metadata, deletable_paths=()):
+        """
+        Generate oids, reusing the known oid of paths whose stat fingerprint
+        did not change. If rename detection is enabled, an inserted path
+        referring to the same inode as a deleted path inherits its oid.
+        """
+        oids = []
+        missing = []
+        for i, (path, meta) in enumerate(zip(paths, metadata)):
+            fingerprint = self._metadata_fingerprint(meta)
+            oid = None
+            if fingerprint is not None:
+                entry = self._repository.lookup(path)
+                if entry is not None and entry[1] == fingerprint:
+                    oid = entry[0]
+            if oid is None:
+                missing.append(i)
+            oids.append(oid)
+
+        if self.detect_renames and deletable_paths and missing:
+            renamed = self._metadata_lookup_renamed(deletable_paths, paths)
+            if renamed:
+                remaining = []
+                for i in missing:
+                    key = self._metadata_inode(self._metadata_fingerprint(metadata[i]))
+                    oid = renamed.pop(key, None) if key is not None else None
+                    if oid is None:
+                        remaining.append(i)
+                    else:
+                        oids[i] = oid
+                missing = remaining
+
+        self.metrics.incr('oids_reused', len(oids) - len(missing))
+        generated = self._metadata_generate_oids([merged_metadata[i] for i in missing])
+        for i, oid in zip(missing, generated):
+            oids[i] = oid
+
+        return tuple(oids)
+
+
+    def _metadata_fingerprints(self, paths, metadata):
+        return dict((path, self._metadata_fingerprint(meta)) for path, meta in zip(paths, metadata))
 
 
     def _metadata_generate_uris(self, paths):
@@ -46,60 +524,259 @@ class MessageFactory(object):
 
 
     def _metadata_merge(self, *args):
-        return tuple(functools.reduce(lambda x, y: dict(list(x.items()) + list(y.items())), dicts, {}) for dicts in list(zip(*args)))
-
-    def _construct_message(self, deleted_objects, inserted_objects, insertable_oids, insertable_meta):
-        deleted_oids = ()
-        inserted_oids = ()
-        metadata = ()
-
-        if deleted_objects:
-            (deleted_paths, deleted_oids) = list(zip(*deleted_objects))
-            metadata += tuple(zip(deleted_oids, self._metadata_generate_uris(deleted_paths)))
-
-        if inserted_objects:
-            (inserted_paths, inserted_oids) = list(zip(*inserted_objects))
-            metadata += tuple((oid, meta) for oid, meta in zip(insertable_oids, insertable_meta) if oid in inserted_oids)
-
+        merged = []
+        for dicts in zip(*args):
+            meta = {}
+            for d in dicts:
+                meta.update(d)
+            merged.append(meta)
+        return tuple(merged)
+
+    def _construct_message(self, deleted_objects, inserted_objects, metadata_index,
+                           item_type='delta', **extra):
+        # Build the data dict in one pass, the C extension of the bson module
+        # encodes the whole message at once.
+        data = dict((oid, {'path': path}) for path, oid in deleted_objects)
+        data.update((oid, metadata_index[oid]) for _, oid in inserted_objects)
+
+        deleted_oids = tuple(oid for _, oid in deleted_objects)
+        inserted_oids = tuple(oid for _, oid in inserted_objects)
+        return self._encode_message(deleted_oids, inserted_oids, data, item_type, extra)
+
+    def _encode_message(self, deleted_oids, inserted_oids, data, item_type, extra):
         item = {
-            'type': 'delta',
+            'type': item_type,
             'date': datetime.datetime.now(),
             'deletes': deleted_oids,
             'inserts': inserted_oids,
-            'data': dict(metadata)
+            'data': data
         }
+        item.update(extra)
 
         msg = {
             'port': self.port_name,
             'item': item
         }
 
-        return BSON.encode(msg)
+        self.metrics.incr('messages')
+        self.metrics.incr('message_entries', len(deleted_oids) + len(inserted_oids))
+        if not self.encoder:
+            return msg
+        with self.metrics.timer('message_encode'):
+            return self.encoder(msg)
+
+
+    def _chunks(self, objects, inserted):
+        """
+        Split (path, oid) tuples into chunks of at most chunk_size entries
+        and approximately chunk_bytes. Yields (chunk, estimated size) tuples,
+        the last chunk may be filled up further by the caller.
+        """
+        chunk_size = self.chunk_size or max(1, len(objects))
+        if not self.chunk_bytes:
+            for i in range(0, len(objects), chunk_size):
+                yield (objects[i:i + chunk_size], 0)
+            return
+
+        overhead = self.ENTRY_OVERHEAD + (self.INSERT_OVERHEAD if inserted else 0)
+        start = 0
+        size = 0
+        for i, (path, oid) in enumerate(objects):
+            entry_size = overhead + len(path) + 2 * len(oid)
+            if i > start and (i - start >= chunk_size or size + entry_size > self.chunk_bytes):
+                yield (objects[start:i], size)
+                start = i
+                size = 0
+            size += entry_size
+        if start < len(objects):
+            yield (objects[start:], size)
 
 
     def _generate_messages(self, deleted_objects, inserted_objects, insertable_oids, insertable_meta):
-        if len(deleted_objects) + len(inserted_objects) > self.CHUNK_SIZE:
-            for i in range(0, len(deleted_objects), self.CHUNK_SIZE):
-                yield self._construct_message(deleted_objects[i:i+self.CHUNK_SIZE], (), insertable_oids, insertable_meta)
-            for i in range(0, len(inserted_objects), self.CHUNK_SIZE):
-                yield self._construct_message((), inserted_objects[i:i+self.CHUNK_SIZE], insertable_oids, insertable_meta)
-        elif len(deleted_objects) + len(inserted_objects) > 0:
-            yield self._construct_message(deleted_objects, inserted_objects, insertable_oids, insertable_meta)
+        metadata_index = dict(zip(insertable_oids, insertable_meta))
+
+        # Deletes and inserts share a message where the last chunk of deletes
+        # leaves room for inserts.
+        pending = ()
+        pending_size = 0
+        for (chunk, size) in self._chunks(deleted_objects, False):
+            if pending:
+                yield self._construct_message(pending, (), metadata_index)
+            pending = chunk
+            pending_size = size
+
+        if not pending:
+            for (chunk, _) in self._chunks(inserted_objects, True):
+                yield self._construct_message((), chunk, metadata_index)
+            return
+
+        remaining = inserted_objects
+        if remaining:
+            room = len(remaining)
+            if self.chunk_size:
+                room = min(room, self.chunk_size - len(pending))
+            if self.chunk_bytes:
+                overhead = self.ENTRY_OVERHEAD + self.INSERT_OVERHEAD
+                count = 0
+                for path, oid in remaining[:room]:
+                    pending_size += overhead + len(path) + 2 * len(oid)
+                    if pending_size > self.chunk_bytes:
+                        break
+                    count += 1
+                room = count
+            yield self._construct_message(pending, remaining[:room], metadata_index)
+            remaining = remaining[room:]
+        else:
+            yield self._construct_message(pending, (), metadata_index)
+
+        for (chunk, _) in self._chunks(remaining, True):
+            yield self._construct_message((), chunk, metadata_index)
+
+
+    def snapshot(self):
+        """
+        Return a list of (path, oid, fingerprint) tuples of all known objects.
+        """
+        return list(self._repository.entries())
+
+
+    def dump(self):
+        """
+        Generate messages of type 'snapshot' listing all known objects as
+        inserts, such that a consumer which lost its state can rebuild it
+        without a rescan. The first message has the 'first' flag set, the
+        last one the 'last' flag. An empty repository yields a single
+        message without inserts.
+        """
+        if self.fragment_cache:
+            for msg in self._dump_fragments():
+                yield msg
+            return
+
+        objects = []
+        metadata_index = {}
+        for path, oid, fingerprint in self._repository.entries():
+            objects.append((path, oid))
+            metadata_index[oid] = self._snapshot_metadata(path, fingerprint)
+
+        chunks = [chunk for chunk, _ in self._chunks(tuple(objects), True)] or [()]
+        for i, chunk in enumerate(chunks):
+            yield self._construct_message((), chunk, metadata_index, 'snapshot',
+                                          first=(i == 0), last=(i == len(chunks) - 1))
+
+
+    def _snapshot_metadata(self, path, fingerprint):
+        meta = {'path': path}
+        if fingerprint is not None:
+            meta['stat'] = fingerprint
+        return meta
+
+
+    def _encode_fragments(self, entries):
+        """
+        Encode the data elements (oid: metadata) of (path, oid, fingerprint)
+        tuples. Entries with distinct oids are encoded in a single pass.
+        Returns a list of fragments in the order of entries.
+        """
+        counts = collections.Counter(oid for _, oid, _ in entries)
+        unique = dict((oid, self._snapshot_metadata(path, fingerprint))
+                      for path, oid, fingerprint in entries if counts[oid] == 1)
+        elements = dict(_split_elements(BSON.encode(unique))) if unique else {}
+
+        fragments = []
+        for path, oid, fingerprint in entries:
+            if counts[oid] == 1:
+                fragments.append(elements[oid])
+            else:
+                fragments.append(BSON.encode({oid: self._snapshot_metadata(path, fingerprint)})[4:-1])
+        self.metrics.incr('fragments_encoded', len(entries))
+        return fragments
+
+
+    def _dump_fragments(self):
+        """
+        Like dump(), but assemble the data of the messages from cached
+        fragments. Missing fragments are encoded and cached, such that
+        further snapshots only concatenate bytes.
+        """
+        entries = list(self._repository.fragment_entries())
+        objects = tuple((path, oid) for path, oid, _, _ in entries)
+        chunks = [chunk for chunk, _ in self._chunks(objects, True)] or [()]
+
+        start = 0
+        for i, chunk in enumerate(chunks):
+            part = entries[start:start + len(chunk)]
+            start += len(chunk)
+
+            missing = [(path, oid, fingerprint) for path, oid, fingerprint, fragment in part if fragment is None]
+            encoded = self._encode_fragments(missing) if missing else []
+            self._repository.set_fragments((path, fragment) for (path, _, _), fragment in zip(missing, encoded))
+
+            # Later entries win on duplicate oids, like in the data dict.
+            elements = collections.OrderedDict()
+            encoded = iter(encoded)
+            for _, oid, _, fragment in part:
+                elements[oid] = next(encoded) if fragment is None else fragment
+            body = b''.join(elements.values())
+            data = RawBSONDocument(_INT32.pack(len(body) + 5) + body + b'\0')
+
+            yield self._encode_message((), tuple(oid for _, oid in chunk), data, 'snapshot',
+                                       {'first': i == 0, 'last': i == len(chunks) - 1})
+
+
+    def restore(self, entries):
+        """
+        Populate the repository from (path, oid, fingerprint) tuples as
+        returned by snapshot() without generating any messages.
+        """
+        self._repository.restore(entries)
+
+
+    def __len__(self):
+        return len(self._repository)
+
+
+    def paths(self):
+        return [path for path, oid in self._repository.items()]
+
+
+    def subtree(self, dirpath):
+        """
+        Return the known paths below dirpath.
+        """
+        return self._repository.subtree(dirpath)
+
+
+    def fingerprints(self, dirpath):
+        """
+        Return a dict mapping the known paths directly within dirpath to
+        their stat fingerprint (None if unknown).
+        """
+        return self._repository.fingerprints(dirpath)
+
+
+    def subdirs(self, dirpath):
+        """
+        Return the subdirectories of dirpath containing known paths.
+        """
+        return self._repository.subdirs(dirpath)
 
 
     def replace(self, paths, metadata):
         uri_metadata = self._metadata_generate_uris(paths)
         merged_metadata = self._metadata_merge(metadata, uri_metadata)
-        oids = self._metadata_generate_oids(merged_metadata)
+        oids = self._metadata_lookup_oids(paths, metadata, merged_metadata)
 
-        (deleted_objects, inserted_objects) = self._repository.replace(set(zip(paths, oids)))
+        fingerprints = self._metadata_fingerprints(paths, metadata)
+        (deleted_objects, inserted_objects) = self._repository.replace(set(zip(paths, oids)), fingerprints)
         return self._generate_messages(tuple(deleted_objects), tuple(inserted_objects), oids, merged_metadata)
 
 
     def update(self, deletable_paths, insertable_paths, insertable_meta):
         uri_metadata = self._metadata_generate_uris(insertable_paths)
         merged_metadata = self._metadata_merge(insertable_meta, uri_metadata)
-        oids = self._metadata_generate_oids(merged_metadata)
+        oids = self._metadata_lookup_oids(insertable_paths, insertable_meta, merged_metadata, deletable_paths)
 
-        (deleted_objects, inserted_objects) = self._repository.update(deletable_paths, list(zip(insertable_paths, oids)))
+        fingerprints = self._metadata_fingerprints(insertable_paths, insertable_meta)
+        (deleted_objects, inserted_objects) = self._repository.update(deletable_paths, list(zip(insertable_paths, oids)), fingerprints)
         return self._generate_messages(tuple(deleted_objects), tuple(inserted_objects), oids, merged_metadata)
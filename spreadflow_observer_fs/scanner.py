@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import os
+import threading
+import time
+from spreadflow_observer_fs.compat import scandir
+
+
+class ScanStatistics(object):
+
+    def __init__(self):
+        self.entries = 0
+        self.matches = 0
+        self.elapsed = 0
+
+    @property
+    def rate(self):
+        return self.entries / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        return "{:d} entries ({:d} matches) in {:.2f}s ({:.0f} entries/s)".format(
+            self.entries, self.matches, self.elapsed, self.rate)
+
+
+class DirectoryScanner(object):
+    """
+    Walks directory trees using scandir and reports matching files together
+    with their stat result.
+
+    Subdirectories are distributed over a pool of worker threads. The matcher
+    decides which files are reported (matcher.matches(path)) and which
+    directories are pruned from the walk (matcher.prune(dirpath)).
+
+    If a directory callback is given, it is called with every directory
+    right before it is listed (e.g., to add a watch for it).
+    """
+
+    def __init__(self, matcher, workers=1, directory_callback=None):
+        self.matcher = matcher
+        self.workers = max(1, workers)
+        self.directory_callback = directory_callback
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stop a running scan. Directories not yet listed are skipped.
+        """
+        self._cancelled.set()
+
+    def _scan_directory(self, directory, pending, callback, stats, lock):
+        paths = []
+        metadata = []
+        entries = 0
+
+        if self._cancelled.is_set():
+            return
+
+        if self.directory_callback is not None:
+            self.directory_callback(directory)
+
+        try:
+            entries_it = scandir(directory)
+        except OSError:
+            return
+
+        try:
+            for entry in entries_it:
+                entries += 1
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink() and not self.matcher.prune(entry.path):
+                            pending.put(entry.path)
+                        continue
+                except OSError:
+                    continue
+
+                if self.matcher.matches(entry.path):
+                    try:
+                        metadata.append(entry.stat())
+                    except OSError:
+                        continue
+                    paths.append(entry.path)
+        except OSError:
+            pass
+        finally:
+            if hasattr(entries_it, 'close'):
+                entries_it.close()
+
+        with lock:
+            stats.entries += entries
+            stats.matches += len(paths)
+
+        if len(paths):
+            callback(tuple(paths), tuple(metadata))
+
+    def _worker(self, pending, callback, stats, lock):
+        while True:
+            directory = pending.get()
+            try:
+                if directory is None:
+                    break
+                self._scan_directory(directory, pending, callback, stats, lock)
+            finally:
+                pending.task_done()
+
+    def scan(self, directories, callback):
+        """
+        Scan the given directories and call callback(paths, stat_results) once
+        per directory containing matches. The callback is invoked from the
+        worker threads. Returns a ScanStatistics instance.
+        """
+        stats = ScanStatistics()
+        lock = threading.Lock()
+        pending = queue.Queue()
+        start = time.time()
+
+        for directory in directories:
+            pending.put(os.path.abspath(directory))
+
+        if self.workers == 1:
+            while not pending.empty():
+                self._scan_directory(pending.get(), pending, callback, stats, lock)
+        else:
+            threads = [threading.Thread(target=self._worker, args=(pending, callback, stats, lock))
+                       for _ in range(self.workers)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            pending.join()
+            for thread in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+
+        stats.elapsed = time.time() - start
+        return stats
@@ -2,61 +2,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
-try:
-    import queue
-except ImportError:
-    import Queue as queue
 import argparse
 import importlib
-import os
+import signal
 import sys
 import threading
+from spreadflow_observer_fs.control import serve
+from spreadflow_observer_fs.metrics import MetricsDump
+from spreadflow_observer_fs.oid import OID_GENERATORS
+from spreadflow_observer_fs.pipeline import ObserverPipeline
 from spreadflow_observer_fs.protocol import MessageFactory
-from pathtools.patterns import match_path, filter_paths
-from watchdog.events import PatternMatchingEventHandler
-
-
-class EventHandler(PatternMatchingEventHandler):
-    def __init__(self, pattern, changes_queue):
-        super(EventHandler, self).__init__(patterns=[pattern],
-                ignore_patterns=None, ignore_directories=True,
-                case_sensitive=False)
-        self._changes_queue = changes_queue
-        self._inserts = []
-        self._deletes = []
-
-    def on_moved(self, event):
-        if event.src_path and match_path(event.src_path,
-                included_patterns=self.patterns,
-                excluded_patterns=self.ignore_patterns,
-                case_sensitive=self.case_sensitive):
-            self._deletes.append(event.src_path)
-        if event.dest_path and match_path(event.dest_path,
-                included_patterns=self.patterns,
-                excluded_patterns=self.ignore_patterns,
-                case_sensitive=self.case_sensitive):
-            self._inserts.append(event.dest_path)
-        self.flush()
-
-    def on_created(self, event):
-        self._inserts.append(event.src_path)
-        self.flush()
-
-    def on_deleted(self, event):
-        self._deletes.append(event.src_path)
-        self.flush()
-
-    def on_modified(self, event):
-        self._deletes.append(event.src_path)
-        self._inserts.append(event.src_path)
-        self.flush()
-
-    def flush(self):
-        if len(self._inserts) or len(self._deletes):
-            self._changes_queue.put((tuple(self._deletes), tuple(self._inserts)))
-
-        self._inserts = []
-        self._deletes = []
+from spreadflow_observer_fs.shard import ShardPool
+from spreadflow_observer_fs.watch import WatchSet
+from spreadflow_observer_fs.writer import BufferedWriter
 
 
 class WatchdogObserverCommand(object):
@@ -64,9 +22,49 @@ class WatchdogObserverCommand(object):
     query = None
     native_query = None
     directory = None
+    watch = None
     observer_class = 'watchdog.observers.Observer'
-
-    def __init__(self, out=None):
+    debounce_ms = ObserverPipeline.debounce_ms
+    max_batch = ObserverPipeline.max_batch
+    scan_workers = ObserverPipeline.scan_workers
+    scan_queue = ObserverPipeline.scan_queue
+    bulk_rate = ObserverPipeline.bulk_rate
+    include = None
+    exclude = None
+    exclude_dir = None
+    state_file = ObserverPipeline.state_file
+    state_interval = ObserverPipeline.state_interval
+    stat_workers = ObserverPipeline.stat_workers
+    stat_batch = ObserverPipeline.stat_batch
+    chunk_size = ObserverPipeline.chunk_size
+    chunk_bytes = ObserverPipeline.chunk_bytes
+    output_buffer = 65536
+    output_delay_ms = 10
+    output_queue = 1024
+    oid = ObserverPipeline.oid
+    hash_workers = ObserverPipeline.hash_workers
+    hash_cache = ObserverPipeline.hash_cache
+    detect_renames = ObserverPipeline.detect_renames
+    fragment_cache = ObserverPipeline.fragment_cache
+    poll_interval = ObserverPipeline.poll_interval
+    poll_rate = ObserverPipeline.poll_rate
+    poll_workers = ObserverPipeline.poll_workers
+    metrics_interval = ObserverPipeline.metrics_interval
+    metrics_port = ObserverPipeline.metrics_port
+    metrics_file = ObserverPipeline.metrics_file
+    shards = ObserverPipeline.shards
+    shard_key = ObserverPipeline.shard_key
+
+    PIPELINE_OPTIONS = ('debounce_ms', 'max_batch', 'scan_workers', 'scan_queue', 'bulk_rate',
+                        'state_file', 'state_interval', 'stat_workers',
+                        'stat_batch', 'chunk_size', 'chunk_bytes', 'oid',
+                        'hash_workers', 'hash_cache', 'detect_renames', 'fragment_cache',
+                        'poll_interval', 'poll_rate', 'poll_workers',
+                        'metrics_interval', 'metrics_port', 'metrics_file',
+                        'shards', 'shard_key')
+
+    def __init__(self, out=None, control=None):
+        self._out = out
         if out is None:
             try:
                 # Python 3 does not allow us to write binary data to stdout.
@@ -76,6 +74,13 @@ class WatchdogObserverCommand(object):
             except AttributeError:
                 self._out = sys.stdout
 
+        self._control = control
+        if control is None:
+            try:
+                self._control = sys.stdin.buffer #pylint: disable=no-member
+            except AttributeError:
+                self._control = sys.stdin
+
     def load_observer(self, fqcn):
         module_name, class_name = fqcn.rsplit(".", 1)
         observer_module = importlib.import_module(module_name)
@@ -84,82 +89,144 @@ class WatchdogObserverCommand(object):
     def run(self, args):
 
         parser = argparse.ArgumentParser(prog=args[0])
-        parser.add_argument('directory', metavar='DIR',
+        parser.add_argument('directory', metavar='DIR', nargs='?',
                             help='Base directory')
-        parser.add_argument('query', metavar='PATTERN',
+        parser.add_argument('query', metavar='PATTERN', nargs='?',
                             help='Pattern or query string')
+        parser.add_argument('-w', '--watch', metavar=('PORT', 'DIR', 'PATTERN'), nargs=3, action='append',
+                            help='Report files below DIR matching PATTERN on PORT (may be given multiple times)')
         parser.add_argument('-n', '--native-query', action='store_true',
                             help='PATTERN is a native query for the selected observer')
         parser.add_argument('-o', '--observer-class', metavar='CLASS',
-                            help='Specify the watchdog observer implementation (fully qualified class name).')
+                            help='Specify the watchdog observer implementation (fully qualified class name) or inotify for the built-in Linux engine.')
+        parser.add_argument('--debounce-ms', metavar='MS', type=int,
+                            help='Coalesce filesystem events for MS milliseconds before reporting them (default: 0, report immediately)')
+        parser.add_argument('--max-batch', metavar='N', type=int,
+                            help='Report coalesced events early once N paths are pending (default: 1000)')
+        parser.add_argument('-i', '--include', metavar='PATTERN', action='append',
+                            help='Additionally report files matching PATTERN (may be given multiple times)')
+        parser.add_argument('-e', '--exclude', metavar='PATTERN', action='append',
+                            help='Ignore files matching PATTERN (may be given multiple times)')
+        parser.add_argument('-x', '--exclude-dir', metavar='PATTERN', action='append',
+                            help='Skip directories matching PATTERN (may be given multiple times)')
+        parser.add_argument('--scan-workers', metavar='N', type=int,
+                            help='Number of threads used for the initial scan (default: 1)')
+        parser.add_argument('--scan-queue', metavar='N', type=int,
+                            help='Maximum number of initial scan chunks waiting to be reported (default: 16)')
+        parser.add_argument('--bulk-rate', metavar='N', type=int,
+                            help='Report at most N files per second from the initial scan, live changes are not limited (default: 0, no limit)')
+        parser.add_argument('--state-file', metavar='FILE',
+                            help='Persist the repository to FILE and only report differences on restart')
+        parser.add_argument('--state-interval', metavar='SECONDS', type=int,
+                            help='Save the state file every SECONDS while running (default: 300)')
+        parser.add_argument('--stat-workers', metavar='N', type=int,
+                            help='Number of threads used to stat changed files (default: 1)')
+        parser.add_argument('--stat-batch', metavar='N', type=int,
+                            help='Maximum number of paths merged into one batch (default: 1000)')
+        parser.add_argument('--chunk-size', metavar='N', type=int,
+                            help='Maximum number of entries per message, 0 for no limit (default: %d)' % MessageFactory.CHUNK_SIZE)
+        parser.add_argument('--chunk-bytes', metavar='N', type=int,
+                            help='Approximate maximum size of a message in bytes, 0 for no limit (default: %d)' % MessageFactory.CHUNK_BYTES)
+        parser.add_argument('--output-buffer', metavar='BYTES', type=int,
+                            help='Coalesce messages into writes of up to BYTES (default: 65536)')
+        parser.add_argument('--output-delay-ms', metavar='MS', type=int,
+                            help='Maximum time a message is held back in the output buffer (default: 10)')
+        parser.add_argument('--output-queue', metavar='N', type=int,
+                            help='Maximum number of messages waiting for output (default: 1024)')
+        parser.add_argument('--oid', choices=sorted(OID_GENERATORS),
+                            help='Object id strategy: hash of path and stat fields (stat), of path and file contents (content) or of the metadata repr as in previous releases (legacy). Default: stat')
+        parser.add_argument('--hash-workers', metavar='N', type=int,
+                            help='Number of threads reading file contents with --oid=content (default: 4)')
+        parser.add_argument('--hash-cache', metavar='N', type=int,
+                            help='Number of content digests cached with --oid=content (default: 100000)')
+        parser.add_argument('--detect-renames', action='store_true',
+                            help='Keep the oid of files which are renamed or moved (detected by device and inode number)')
+        parser.add_argument('--fragment-cache', action='store_true',
+                            help='Keep the encoded metadata of every file in memory to speed up repeated snapshot commands. Only snapshots benefit, change messages are encoded as usual')
+        parser.add_argument('--poll-interval', metavar='SECONDS', type=float,
+                            help='Poll the directories every SECONDS instead of using the watchdog observer, e.g. on network filesystems (default: 0, disabled)')
+        parser.add_argument('--poll-rate', metavar='N', type=int,
+                            help='Limit polling to N stat calls per second (default: 0, no limit)')
+        parser.add_argument('--poll-workers', metavar='N', type=int,
+                            help='Number of threads polling subtrees in parallel (default: 1)')
+        parser.add_argument('--metrics-interval', metavar='SECONDS', type=float,
+                            help='Report metrics every SECONDS (default: 0, only on SIGUSR1)')
+        parser.add_argument('--metrics-port', metavar='PORT',
+                            help='Report metrics as messages of type metrics on PORT')
+        parser.add_argument('--metrics-file', metavar='FILE',
+                            help='Report metrics by replacing FILE with a JSON document')
+
+        parser.add_argument('--shards', metavar='N', type=int,
+                            help='Distribute stat calls, oid generation and message encoding over N worker processes (default: 1). Not supported with --state-file and --poll-interval')
+        parser.add_argument('--shard-key', choices=ShardPool.KEYS,
+                            help='Assign files to shards by hash of the path or of the top-level subdirectory, which keeps renames within it detectable (default: path)')
 
         parser.parse_args(args[1:], namespace=self)
 
-        try:
-            Observer = self.load_observer(self.observer_class)
-        except:
-            parser.error("Watchdog observer implementation not found")
+        watch_specs = list(self.watch or [])
+        if self.directory is not None and self.query is not None:
+            watch_specs.insert(0, ('default', self.directory, self.query))
+        elif self.directory is not None:
+            parser.error("PATTERN is required when DIR is given")
+        if not watch_specs:
+            parser.error("Specify DIR and PATTERN or at least one --watch")
 
-        changes_queue = queue.Queue()
+        if self.shards > 1 and (self.state_file or self.poll_interval):
+            parser.error("--shards cannot be combined with --state-file or --poll-interval")
 
-        stop_sentinel = object()
-        def stdin_watch():
-            while sys.stdin.read():
-                pass
-            changes_queue.put(stop_sentinel)
+        watch_set = WatchSet.from_specs(watch_specs, native_query=self.native_query,
+                                        include=self.include, exclude=self.exclude,
+                                        exclude_dirs=self.exclude_dir)
 
-        stdin_watch_thread = threading.Thread(target=stdin_watch)
+        Observer = None
+        engine = 'inotify' if self.observer_class == 'inotify' else 'watchdog'
+        if engine == 'watchdog':
+            try:
+                Observer = self.load_observer(self.observer_class)
+            except:
+                parser.error("Watchdog observer implementation not found")
+
+        writer = BufferedWriter(self._out, max_bytes=self.output_buffer,
+                                max_delay=self.output_delay_ms / 1000,
+                                max_queue=self.output_queue)
+
+        options = dict((key, getattr(self, key)) for key in self.PIPELINE_OPTIONS)
+        pipeline = ObserverPipeline(watch_set, writer.write, engine=engine,
+                                    observer_class=Observer, **options)
+
+        for name in ('messages', 'bytes', 'writes', 'stalls', 'stalled_time'):
+            pipeline.metrics.gauge('output_' + name, lambda name=name: getattr(writer, name))
+
+        # The signal handler runs on the main thread, which is the consumer
+        # of the pipeline. The dump is written by another thread.
+        metrics_dump = MetricsDump(pipeline.metrics, sys.stderr)
+        metrics_dump.start()
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, metrics_dump.request)
+
+        # Commands are read from stdin as BSON documents (see control.py),
+        # EOF stops the observer.
+        def log(message):
+            sys.stderr.write(message + '\n')
+            sys.stderr.flush()
+
+        stdin_watch_thread = threading.Thread(target=serve, args=(self._control, pipeline, log))
         stdin_watch_thread.start()
 
-        pattern = self.query
-        if not self.native_query:
-            pattern = '*/' + pattern
-
-        event_handler = EventHandler(pattern, changes_queue)
-
-        observer = Observer()
-        observer.schedule(event_handler, self.directory, recursive=True)
-        observer.start()
-
-        factory = MessageFactory()
-
-        for root, dirs, files in os.walk(os.path.abspath(self.directory)):
-            paths = [os.path.join(root, f) for f in files]
-            inserts = tuple(filter_paths(paths, included_patterns=[pattern], case_sensitive=False))
-            if len(inserts):
-                changes_queue.put((tuple(), tuple(inserts)))
+        writer.start()
+        try:
+            pipeline.run()
+        finally:
+            metrics_dump.close()
+            writer.close()
 
-        while True:
-            try:
-                item = changes_queue.get(timeout=1000)
-                if item == stop_sentinel:
-                    break
-
-                (deletable_paths, insertable_paths) = item
-
-                insertable_meta = []
-                insertable_paths_ok = []
-                for path in insertable_paths[:]:
-                    try:
-                        insertable_meta.append({'stat': tuple(os.stat(path))})
-                        insertable_paths_ok.append(path)
-                    except OSError:
-                        continue
-
-                for msg in factory.update(deletable_paths, tuple(insertable_paths_ok), tuple(insertable_meta)):
-                    self._out.write(msg)
-                    self._out.flush()
-
-                changes_queue.task_done()
-            except queue.Empty:
-                pass
-            except KeyboardInterrupt:
-                break
-
-        observer.stop()
-        observer.join()
         stdin_watch_thread.join()
 
 def main():
     cmd = WatchdogObserverCommand()
     sys.exit(cmd.run(sys.argv))
+
+def main_inotify():
+    cmd = WatchdogObserverCommand()
+    cmd.observer_class = 'inotify'
+    sys.exit(cmd.run(sys.argv))
@@ -0,0 +1,216 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import collections
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from spreadflow_observer_fs.batch import ChangeSet, StatPool
+from spreadflow_observer_fs.compat import fsencode
+from spreadflow_observer_fs.oid import create_oid_generator
+from spreadflow_observer_fs.protocol import MessageFactory
+
+# Forking a process with running threads is unsafe (e.g., the child blocks on
+# closing stdin while a thread of the parent is reading from it). Start
+# workers from a fresh interpreter where possible.
+try:
+    _mp = multiprocessing.get_context('spawn')
+except AttributeError:
+    _mp = multiprocessing
+
+
+class Shard(object):
+    """
+    Owns one slice of the repositories of a watch set and turns batches of
+    changes into messages. Runs inside a shard worker process.
+    """
+
+    def __init__(self, watch_set, encoder, chunk_size=None, chunk_bytes=None,
+                 oid='stat', hash_workers=4, hash_cache=100000,
+                 detect_renames=False, stat_workers=1):
+        self.watch_set = watch_set
+        self._oid_generator = create_oid_generator(oid, hash_workers, hash_cache)
+        self._stat_pool = StatPool(stat_workers)
+        self._factories = collections.OrderedDict(
+            (port, MessageFactory(port, chunk_size=chunk_size,
+                                  chunk_bytes=chunk_bytes,
+                                  oid_generator=self._oid_generator,
+                                  encoder=encoder,
+                                  detect_renames=detect_renames))
+            for port in watch_set.ports)
+
+    def __len__(self):
+        return sum(len(factory) for factory in self._factories.values())
+
+    def process(self, deleted_subtrees, entries):
+        """
+        Apply the entries of a ChangeSet after removing all known paths below
+        the deleted subtrees. Returns the list of messages.
+        """
+        changes = ChangeSet()
+        for dirpath in deleted_subtrees:
+            deletes = set()
+            for factory in self._factories.values():
+                deletes.update(factory.subtree(dirpath))
+            changes.add(tuple(deletes), ())
+        changes.add_entries(entries)
+
+        messages = []
+        (deletable_paths, insertable_paths, insertable_meta) = changes.resolve(self._stat_pool)
+        for port, deletes, inserts, meta in self.watch_set.route(deletable_paths, insertable_paths, insertable_meta):
+            messages.extend(self._factories[port].update(deletes, inserts, meta))
+        return messages
+
+    def close(self):
+        self._stat_pool.close()
+        self._oid_generator.close()
+
+
+def _run_shard(index, inbox, outbox, watch_set, encoder, options):
+    # Interrupts are handled by the parent, which stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    shard = Shard(watch_set, encoder, **options)
+    try:
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            outbox.put((index, shard.process(*item), len(shard)))
+    finally:
+        shard.close()
+        outbox.put((index, None, len(shard)))
+
+
+class ShardPool(object):
+    """
+    Distributes batches of changes over worker processes, each owning the
+    slice of the repositories selected by the shard key of a path.
+
+    With the 'path' key, paths are assigned by hash. With the 'directory'
+    key, all paths below the same top-level subdirectory of a root go to
+    the same worker, such that renames within it keep their oid with
+    detect_renames. Deleted subtrees are passed to all workers.
+
+    Messages produced by the workers are passed to emit() from a collector
+    thread in the parent. If a worker terminates unexpectedly, on_failure()
+    is called and further batches for it raise a RuntimeError.
+    """
+
+    KEYS = ('path', 'directory')
+
+    # Maximum number of batches waiting for a single worker.
+    MAX_PENDING = 8
+
+    def __init__(self, shards, watch_set, emit, encoder, options, key='path',
+                 on_failure=None):
+        if key not in self.KEYS:
+            raise ValueError("Unknown shard key {!r}".format(key))
+
+        self.shards = shards
+        self.key = key
+        self.entries = [0] * shards
+        self._roots = [os.path.join(root, '') for root in watch_set.roots()]
+        self._emit = emit
+        self._on_failure = on_failure
+        self._closing = False
+        self._outbox = _mp.Queue()
+        self._inboxes = [_mp.Queue(self.MAX_PENDING) for _ in range(shards)]
+        self._processes = [
+            _mp.Process(target=_run_shard,
+                        args=(index, inbox, self._outbox, watch_set, encoder, options))
+            for index, inbox in enumerate(self._inboxes)]
+        self._collector = threading.Thread(target=self._collect)
+        self._collector.daemon = True
+
+    def __len__(self):
+        return sum(self.entries)
+
+    def _key(self, path):
+        if self.key == 'directory':
+            for root in self._roots:
+                if path.startswith(root):
+                    relpath = path[len(root):]
+                    return relpath.split(os.sep, 1)[0] if os.sep in relpath else ''
+        return path
+
+    def shard(self, path):
+        return (zlib.crc32(fsencode(self._key(path))) & 0xffffffff) % self.shards
+
+    def submit(self, changes):
+        """
+        Split a ChangeSet by shard and queue the parts for the workers.
+        Blocks while a worker has MAX_PENDING batches waiting.
+        """
+        parts = [[] for _ in range(self.shards)]
+        for entry in changes.entries():
+            parts[self.shard(entry[0])].append(entry)
+
+        deleted_subtrees = tuple(changes.deleted_subtrees)
+        for index, entries in enumerate(parts):
+            if entries or deleted_subtrees:
+                self._put(index, (deleted_subtrees, entries))
+
+    def _put(self, index, item):
+        while True:
+            try:
+                self._inboxes[index].put(item, timeout=1)
+                return
+            except queue.Full:
+                if not self._processes[index].is_alive():
+                    raise RuntimeError("Shard worker {:d} is not running".format(index))
+
+    def _finished(self, index):
+        if not self._closing and self._on_failure:
+            self._on_failure(index)
+
+    def _collect(self):
+        running = set(range(self.shards))
+        exited = set()
+        while running:
+            try:
+                (index, messages, entries) = self._outbox.get(timeout=1)
+            except queue.Empty:
+                # Workers which were killed do not report back. Give those
+                # which just exited another round to deliver their output.
+                for index in sorted(running):
+                    if self._processes[index].is_alive():
+                        continue
+                    if index in exited:
+                        running.discard(index)
+                        self._finished(index)
+                    exited.add(index)
+                continue
+
+            self.entries[index] = entries
+            if messages is None:
+                running.discard(index)
+                self._finished(index)
+                continue
+            for msg in messages:
+                self._emit(msg)
+
+    def start(self):
+        for process in self._processes:
+            process.daemon = True
+            process.start()
+        self._collector.start()
+
+    def close(self):
+        """
+        Let the workers finish pending batches and wait for their output.
+        """
+        self._closing = True
+        for index, process in enumerate(self._processes):
+            if process.is_alive():
+                self._inboxes[index].put(None)
+        self._collector.join()
+        for process in self._processes:
+            process.join()
@@ -2,20 +2,171 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import threading
+from bson import BSON
 from spreadflow_core.remote import MessageHandler, SchedulerClientFactory, \
     SchedulerProtocol, ClientEndpointMixin, StrportGeneratorMixin
 from spreadflow_format_bson import MessageParser
+from spreadflow_observer_fs.control import execute
+from spreadflow_observer_fs.pipeline import ObserverPipeline
+from spreadflow_observer_fs.watch import WatchSet
+from twisted.internet import defer
+from twisted.python import log
+
+
+class FilesystemObserverPort(object):
+    """
+    Source for the deltas of an additional watch of a FilesystemObserverSource.
+    """
+
+    def __call__(self, item, send):
+        send(item, self)
+
 
 class FilesystemObserverSource(ClientEndpointMixin, StrportGeneratorMixin):
+    """
+    Source for the deltas reported by an observer process.
+
+    The snapshot(), rescan(), pause() and resume() methods send commands to
+    the running observer (see control.py). Snapshots are delivered as items
+    of type 'snapshot'.
+    """
+
+    def __init__(self, query, directory, watches=(), **kwds):
+        args = [directory, query]
+        self.ports = {}
+        for port, watch_directory, watch_query in watches:
+            args += [port, watch_directory, watch_query]
+            self.ports[port] = FilesystemObserverPort()
+        if kwds.get('metrics_port'):
+            self.ports[kwds['metrics_port']] = FilesystemObserverPort()
 
-    def __init__(self, query, directory, **kwds):
         self.strport = self.strport_generate('spreadflow-observer-fs',
-                                             directory, query, **kwds)
+                                             *args, **kwds)
+
+    def port(self, name):
+        return self.ports[name]
+
+    def _command(self, command):
+        peer = getattr(self, 'peer', None)
+        if peer is None or peer.transport is None:
+            raise RuntimeError("The observer is not running")
+        peer.transport.write(BSON.encode(command))
+
+    def snapshot(self):
+        """
+        Request all known objects as snapshot items, e.g., after the state
+        of the flow was lost.
+        """
+        self._command({'command': 'snapshot'})
+
+    def rescan(self, path):
+        """
+        Reconcile the known objects below path with the filesystem.
+        """
+        self._command({'command': 'rescan', 'path': path})
+
+    def pause(self):
+        self._command({'command': 'pause'})
+
+    def resume(self):
+        self._command({'command': 'resume'})
 
     def get_client_protocol_factory(self, scheduler, reactor):
-        handler = MessageHandler(scheduler, {'default': self})
+        port_map = {'default': self}
+        port_map.update(self.ports)
+        handler = MessageHandler(scheduler, port_map)
         return SchedulerClientFactory.forProtocol(
             SchedulerProtocol, handler=handler, parser_factory=MessageParser)
 
     def __call__(self, item, send):
         send(item, self)
+
+
+class _ReactorBatchEmitter(object):
+    """
+    Collects messages emitted from the observer thread and delivers them in
+    batches on the reactor thread.
+    """
+
+    def __init__(self, reactor, deliver):
+        self._reactor = reactor
+        self._deliver = deliver
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def __call__(self, msg):
+        with self._lock:
+            self._pending.append(msg)
+            if len(self._pending) > 1:
+                return
+        self._reactor.callFromThread(self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        for msg in pending:
+            self._deliver(msg)
+
+
+class InProcessFilesystemObserverSource(FilesystemObserverSource):
+    """
+    Filesystem observer source running the observer in a thread of the
+    Twisted process instead of a child process.
+
+    Delta items are handed to the scheduler directly without being encoded
+    and piped. Keyword arguments are the options of ObserverPipeline (e.g.,
+    scan_workers, oid or state_file).
+    """
+
+    def __init__(self, query, directory, watches=(), native_query=True, include=None,
+                 exclude=None, exclude_dirs=None, **options):
+        kwds = {}
+        if options.get('metrics_port'):
+            kwds['metrics_port'] = options['metrics_port']
+        super(InProcessFilesystemObserverSource, self).__init__(query, directory, watches, **kwds)
+        specs = [('default', directory, query)] + list(watches)
+        self.watch_set = WatchSet.from_specs(specs, native_query=native_query,
+                                             include=include, exclude=exclude,
+                                             exclude_dirs=exclude_dirs)
+        self.options = options
+        self._pipeline = None
+        self._stopped = None
+
+    def attach(self, scheduler, reactor):
+        port_map = {'default': self}
+        port_map.update(self.ports)
+
+        def deliver(msg):
+            scheduler.send(msg['item'], port_map[msg['port']])
+
+        emit = _ReactorBatchEmitter(reactor, deliver)
+        self._pipeline = ObserverPipeline(self.watch_set, emit, encoder=None,
+                                          log=log.msg, **self.options)
+        self._stopped = defer.Deferred()
+
+        def run():
+            try:
+                self._pipeline.run()
+            finally:
+                reactor.callFromThread(self._stopped.callback, None)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+        return defer.succeed(None)
+
+    def _command(self, command):
+        if self._pipeline is None:
+            raise RuntimeError("The observer is not running")
+        execute(self._pipeline, command)
+
+    def detach(self):
+        if self._pipeline is None:
+            return defer.succeed(None)
+
+        self._pipeline.stop()
+        self._pipeline = None
+        return self._stopped
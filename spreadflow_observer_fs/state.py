@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+from bson import BSON, decode_file_iter
+from bson.errors import InvalidBSON
+
+
+def _listify(value):
+    return list(value) if isinstance(value, (list, tuple)) else value
+
+
+class StateFile(object):
+    """
+    Persists repository snapshots as a stream of BSON documents.
+
+    The first document is a header identifying the format version, the
+    watches (port, directory and patterns) and the oid
+    strategy. A snapshot recorded with different parameters is ignored on
+    load.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path, watches, oid=None):
+        self.path = path
+        self.watches = [list(map(_listify, watch)) for watch in watches]
+        self.oid = oid
+
+    def _header(self):
+        return {
+            'version': self.VERSION,
+            'watches': self.watches,
+            'oid': self.oid
+        }
+
+    def load(self):
+        """
+        Return a dict mapping port names to lists of (path, oid, fingerprint)
+        tuples. The dict is empty if no compatible snapshot exists.
+        """
+        snapshots = {}
+
+        try:
+            stream = open(self.path, 'rb')
+        except IOError:
+            return snapshots
+
+        with stream:
+            try:
+                docs = decode_file_iter(stream)
+                header = next(docs, None)
+                if header != self._header():
+                    return {}
+
+                for doc in docs:
+                    snapshots.setdefault(doc['port'], []).append(
+                        (doc['path'], doc['oid'], doc.get('stat')))
+            except (InvalidBSON, KeyError):
+                return {}
+
+        return snapshots
+
+    def save(self, snapshots):
+        """
+        Atomically replace the snapshot with the given dict mapping port names
+        to lists of (path, oid, fingerprint) tuples.
+        """
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'wb') as stream:
+            stream.write(BSON.encode(self._header()))
+            for port, entries in snapshots.items():
+                for path, oid, fingerprint in entries:
+                    doc = {'port': port, 'path': path, 'oid': oid}
+                    if fingerprint is not None:
+                        doc['stat'] = fingerprint
+                    stream.write(BSON.encode(doc))
+            stream.flush()
+            os.fsync(stream.fileno())
+
+        os.rename(tmppath, self.path)
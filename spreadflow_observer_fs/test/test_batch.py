@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for change batching and the stat stage.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import fixtures
+import os
+import unittest
+
+from spreadflow_observer_fs.batch import ChangeSet, ScanChunk, ScanFilter, StatPool, SubtreeChange
+
+
+class ChangeSetTestCase(unittest.TestCase):
+    """
+    Unit tests for merging queue items into a batch.
+    """
+
+    def test_resolve(self):
+        """
+        Later items win, known stat results are reused and paths which cannot
+        be stat'ed end up as deletes.
+        """
+        with fixtures.TempDir() as fix:
+            existing = os.path.join(fix.path, 'a.txt')
+            missing = os.path.join(fix.path, 'b.txt')
+            scanned = os.path.join(fix.path, 'c.txt')
+            with open(existing, 'w') as stream:
+                stream.write('a')
+
+            changes = ChangeSet()
+            changes.add((existing,), (existing,))
+            changes.add((), (missing,))
+            changes.add((), (scanned,), ((1, 2, 3),))
+            changes.add((existing,), ())
+            changes.add((existing,), (existing,))
+            self.assertEqual(len(changes), 3)
+
+            for workers in (1, 4):
+                pool = StatPool(workers)
+                deletes, inserts, meta = changes.resolve(pool)
+                pool.close()
+
+                self.assertEqual(sorted(deletes), sorted([existing, missing, scanned]))
+                self.assertEqual(inserts, (scanned, existing))
+                self.assertEqual(meta, (
+                    {'stat': (1, 2, 3)},
+                    {'stat': tuple(os.stat(existing))},
+                ))
+
+    def test_subtree(self):
+        """
+        Pending paths below a directory are found, siblings sharing a name
+        prefix are not.
+        """
+        changes = ChangeSet()
+        changes.add(('/x/d/a',), ('/x/d/e/b', '/x/dd/c', '/x/a'))
+        self.assertEqual(changes.subtree('/x/d'), ['/x/d/a', '/x/d/e/b'])
+        self.assertEqual(changes.subtree('/y'), [])
+
+    def test_scan_filter(self):
+        """
+        Scan results for paths and directories changed by live events are
+        dropped.
+        """
+        scan_filter = ScanFilter()
+        chunk = ScanChunk(('/x/a', '/x/b', '/x/d/c', '/x/dd/e'), (1, 2, 3, 4))
+        self.assertEqual(scan_filter.filter(chunk), (chunk.paths, chunk.stats))
+
+        scan_filter.live(('/x/b',))
+        scan_filter.live_subtree(SubtreeChange('/x/d', None))
+        self.assertEqual(scan_filter.filter(chunk), (('/x/a', '/x/dd/e'), (1, 4)))
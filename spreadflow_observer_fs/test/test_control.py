@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the control channel.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import io
+import unittest
+
+from bson import BSON
+
+from spreadflow_observer_fs.control import read_commands, serve
+
+
+class RecordingPipeline(object):
+    """
+    Records the control methods called on it.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name not in ('snapshot', 'rescan', 'pause', 'resume', 'stop'):
+            raise AttributeError(name)
+        return lambda *args: self.calls.append((name,) + args)
+
+
+class ControlTestCase(unittest.TestCase):
+    """
+    Unit tests for the control channel.
+    """
+
+    def test_read_commands(self):
+        """
+        Commands are read as BSON documents until EOF.
+        """
+        data = BSON.encode({'command': 'snapshot'}) + BSON.encode({'command': 'pause'})
+        self.assertEqual(list(read_commands(io.BytesIO(data))),
+                         [{'command': 'snapshot'}, {'command': 'pause'}])
+        self.assertEqual(list(read_commands(io.BytesIO(b''))), [])
+
+        with self.assertRaises(ValueError):
+            list(read_commands(io.BytesIO(data[:-1])))
+        with self.assertRaises(ValueError):
+            list(read_commands(io.BytesIO(b'not bson\n')))
+
+    def test_serve(self):
+        """
+        Commands are dispatched to the pipeline, invalid ones are logged.
+        The pipeline is stopped on EOF, also after malformed input.
+        """
+        data = b''.join(BSON.encode(command) for command in (
+            {'command': 'pause'},
+            {'command': 'rescan', 'path': '/some/directory'},
+            {'command': 'rescan'},
+            {'command': 'unknown'},
+            {'command': 'snapshot'},
+            {'command': 'resume'},
+        ))
+
+        pipeline = RecordingPipeline()
+        log = []
+        serve(io.BytesIO(data), pipeline, log.append)
+        self.assertEqual(pipeline.calls, [
+            ('pause',),
+            ('rescan', '/some/directory'),
+            ('snapshot',),
+            ('resume',),
+            ('stop',),
+        ])
+        self.assertEqual(len(log), 2)
+
+        pipeline = RecordingPipeline()
+        log = []
+        serve(io.BytesIO(b'garbage' * 1000), pipeline, log.append)
+        self.assertEqual(pipeline.calls, [('stop',)])
+        self.assertEqual(len(log), 1)
+
+    def test_serve_invalid_path(self):
+        """
+        Rescan paths other than strings are rejected, the pipeline is still
+        stopped on EOF.
+        """
+        data = b''.join(BSON.encode(command) for command in (
+            {'command': 'rescan', 'path': 5},
+            {'command': 'rescan', 'path': b'/some/directory'},
+        ))
+
+        pipeline = RecordingPipeline()
+        log = []
+        serve(io.BytesIO(data), pipeline, log.append)
+        self.assertEqual(pipeline.calls, [('stop',)])
+        self.assertEqual(len(log), 2)
+
+    def test_serve_unexpected_error(self):
+        """
+        The pipeline is stopped if a command fails unexpectedly.
+        """
+        class FailingPipeline(RecordingPipeline):
+            def snapshot(self):
+                raise RuntimeError("snapshot failed")
+
+        pipeline = FailingPipeline()
+        with self.assertRaises(RuntimeError):
+            serve(io.BytesIO(BSON.encode({'command': 'snapshot'})), pipeline, lambda message: None)
+        self.assertEqual(pipeline.calls, [('stop',)])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the watchdog event handler.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import unittest
+
+from watchdog.events import DirCreatedEvent, DirDeletedEvent, \
+    DirModifiedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent, \
+    FileModifiedEvent, FileMovedEvent
+
+from spreadflow_observer_fs.batch import SubtreeChange
+from spreadflow_observer_fs.matcher import PatternMatcher
+from spreadflow_observer_fs.handler import EventHandler
+
+
+class EventHandlerTestCase(unittest.TestCase):
+    """
+    Unit tests for the watchdog event handler.
+    """
+
+    def _drain(self, changes_queue):
+        items = []
+        while not changes_queue.empty():
+            items.append(changes_queue.get_nowait())
+        return items
+
+    def test_flush_immediately(self):
+        """
+        Without debounce interval every event is reported right away.
+        """
+        changes_queue = queue.Queue()
+        handler = EventHandler(PatternMatcher(['*/*.txt']), changes_queue)
+
+        handler.dispatch(FileCreatedEvent('/x/a.txt'))
+        handler.dispatch(FileCreatedEvent('/x/a.dat'))
+        handler.dispatch(FileMovedEvent('/x/a.txt', '/x/b.txt'))
+
+        self.assertEqual(self._drain(changes_queue), [
+            (('/x/a.txt',), ('/x/a.txt',)),
+            (('/x/a.txt', '/x/b.txt'), ('/x/b.txt',)),
+        ])
+
+    def test_coalesce(self):
+        """
+        Within the debounce interval events are collapsed into their net effect.
+        """
+        changes_queue = queue.Queue()
+        handler = EventHandler(PatternMatcher(['*/*.txt']), changes_queue, debounce=60)
+
+        handler.dispatch(FileCreatedEvent('/x/a.txt'))
+        handler.dispatch(FileModifiedEvent('/x/a.txt'))
+        handler.dispatch(FileCreatedEvent('/x/b.txt'))
+        handler.dispatch(FileModifiedEvent('/x/a.txt'))
+        handler.dispatch(FileDeletedEvent('/x/b.txt'))
+        self.assertTrue(changes_queue.empty())
+
+        handler.flush()
+        self.assertEqual(self._drain(changes_queue), [
+            (('/x/a.txt', '/x/b.txt'), ('/x/a.txt',)),
+        ])
+
+    def test_max_batch(self):
+        """
+        Pending changes are reported early when the batch limit is reached.
+        """
+        changes_queue = queue.Queue()
+        handler = EventHandler(PatternMatcher(['*/*.txt']), changes_queue, debounce=60, max_batch=2)
+
+        handler.dispatch(FileCreatedEvent('/x/a.txt'))
+        handler.dispatch(FileModifiedEvent('/x/a.txt'))
+        self.assertTrue(changes_queue.empty())
+        handler.dispatch(FileCreatedEvent('/x/b.txt'))
+
+        self.assertEqual(self._drain(changes_queue), [
+            (('/x/a.txt', '/x/b.txt'), ('/x/a.txt', '/x/b.txt')),
+        ])
+        handler.flush()
+
+    def test_directory_events(self):
+        """
+        Directory events are reported as one subtree change each, after the
+        pending file changes. Synthesized events for their contents are
+        ignored.
+        """
+        changes_queue = queue.Queue()
+        handler = EventHandler(PatternMatcher(['*/*.txt'], exclude_dirs=['*/tmp']),
+                               changes_queue, debounce=60)
+
+        handler.dispatch(FileCreatedEvent('/x/a.txt'))
+        handler.dispatch(DirMovedEvent('/x/d', '/x/e'))
+        handler.dispatch(FileMovedEvent('/x/d/b.txt', '/x/e/b.txt', is_synthetic=True))
+        handler.dispatch(DirModifiedEvent('/x'))
+        handler.dispatch(DirMovedEvent('/x/e', '/x/tmp'))
+        handler.dispatch(DirDeletedEvent('/x/f'))
+        handler.dispatch(DirCreatedEvent('/x/g'))
+        handler.dispatch(DirCreatedEvent('/x/tmp'))
+
+        self.assertEqual(self._drain(changes_queue), [
+            (('/x/a.txt',), ('/x/a.txt',)),
+            SubtreeChange('/x/d', '/x/e'),
+            SubtreeChange('/x/e', None),
+            SubtreeChange('/x/f', None),
+            SubtreeChange(None, '/x/g'),
+        ])
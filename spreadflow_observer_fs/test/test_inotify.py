@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the inotify engine.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import fixtures
+import os
+import struct
+import sys
+import unittest
+
+from spreadflow_observer_fs.batch import SubtreeChange
+from spreadflow_observer_fs.inotify import InotifyObserver, parse_events, \
+    IN_CREATE, IN_Q_OVERFLOW
+from spreadflow_observer_fs.matcher import PatternMatcher
+from spreadflow_observer_fs.scanner import DirectoryScanner
+
+
+def _event(wd, mask, name=b''):
+    if name:
+        name += b'\0' * (16 - len(name))
+    return struct.pack(str('iIII'), wd, mask, 0, len(name)) + name
+
+
+class ParseEventsTestCase(unittest.TestCase):
+    """
+    Unit tests for parsing raw inotify events.
+    """
+
+    def test_parse_events(self):
+        """
+        Events are parsed in bulk, name padding is stripped.
+        """
+        buf = _event(1, IN_CREATE, b'a.txt') + _event(-1, IN_Q_OVERFLOW)
+        self.assertEqual(list(parse_events(buf)), [
+            (1, IN_CREATE, 0, b'a.txt'),
+            (-1, IN_Q_OVERFLOW, 0, b''),
+        ])
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "inotify is only available on Linux")
+class InotifyObserverTestCase(unittest.TestCase):
+    """
+    Unit tests for the inotify engine.
+    """
+
+    def _touch(self, path):
+        with open(path, 'w'):
+            pass
+
+    def _start(self, directory):
+        items = queue.Queue()
+        resyncs = []
+        observer = InotifyObserver(PatternMatcher(['*.txt']), [directory], items.put,
+                                   lambda dirpath, reason: resyncs.append(dirpath))
+        observer.start()
+        self.addCleanup(observer.stop)
+        scanner = DirectoryScanner(PatternMatcher(['*.txt']), directory_callback=observer.watch)
+        scanner.scan([directory], lambda paths, stats: None)
+        return observer, items, resyncs
+
+    def test_events(self):
+        """
+        File changes are coalesced, directory events reported as subtree
+        changes. Watches are added by the scanner.
+        """
+        with fixtures.TempDir() as fix:
+            os.mkdir(os.path.join(fix.path, 'sub'))
+            observer, items, _ = self._start(fix.path)
+            self.assertEqual(len(observer), 2)
+
+            path = os.path.join(fix.path, 'sub', 'a.txt')
+            self._touch(path)
+            self._touch(os.path.join(fix.path, 'ignored.dat'))
+            self.assertEqual(items.get(timeout=5), ((path,), (path,)))
+
+            # Create and close may be reported in separate reads.
+            os.unlink(path)
+            item = items.get(timeout=5)
+            while item == ((path,), (path,)):
+                item = items.get(timeout=5)
+            self.assertEqual(item, ((path,), ()))
+
+            os.rename(os.path.join(fix.path, 'sub'), os.path.join(fix.path, 'moved'))
+            self.assertEqual(items.get(timeout=5), SubtreeChange(os.path.join(fix.path, 'sub'), None))
+            self.assertEqual(items.get(timeout=5), SubtreeChange(None, os.path.join(fix.path, 'moved')))
+            self.assertEqual(len(observer), 1)
+
+    def test_overflow(self):
+        """
+        A queue overflow triggers a resync of all roots.
+        """
+        with fixtures.TempDir() as fix:
+            observer, _, resyncs = self._start(fix.path)
+            observer._process(_event(-1, IN_Q_OVERFLOW)) #pylint: disable=protected-access
+            self.assertEqual(resyncs, [None])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the priority lanes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import threading
+import unittest
+
+from spreadflow_observer_fs.lanes import Lanes
+
+
+class LanesTestCase(unittest.TestCase):
+    """
+    Unit tests for the priority lanes.
+    """
+
+    def test_priority(self):
+        """
+        Items are returned by lane priority, in FIFO order within a lane.
+        """
+        lanes = Lanes()
+        lanes.put('bulk', Lanes.BULK)
+        lanes.put('resync', Lanes.RESYNC)
+        lanes.put('live-1')
+        lanes.put('live-2', Lanes.LIVE)
+        self.assertEqual(lanes.qsize(), 4)
+        self.assertEqual(lanes.qsize(Lanes.LIVE), 2)
+
+        self.assertEqual(lanes.get_nowait((Lanes.RESYNC, Lanes.BULK)), (Lanes.RESYNC, 'resync'))
+        self.assertEqual([lanes.get(timeout=0) for _ in range(3)], [
+            (Lanes.LIVE, 'live-1'),
+            (Lanes.LIVE, 'live-2'),
+            (Lanes.BULK, 'bulk'),
+        ])
+        self.assertRaises(queue.Empty, lanes.get_nowait)
+
+    def test_get_blocks(self):
+        """
+        get() waits for an item on one of the requested lanes.
+        """
+        lanes = Lanes()
+        lanes.put('bulk', Lanes.BULK)
+        self.assertRaises(queue.Empty, lanes.get, (Lanes.LIVE,), 0.05)
+
+        timer = threading.Timer(0.05, lanes.put, ('live',))
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertEqual(lanes.get((Lanes.LIVE,), timeout=5), (Lanes.LIVE, 'live'))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the compiled pattern matcher.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import itertools
+import unittest
+
+from pathtools.patterns import match_path
+
+from spreadflow_observer_fs.matcher import PatternMatcher
+
+
+class PatternMatcherTestCase(unittest.TestCase):
+    """
+    Unit tests for the compiled pattern matcher.
+    """
+
+    PATHS = (
+        '/a.txt', '/x/a.txt', '/x/A.TXT', '/x/a.txt.bak', '/x/y/b.jpg',
+        '/x/tmp/c.txt', '/x/tmpfile.txt', '/x/.txt', '/x/foo/bar.txt',
+        '/x/foo.txt', 'a.txt', '/x/[a].txt', '/x/a?txt',
+    )
+
+    PATTERNS = (
+        ['*/*.txt'], ['*.txt'], ['*/*.txt', '*/*.jpg'], ['*/foo*.txt'],
+        ['*/a.txt'], ['*/?.txt'], ['*/[ab].*'], ['*/*/*.txt'], ['*'],
+    )
+
+    def test_matches_like_pathtools(self):
+        """
+        Compiled patterns behave like pathtools.patterns.match_path.
+        """
+        excludes = ([], ['*/*.bak'], ['*/tmp*'])
+        for patterns, exclude_patterns, case_sensitive in itertools.product(
+                self.PATTERNS, excludes, (False, True)):
+            matcher = PatternMatcher(patterns, exclude_patterns=exclude_patterns,
+                                     case_sensitive=case_sensitive)
+            for path in self.PATHS:
+                expected = match_path(path, included_patterns=patterns,
+                                      excluded_patterns=exclude_patterns,
+                                      case_sensitive=case_sensitive)
+                self.assertEqual(matcher.matches(path), expected,
+                                 '{0!r} {1!r} {2!r}'.format(path, patterns, exclude_patterns))
+
+    def test_exclude_dirs(self):
+        """
+        Excluded directories are pruned and files below them do not match.
+        """
+        matcher = PatternMatcher(['*/*.txt'], exclude_dirs=['*/tmp', '*/.git'])
+        self.assertTrue(matcher.prune('/x/tmp'))
+        self.assertTrue(matcher.prune('/x/.GIT'))
+        self.assertFalse(matcher.prune('/x/tmpfile'))
+        self.assertFalse(matcher.matches('/x/tmp/c.txt'))
+        self.assertTrue(matcher.matches('/x/tmpfile.txt'))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the metrics registry.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import io
+import os
+import signal
+import threading
+import time
+import unittest
+
+from spreadflow_observer_fs.metrics import Histogram, Metrics, MetricsDump
+
+
+class MetricsTestCase(unittest.TestCase):
+    """
+    Unit tests for counters, gauges and histograms.
+    """
+
+    def test_histogram(self):
+        """
+        Percentiles are reported as the upper bound of their bucket, capped
+        by the maximum.
+        """
+        histogram = Histogram()
+        for _ in range(98):
+            histogram.observe(0.000003)
+        histogram.observe(0.001)
+        histogram.observe(0.5)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        self.assertEqual(snapshot['max'], 0.5)
+        self.assertEqual(snapshot['p50'], 0.000004)
+        self.assertEqual(snapshot['p90'], 0.000004)
+        self.assertEqual(snapshot['p99'], 0.001024)
+        self.assertEqual(Histogram().percentile(0.5), 0)
+
+    def test_snapshot(self):
+        """
+        A snapshot contains counters, evaluated gauges and histograms.
+        """
+        metrics = Metrics()
+        metrics.incr('events')
+        metrics.incr('events', 2)
+        metrics.gauge('depth', lambda: 7)
+        with metrics.timer('stage'):
+            pass
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'events': 3})
+        self.assertEqual(snapshot['gauges'], {'depth': 7})
+        self.assertEqual(snapshot['histograms']['stage']['count'], 1)
+        self.assertEqual(metrics.counter('events'), 3)
+        self.assertEqual(metrics.counter('unknown'), 0)
+
+        text = metrics.format()
+        self.assertIn('events: 3', text)
+        self.assertIn('depth: 7', text)
+        self.assertIn('stage: count=1', text)
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR1'), "SIGUSR1 is not available")
+    def test_dump_signal(self):
+        """
+        Dumps requested from a signal handler do not deadlock the main thread
+        while it is busy updating the metrics.
+        """
+        metrics = Metrics()
+        out = io.StringIO()
+        dump = MetricsDump(metrics, out)
+        dump.start()
+        previous = signal.signal(signal.SIGUSR1, dump.request)
+        self.addCleanup(signal.signal, signal.SIGUSR1, previous)
+
+        def send():
+            for _ in range(50):
+                os.kill(os.getpid(), signal.SIGUSR1)
+                time.sleep(0.002)
+
+        sender = threading.Thread(target=send)
+        sender.start()
+        while sender.is_alive():
+            metrics.incr('events')
+            metrics.observe('stage', 0.001)
+        sender.join()
+
+        deadline = time.time() + 5
+        while 'events' not in out.getvalue() and time.time() < deadline:
+            time.sleep(0.01)
+        dump.close()
+        self.assertIn('Metrics after', out.getvalue())
+        self.assertIn('events', out.getvalue())
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the object id strategies.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import fixtures
+import os
+import unittest
+
+from spreadflow_observer_fs.oid import ContentOidGenerator, StatOidGenerator
+
+
+class StatOidGeneratorTestCase(unittest.TestCase):
+    """
+    Unit tests for the stat based oid strategy.
+    """
+
+    def test_oids(self):
+        """
+        Oids depend on path and stat fields except the access time.
+        """
+        generate = StatOidGenerator()
+        stat = (33188, 10, 20, 1, 1000, 1000, 5, 100, 200, 300)
+        atime = stat[:7] + (101,) + stat[8:]
+        mtime = stat[:8] + (201,) + stat[9:]
+
+        oids = generate([
+            {'path': '/a', 'stat': stat},
+            {'path': '/a', 'stat': atime},
+            {'path': '/a', 'stat': mtime},
+            {'path': '/b', 'stat': stat},
+        ])
+
+        self.assertEqual(len(oids[0]), 40)
+        self.assertEqual(oids[0], oids[1])
+        self.assertEqual(len(set(oids)), 3)
+
+
+class ContentOidGeneratorTestCase(unittest.TestCase):
+    """
+    Unit tests for the content based oid strategy.
+    """
+
+    def test_oids(self):
+        """
+        Oids depend on path and contents only, unreadable files fall back to
+        stat based oids.
+        """
+        with fixtures.TempDir() as fix:
+            path_a = os.path.join(fix.path, 'a')
+            path_b = os.path.join(fix.path, 'b')
+            for path in (path_a, path_b):
+                with open(path, 'wb') as stream:
+                    stream.write(b'same')
+
+            for workers in (1, 2):
+                generate = ContentOidGenerator(workers=workers, cache_size=1)
+                meta_a = {'path': path_a, 'stat': tuple(os.stat(path_a))}
+                meta_b = {'path': path_b, 'stat': tuple(os.stat(path_b))}
+                touched_a = {'path': path_a, 'stat': meta_a['stat'][:8] + (0, 0)}
+                missing = {'path': os.path.join(fix.path, 'c'), 'stat': meta_a['stat']}
+
+                oids = generate([meta_a, meta_b, touched_a, missing])
+                generate.close()
+
+                self.assertNotEqual(oids[0], oids[1])
+                self.assertEqual(oids[0], oids[2])
+                self.assertEqual(oids[3], StatOidGenerator()([missing])[0])
+
+    def test_cache(self):
+        """
+        Cached content digests are used for files with unchanged stat.
+        """
+        with fixtures.TempDir() as fix:
+            path = os.path.join(fix.path, 'a')
+            with open(path, 'wb') as stream:
+                stream.write(b'before')
+            meta = {'path': path, 'stat': tuple(os.stat(path))}
+
+            generate = ContentOidGenerator(workers=1)
+            before = generate([meta])
+
+            with open(path, 'wb') as stream:
+                stream.write(b'after!')
+            self.assertEqual(generate([meta]), before)
+
+            meta = {'path': path, 'stat': meta['stat'][:6] + (7,) + meta['stat'][7:]}
+            self.assertNotEqual(generate([meta]), before)
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the observer pipeline.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+import fixtures
+import os
+import sys
+import threading
+import time
+import unittest
+
+from watchdog.observers.api import BaseObserver, EventEmitter
+
+from spreadflow_observer_fs.batch import ScanChunk, ScanFilter, StatPool
+from spreadflow_observer_fs.lanes import Lanes
+from spreadflow_observer_fs.pipeline import ObserverPipeline
+from spreadflow_observer_fs.watch import WatchSet
+
+
+class SilentEmitter(EventEmitter):
+    """
+    Event emitter which never reports anything. Stops with an error on the
+    first call if the directory contains a file named 'crash'.
+    """
+
+    def queue_events(self, timeout):
+        if os.path.exists(os.path.join(self.watch.path, 'crash')):
+            os.unlink(os.path.join(self.watch.path, 'crash'))
+            raise OSError("Emitter failure")
+        time.sleep(timeout)
+
+
+class SilentObserver(BaseObserver):
+    """
+    Observer based on the silent event emitter.
+    """
+
+    def __init__(self):
+        super(SilentObserver, self).__init__(SilentEmitter)
+
+
+class ObserverPipelineTestCase(unittest.TestCase):
+    """
+    Unit tests for the observer pipeline.
+    """
+
+    def _touch(self, path):
+        with open(path, 'w'):
+            pass
+
+    def _start(self, directory, **options):
+        messages = []
+        watch_set = WatchSet.from_specs([('default', directory, '*.txt')])
+        pipeline = ObserverPipeline(watch_set, messages.append, encoder=None,
+                                    log=lambda msg: None,
+                                    observer_class=SilentObserver, **options)
+        pipeline.MONITOR_INTERVAL = 0.05
+        thread = threading.Thread(target=pipeline.run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(pipeline.stop)
+        return pipeline, messages
+
+    def _wait(self, messages, count):
+        deadline = time.time() + 10
+        while len(messages) < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(messages), count)
+
+    def _paths(self, item, key):
+        return sorted(item['data'][oid]['path'] for oid in item[key])
+
+    def test_resync(self):
+        """
+        A resync only reports the differences between the repository and the
+        directory contents.
+        """
+        with fixtures.TempDir() as fix:
+            for name in ('a.txt', 'b.txt'):
+                self._touch(os.path.join(fix.path, name))
+
+            pipeline, messages = self._start(fix.path)
+            self._wait(messages, 1)
+
+            os.unlink(os.path.join(fix.path, 'a.txt'))
+            self._touch(os.path.join(fix.path, 'c.txt'))
+            pipeline.resync()
+            self._wait(messages, 2)
+
+            item = messages[1]['item']
+            self.assertEqual(len(item['deletes']), 1)
+            self.assertEqual(self._paths(item, 'inserts'), [os.path.join(fix.path, 'c.txt')])
+            self.assertEqual(pipeline.resyncs, 1)
+
+    def test_control(self):
+        """
+        Snapshots list all known objects, rescans are limited to watched
+        directories and messages are withheld while paused.
+        """
+        with fixtures.TempDir() as fix:
+            os.mkdir(os.path.join(fix.path, 'sub'))
+            paths = [os.path.join(fix.path, 'a.txt'), os.path.join(fix.path, 'sub', 'b.txt')]
+            for path in paths:
+                self._touch(path)
+
+            pipeline, messages = self._start(fix.path)
+            deadline = time.time() + 10
+            while sum(len(msg['item']['inserts']) for msg in messages) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            count = len(messages)
+
+            pipeline.snapshot()
+            self._wait(messages, count + 1)
+            item = messages[count]['item']
+            self.assertEqual(item['type'], 'snapshot')
+            self.assertTrue(item['first'] and item['last'])
+            self.assertEqual(self._paths(item, 'inserts'), paths)
+
+            with self.assertRaises(ValueError):
+                pipeline.rescan(os.path.dirname(fix.path))
+
+            pipeline.pause()
+            self._touch(os.path.join(fix.path, 'sub', 'c.txt'))
+            pipeline.rescan(os.path.join(fix.path, 'sub'))
+            time.sleep(0.2)
+            self.assertEqual(len(messages), count + 1)
+            self.assertTrue(pipeline.paused)
+
+            pipeline.resume()
+            self._wait(messages, count + 2)
+            item = messages[count + 1]['item']
+            self.assertEqual(item['deletes'], ())
+            self.assertEqual(self._paths(item, 'inserts'), [os.path.join(fix.path, 'sub', 'c.txt')])
+
+    def test_emitter_restart(self):
+        """
+        A failed event emitter is restarted and its directory resynced.
+        """
+        with fixtures.TempDir() as fix:
+            self._touch(os.path.join(fix.path, 'a.txt'))
+
+            pipeline, messages = self._start(fix.path)
+            self._wait(messages, 1)
+
+            os.unlink(os.path.join(fix.path, 'a.txt'))
+            self._touch(os.path.join(fix.path, 'b.txt'))
+            self._touch(os.path.join(fix.path, 'crash'))
+            self._wait(messages, 2)
+
+            item = messages[1]['item']
+            self.assertEqual(self._paths(item, 'deletes'), [os.path.join(fix.path, 'a.txt')])
+            self.assertEqual(self._paths(item, 'inserts'), [os.path.join(fix.path, 'b.txt')])
+            self.assertEqual(pipeline.resyncs, 1)
+
+    def test_scan_streaming(self):
+        """
+        The initial scan is reported in chunks of at most stat_batch paths.
+        """
+        with fixtures.TempDir() as fix:
+            paths = [os.path.join(fix.path, '{:d}.txt'.format(i)) for i in range(10)]
+            for path in paths:
+                self._touch(path)
+
+            _, messages = self._start(fix.path, stat_batch=3, scan_queue=1)
+            deadline = time.time() + 10
+            while sum(len(msg['item']['inserts']) for msg in messages) < 10 and time.time() < deadline:
+                time.sleep(0.01)
+
+            self.assertTrue(all(len(msg['item']['inserts']) <= 3 for msg in messages))
+            self.assertEqual(sorted(sum((self._paths(msg['item'], 'inserts') for msg in messages), [])),
+                             sorted(paths))
+
+    def test_scan_stale(self):
+        """
+        Live events win over scan results queued or merged later.
+        """
+        with fixtures.TempDir() as fix:
+            deleted = os.path.join(fix.path, 'a.txt')
+            scanned = os.path.join(fix.path, 'b.txt')
+            watch_set = WatchSet.from_specs([('default', fix.path, '*.txt')])
+            pipeline = ObserverPipeline(watch_set, None, encoder=None)
+            pipeline._scan_filter = ScanFilter() #pylint: disable=protected-access
+
+            queue = pipeline._changes_queue #pylint: disable=protected-access
+            queue.put(((deleted,), (deleted,)))
+            pipeline._scan_slots.put(None) #pylint: disable=protected-access
+            queue.put(ScanChunk((deleted, scanned), ((1,), (2,))))
+
+            (changes, stop) = pipeline._next_batch({}) #pylint: disable=protected-access
+            self.assertFalse(stop)
+            (deletes, inserts, meta) = changes.resolve(StatPool())
+            self.assertEqual(sorted(deletes), [deleted, scanned])
+            self.assertEqual(inserts, (scanned,))
+            self.assertEqual(meta, ({'stat': (2,)},))
+            self.assertEqual(pipeline.metrics.counter('scan_stale'), 1)
+
+    def test_priority(self):
+        """
+        Live changes are batched before queued backlog work, with at most one
+        chunk of backlog per batch. The initial scan is rate limited.
+        """
+        with fixtures.TempDir() as fix:
+            live = os.path.join(fix.path, 'live.txt')
+            scanned = [os.path.join(fix.path, '{:d}.txt'.format(i)) for i in range(4)]
+            watch_set = WatchSet.from_specs([('default', fix.path, '*.txt')])
+            pipeline = ObserverPipeline(watch_set, None, encoder=None, bulk_rate=10)
+            pipeline._scan_filter = ScanFilter() #pylint: disable=protected-access
+
+            queue = pipeline._changes_queue #pylint: disable=protected-access
+            for i in range(0, 4, 2):
+                pipeline._scan_slots.put(None) #pylint: disable=protected-access
+                queue.put(ScanChunk(scanned[i:i + 2], ((1,), (2,))), Lanes.BULK)
+            queue.put(((live,), (live,)))
+
+            (changes, _) = pipeline._next_batch({}) #pylint: disable=protected-access
+            self.assertEqual([path for path, _ in changes.entries()], [live] + scanned[:2])
+
+            # The second chunk is held back by the rate limit.
+            with self.assertRaises(Empty):
+                pipeline._next_batch({}) #pylint: disable=protected-access
+            self.assertEqual(queue.qsize(Lanes.BULK), 1)
+
+    def test_poll(self):
+        """
+        With a poll interval, changes are picked up by the directory poller.
+        """
+        with fixtures.TempDir() as fix:
+            self._touch(os.path.join(fix.path, 'a.txt'))
+
+            pipeline, messages = self._start(fix.path, poll_interval=0.05)
+            self._wait(messages, 1)
+
+            os.unlink(os.path.join(fix.path, 'a.txt'))
+            self._touch(os.path.join(fix.path, 'b.txt'))
+            self._wait(messages, 2)
+
+            item = messages[1]['item']
+            self.assertEqual(self._paths(item, 'deletes'), [os.path.join(fix.path, 'a.txt')])
+            self.assertEqual(self._paths(item, 'inserts'), [os.path.join(fix.path, 'b.txt')])
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify is only available on Linux")
+    def test_inotify(self):
+        """
+        The inotify engine reports files in directories created after the
+        initial scan.
+        """
+        with fixtures.TempDir() as fix:
+            self._touch(os.path.join(fix.path, 'a.txt'))
+
+            pipeline, messages = self._start(fix.path, engine='inotify')
+            self._wait(messages, 1)
+
+            os.mkdir(os.path.join(fix.path, 'sub'))
+            self._touch(os.path.join(fix.path, 'sub', 'b.txt'))
+            deadline = time.time() + 10
+            while pipeline.metrics.counter('message_entries') < 2 and time.time() < deadline:
+                time.sleep(0.01)
+
+            paths = sum((self._paths(msg['item'], 'inserts') for msg in messages), [])
+            self.assertEqual(sorted(paths), [os.path.join(fix.path, 'a.txt'),
+                                             os.path.join(fix.path, 'sub', 'b.txt')])
+
+    def test_shards(self):
+        """
+        With multiple shards, all changes are reported by the worker
+        processes, including the removal of known paths below a resynced
+        directory.
+        """
+        with fixtures.TempDir() as fix:
+            paths = []
+            for i in range(4):
+                os.mkdir(os.path.join(fix.path, str(i)))
+                paths.append(os.path.join(fix.path, str(i), 'a.txt'))
+                self._touch(paths[-1])
+
+            pipeline, messages = self._start(fix.path, shards=2)
+            def inserted():
+                return sum((self._paths(msg['item'], 'inserts') for msg in messages), [])
+
+            deadline = time.time() + 30
+            while len(inserted()) < 4 and time.time() < deadline:
+                time.sleep(0.01)
+
+            self.assertEqual(sorted(inserted()), sorted(paths))
+
+            count = len(messages)
+            os.unlink(paths[0])
+            os.rmdir(os.path.join(fix.path, '0'))
+            pipeline.resync()
+            self._wait(messages, count + 1)
+
+            item = messages[-1]['item']
+            self.assertEqual(self._paths(item, 'deletes'), paths[:1])
+            self.assertEqual(item['inserts'], ())
+
+    def test_metrics(self):
+        """
+        Metrics are emitted periodically on the metrics port.
+        """
+        with fixtures.TempDir() as fix:
+            self._touch(os.path.join(fix.path, 'a.txt'))
+
+            pipeline, messages = self._start(fix.path, metrics_interval=0.05,
+                                             metrics_port='metrics')
+
+            def ports():
+                return [msg['port'] for msg in messages]
+
+            deadline = time.time() + 10
+            while ports()[-1:] != ['metrics'] or 'default' not in ports():
+                if time.time() > deadline:
+                    break
+                time.sleep(0.01)
+
+            self.assertEqual(ports().count('default'), 1)
+            item = messages[ports().index('default') + 1]['item']
+            self.assertEqual(item['type'], 'metrics')
+            self.assertEqual(item['metrics']['gauges']['repository_entries'], 1)
+            self.assertEqual(item['metrics']['counters']['messages'], 1)
+            self.assertIn('batch_resolve', item['metrics']['histograms'])
+            self.assertIn('queue_depth', item['metrics']['gauges'])
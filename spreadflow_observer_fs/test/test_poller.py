@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the directory poller.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import fixtures
+import os
+import unittest
+
+from spreadflow_observer_fs.batch import SubtreeChange
+from spreadflow_observer_fs.matcher import PatternMatcher
+from spreadflow_observer_fs.poller import DirectoryPoller, RateLimiter
+from spreadflow_observer_fs.protocol import MessageFactory
+
+
+class DirectoryPollerTestCase(unittest.TestCase):
+    """
+    Unit tests for the directory poller.
+    """
+
+    def _touch(self, path, data=''):
+        with open(path, 'w') as stream:
+            stream.write(data)
+
+    def _poller(self, directory, factory, items, workers=1):
+        def lookup(dirpath):
+            return (factory.fingerprints(dirpath), set(factory.subdirs(dirpath)))
+
+        def put(item):
+            items.append(item)
+            if not isinstance(item, SubtreeChange):
+                (deletes, inserts, stats) = item
+                list(factory.update(deletes, inserts, tuple({'stat': tuple(st)} for st in stats)))
+
+        return DirectoryPoller(PatternMatcher(['*.txt']), [directory], lookup, put,
+                               interval=0, workers=workers)
+
+    def test_poll(self):
+        """
+        Only changes compared to the repository are reported. Unchanged
+        directories are not listed again once their mtime is trusted.
+        """
+        for workers in (1, 4):
+            with fixtures.TempDir() as fix:
+                os.makedirs(os.path.join(fix.path, 'sub', 'deep'))
+                paths = [os.path.join(fix.path, 'a.txt'),
+                         os.path.join(fix.path, 'sub', 'b.txt'),
+                         os.path.join(fix.path, 'sub', 'deep', 'c.txt')]
+                for path in paths:
+                    self._touch(path)
+                self._touch(os.path.join(fix.path, 'ignored.dat'))
+
+                factory = MessageFactory(encoder=None)
+                items = []
+                poller = self._poller(fix.path, factory, items, workers)
+
+                stats = poller.poll()
+                self.assertEqual(stats.directories, 3)
+                self.assertEqual(sorted(factory.paths()), sorted(paths))
+
+                del items[:]
+                poller.poll()
+                stats = poller.poll()
+                self.assertEqual(items, [])
+                self.assertEqual(stats.unchanged, 3)
+                self.assertEqual(stats.stats, 6)
+
+                self._touch(paths[1], 'modified')
+                os.unlink(paths[0])
+                poller.poll()
+                self.assertEqual(sorted(factory.paths()), sorted(paths[1:]))
+                self.assertEqual(len(items), 2)
+
+                del items[:]
+                os.unlink(paths[2])
+                os.rmdir(os.path.join(fix.path, 'sub', 'deep'))
+                poller.poll()
+                self.assertEqual(items, [SubtreeChange(os.path.join(fix.path, 'sub', 'deep'), None)])
+
+    def test_errors(self):
+        """
+        Unexpected errors are logged, other directories are still polled and
+        the failed one is retried on the next pass.
+        """
+        for workers in (1, 4):
+            with fixtures.TempDir() as fix:
+                os.mkdir(os.path.join(fix.path, 'sub'))
+                paths = [os.path.join(fix.path, 'a.txt'), os.path.join(fix.path, 'sub', 'b.txt')]
+                for path in paths:
+                    self._touch(path)
+
+                factory = MessageFactory(encoder=None)
+                items = []
+                log = []
+                failed = []
+
+                def lookup(dirpath):
+                    if dirpath == fix.path and not failed:
+                        failed.append(dirpath)
+                        raise IndexError("bytearray index out of range")
+                    return (factory.fingerprints(dirpath), set(factory.subdirs(dirpath)))
+
+                def put(item):
+                    items.append(item)
+                    (deletes, inserts, stats) = item
+                    list(factory.update(deletes, inserts, tuple({'stat': tuple(st)} for st in stats)))
+
+                poller = DirectoryPoller(PatternMatcher(['*.txt']), [fix.path], lookup, put,
+                                         interval=0, workers=workers, log=log.append)
+                stats = poller.poll()
+                self.assertEqual(stats.errors, 1)
+                self.assertEqual(len(log), 1)
+                self.assertEqual(factory.paths(), [])
+
+                stats = poller.poll()
+                self.assertEqual(stats.errors, 0)
+                self.assertEqual(sorted(factory.paths()), sorted(paths))
+
+    def test_rate_limiter(self):
+        """
+        Reservations are spaced out according to the rate.
+        """
+        limiter = RateLimiter(100)
+        self.assertEqual(limiter.reserve(50), 0)
+        self.assertAlmostEqual(limiter.reserve(1), 0.5, places=1)
+        self.assertAlmostEqual(limiter.delay(), 0.51, places=1)
+        self.assertEqual(RateLimiter(0).reserve(1000), 0)
+        self.assertEqual(RateLimiter(0).delay(), 0)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the observer protocol (repository and message factory).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+import time
+import unittest
+
+from bson import BSON
+
+from spreadflow_observer_fs.protocol import MessageFactory, Repository
+
+
+class RepositoryTestCase(unittest.TestCase):
+    """
+    Unit tests for the path-indexed repository.
+    """
+
+    def test_update_insert_and_delete(self):
+        """
+        Inserting new paths and deleting known ones yields the net changes.
+        """
+        repo = Repository()
+
+        deleted, inserted = repo.update((), [('/a', 'x'), ('/b', 'y')])
+        self.assertEqual(deleted, set())
+        self.assertEqual(inserted, set([('/a', 'x'), ('/b', 'y')]))
+        self.assertEqual(len(repo), 2)
+
+        deleted, inserted = repo.update(('/a', '/unknown'), [])
+        self.assertEqual(deleted, set([('/a', 'x')]))
+        self.assertEqual(inserted, set())
+        self.assertEqual(len(repo), 1)
+
+    def test_update_modify(self):
+        """
+        A changed oid on the same path is reported as delete plus insert, an
+        unchanged oid is not reported at all.
+        """
+        repo = Repository()
+        repo.update((), [('/a', 'x')])
+
+        deleted, inserted = repo.update(('/a',), [('/a', 'x')])
+        self.assertEqual(deleted, set())
+        self.assertEqual(inserted, set())
+
+        deleted, inserted = repo.update(('/a',), [('/a', 'z')])
+        self.assertEqual(deleted, set([('/a', 'x')]))
+        self.assertEqual(inserted, set([('/a', 'z')]))
+
+    def test_replace(self):
+        """
+        Replacing the repository reports the difference to the previous state.
+        """
+        repo = Repository()
+        repo.update((), [('/a', 'x'), ('/b', 'y')])
+
+        deleted, inserted = repo.replace(set([('/b', 'y'), ('/c', 'z')]))
+        self.assertEqual(deleted, set([('/a', 'x')]))
+        self.assertEqual(inserted, set([('/c', 'z')]))
+        self.assertEqual(len(repo), 2)
+
+    def test_entries(self):
+        """
+        Hex digests and stat fingerprints survive the compact representation,
+        as do other oids and fingerprints. Fingerprints are cleared when no
+        longer given and records of removed entries are reused.
+        """
+        digest = '0123456789abcdef0123456789abcdef01234567'
+        stat = (33188, 10, 20, 1, 1000, 1000, 5, 100, 200, 300)
+        repo = Repository()
+
+        repo.update((), [('/x/a', digest), ('/x/b', 'X'), ('/x/c', digest.upper())],
+                    {'/x/a': stat, '/x/b': (1.5, -1), '/x/c': None})
+        self.assertEqual(len(repo), 3)
+        self.assertEqual(repo.lookup('/x/a'), (digest, stat))
+        self.assertEqual(repo.lookup('/x/b'), ('X', (1.5, -1)))
+        self.assertEqual(repo.lookup('/x/c'), (digest.upper(), None))
+        self.assertEqual(repo.lookup('/x/d'), None)
+
+        repo.update(('/x/a', '/x/b'), [('/x/a', digest)], {})
+        self.assertEqual(repo.lookup('/x/a'), (digest, None))
+        self.assertEqual(repo.get('/x/b'), None)
+
+        repo.update((), [('/x/d', 'Y')])
+        self.assertEqual(sorted(repo.entries()), [
+            ('/x/a', digest, None),
+            ('/x/c', digest.upper(), None),
+            ('/x/d', 'Y', None),
+        ])
+
+    def test_subtree(self):
+        """
+        All entries below a directory are found, regardless of the depth and
+        of sibling directories sharing a name prefix.
+        """
+        repo = Repository()
+        repo.update((), [('/x/a', '1'), ('/x/d/b', '2'), ('/x/d/e/f/c', '3'),
+                         ('/x/dd/c', '4'), ('/y/a', '5')])
+
+        self.assertEqual(sorted(repo.subtree('/x/d')), ['/x/d/b', '/x/d/e/f/c'])
+        self.assertEqual(sorted(repo.subtree('/x/d/')), ['/x/d/b', '/x/d/e/f/c'])
+        self.assertEqual(len(repo.subtree('/')), 5)
+        self.assertEqual(repo.subtree('/z'), [])
+
+        repo.update(('/x/d/b', '/x/d/e/f/c'), [])
+        self.assertEqual(repo.subtree('/x/d'), [])
+        self.assertEqual(sorted(repo.subtree('/x')), ['/x/a', '/x/dd/c'])
+
+        repo.replace([('/x/d/e/g', '6')])
+        self.assertEqual(repo.subtree('/x/d'), ['/x/d/e/g'])
+        self.assertEqual(repo.subtree('/y'), [])
+
+    def test_concurrent_queries(self):
+        """
+        Per-directory queries from another thread see consistent records
+        while the directory is emptied and refilled.
+        """
+        repo = Repository()
+        names = ['/d/{:d}'.format(i) for i in range(20)]
+        errors = []
+        stopped = threading.Event()
+
+        def query():
+            while not stopped.is_set():
+                try:
+                    for path, fingerprint in repo.fingerprints('/d').items():
+                        if fingerprint != (int(path.rsplit('/', 1)[1]),):
+                            errors.append((path, fingerprint))
+                except Exception as e: #pylint: disable=broad-except
+                    errors.append(e)
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        try:
+            deadline = time.time() + 0.5
+            while time.time() < deadline and not errors:
+                repo.update((), [(path, 'x') for path in names[::-1]],
+                            dict((path, (int(path.rsplit('/', 1)[1]),)) for path in names))
+                repo.update(names, ())
+        finally:
+            stopped.set()
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class MessageFactoryTestCase(unittest.TestCase):
+    """
+    Unit tests for the message factory.
+    """
+
+    def test_snapshot_restore(self):
+        """
+        A factory restored from a snapshot only reports actual differences.
+        """
+        factory = MessageFactory()
+        meta_a = {'stat': (1, 2, 3)}
+        meta_b = {'stat': (4, 5, 6)}
+        msgs = list(factory.update((), ('/a', '/b'), (meta_a, meta_b)))
+        self.assertEqual(len(msgs), 1)
+
+        restored = MessageFactory()
+        restored.restore(factory.snapshot())
+        self.assertEqual(sorted(restored.paths()), ['/a', '/b'])
+
+        msgs = list(restored.update((), ('/a',), (meta_a,)))
+        self.assertEqual(msgs, [])
+
+        msgs = list(restored.update(('/b',), ('/b',), ({'stat': (4, 5, 7)},)))
+        self.assertEqual(len(msgs), 1)
+        item = BSON(msgs[0]).decode()['item']
+        self.assertEqual(len(item['deletes']), 1)
+        self.assertEqual(len(item['inserts']), 1)
+        self.assertEqual(item['data'][item['inserts'][0]]['path'], '/b')
+
+    def test_chunking(self):
+        """
+        Messages are split by entry count and estimated size, deletes and
+        inserts may share a message.
+        """
+        factory = MessageFactory(chunk_size=3, chunk_bytes=0)
+        paths = tuple('/{0:d}'.format(i) for i in range(5))
+        meta = tuple({'stat': (i,)} for i in range(5))
+        msgs = list(factory.update((), paths, meta))
+        items = [BSON(msg).decode()['item'] for msg in msgs]
+        self.assertEqual([len(item['inserts']) for item in items], [3, 2])
+        self.assertEqual(sum(len(item['data']) for item in items), 5)
+
+        msgs = list(factory.update(paths[:1], paths[2:3], ({'stat': (-1,)},)))
+        items = [BSON(msg).decode()['item'] for msg in msgs]
+        self.assertEqual(len(items), 1)
+        self.assertEqual(len(items[0]['deletes']), 2)
+        self.assertEqual(len(items[0]['inserts']), 1)
+
+        factory = MessageFactory(chunk_size=0, chunk_bytes=1)
+        msgs = list(factory.update((), paths, meta))
+        self.assertEqual(len(msgs), 5)
+
+    def test_dump(self):
+        """
+        A dump lists all known objects in chunked snapshot messages.
+        """
+        factory = MessageFactory(chunk_size=2, chunk_bytes=0)
+        items = [BSON(msg).decode()['item'] for msg in factory.dump()]
+        self.assertEqual([(item['type'], item['first'], item['last'], item['inserts']) for item in items],
+                         [('snapshot', True, True, [])])
+
+        paths = tuple('/{0:d}'.format(i) for i in range(3))
+        meta = tuple({'stat': (i,)} for i in range(3))
+        inserted = [BSON(msg).decode()['item'] for msg in factory.update((), paths, meta)]
+        data = dict((oid, meta) for item in inserted for oid, meta in item['data'].items())
+
+        items = [BSON(msg).decode()['item'] for msg in factory.dump()]
+        self.assertEqual([len(item['inserts']) for item in items], [2, 1])
+        self.assertEqual([(item['first'], item['last']) for item in items], [(True, False), (False, True)])
+        self.assertEqual(dict((oid, meta) for item in items for oid, meta in item['data'].items()), data)
+        self.assertEqual(list(factory.update((), (), ())), [])
+
+    def test_dump_fragment_cache(self):
+        """
+        Snapshots assembled from cached fragments match encoded ones, entries
+        are only encoded again after they changed.
+        """
+        def dump(factory):
+            items = [BSON(msg).decode()['item'] for msg in factory.dump()]
+            for item in items:
+                del item['date']
+            return items
+
+        plain = MessageFactory(chunk_size=2, chunk_bytes=0)
+        cached = MessageFactory(chunk_size=2, chunk_bytes=0, fragment_cache=True)
+        encoded = lambda: cached.metrics.counter('fragments_encoded')
+
+        def update(deletes, paths, meta):
+            for factory in (plain, cached):
+                list(factory.update(deletes, paths, meta))
+
+        self.assertEqual(dump(cached), dump(plain))
+        update((), ('/a', '/b', '/c'), ({'stat': (1,)}, {'stat': (2,)}, {}))
+        self.assertEqual(dump(cached), dump(plain))
+        self.assertEqual(encoded(), 3)
+        self.assertEqual(dump(cached), dump(plain))
+        self.assertEqual(encoded(), 3)
+
+        update(('/b',), ('/a', '/d'), ({'stat': (3,)}, {'stat': (4,)}))
+        self.assertEqual(dump(cached), dump(plain))
+        self.assertEqual(encoded(), 5)
+
+    def test_detect_renames(self):
+        """
+        With rename detection a moved file keeps its oid.
+        """
+        stat = (33188, 10, 20, 1, 1000, 1000, 5, 100, 200, 300)
+        moved = stat[:9] + (301,)
+
+        for detect_renames in (False, True):
+            factory = MessageFactory(detect_renames=detect_renames)
+            list(factory.update((), ('/a', '/b'), ({'stat': stat}, {'stat': stat[:1] + (11,) + stat[2:]})))
+
+            msgs = list(factory.update(('/a', '/c'), ('/c',), ({'stat': moved},)))
+            self.assertEqual(len(msgs), 1)
+            item = BSON(msgs[0]).decode()['item']
+            self.assertEqual(len(item['deletes']), 1)
+            self.assertEqual(len(item['inserts']), 1)
+            self.assertEqual(item['data'][item['inserts'][0]]['path'], '/c')
+            self.assertEqual(item['deletes'] == item['inserts'], detect_renames)
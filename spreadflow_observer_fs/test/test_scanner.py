@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the initial directory scanner.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import fixtures
+import os
+import threading
+import unittest
+
+from spreadflow_observer_fs.matcher import PatternMatcher
+from spreadflow_observer_fs.scanner import DirectoryScanner
+
+
+class DirectoryScannerTestCase(unittest.TestCase):
+    """
+    Unit tests for the directory scanner.
+    """
+
+    def _populate(self, rundir):
+        paths = []
+        for subdir in ('', 'a', 'a/b', 'skip', 'skip/c'):
+            dirpath = os.path.join(rundir, subdir)
+            if not os.path.isdir(dirpath):
+                os.makedirs(dirpath)
+            for name in ('x.txt', 'y.dat'):
+                path = os.path.join(dirpath, name)
+                with open(path, 'w') as stream:
+                    stream.write(name)
+                paths.append(path)
+        return paths
+
+    def _scan(self, scanner, rundir):
+        results = {}
+        lock = threading.Lock()
+
+        def collect(paths, stats):
+            with lock:
+                results.update(zip(paths, stats))
+
+        scan_stats = scanner.scan([rundir], collect)
+        return results, scan_stats
+
+    def test_scan(self):
+        """
+        Scanner reports matching files along with their stat result.
+        """
+        for workers in (1, 4):
+            with fixtures.TempDir() as fix:
+                paths = self._populate(fix.path)
+                scanner = DirectoryScanner(PatternMatcher(['*/*.txt']), workers=workers)
+                results, scan_stats = self._scan(scanner, fix.path)
+
+                expected = [path for path in paths if path.endswith('.txt')]
+                self.assertEqual(sorted(results), sorted(expected))
+                for path, st in results.items():
+                    self.assertEqual(tuple(st), tuple(os.stat(path)))
+                self.assertEqual(scan_stats.matches, 5)
+                self.assertEqual(scan_stats.entries, 14)
+
+    def test_scan_exclude(self):
+        """
+        Directories matching an exclude pattern are pruned.
+        """
+        with fixtures.TempDir() as fix:
+            self._populate(fix.path)
+            scanner = DirectoryScanner(PatternMatcher(['*/*.txt'], exclude_dirs=['*/skip']), workers=2)
+            results, _ = self._scan(scanner, fix.path)
+
+            self.assertEqual(sorted(results), [
+                os.path.join(fix.path, 'a', 'b', 'x.txt'),
+                os.path.join(fix.path, 'a', 'x.txt'),
+                os.path.join(fix.path, 'x.txt'),
+            ])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for sharded processing.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import fixtures
+import os
+import unittest
+
+from spreadflow_observer_fs.batch import ChangeSet
+from spreadflow_observer_fs.shard import Shard, ShardPool
+from spreadflow_observer_fs.watch import WatchSet
+
+
+class ShardTestCase(unittest.TestCase):
+    """
+    Unit tests for the shard worker and the assignment of paths to shards.
+    """
+
+    def _touch(self, path):
+        with open(path, 'w'):
+            pass
+
+    def test_process(self):
+        """
+        Changes are resolved against the slice of the repository owned by
+        the shard. Known paths below deleted subtrees are removed.
+        """
+        with fixtures.TempDir() as fix:
+            os.mkdir(os.path.join(fix.path, 'sub'))
+            paths = [os.path.join(fix.path, 'a.txt'), os.path.join(fix.path, 'sub', 'b.txt')]
+            for path in paths:
+                self._touch(path)
+
+            watch_set = WatchSet.from_specs([('default', fix.path, '*.txt')])
+            shard = Shard(watch_set, None)
+            changes = ChangeSet()
+            changes.add((), paths)
+            messages = shard.process((), changes.entries())
+            self.assertEqual(len(messages), 1)
+            self.assertEqual(len(messages[0]['item']['inserts']), 2)
+            self.assertEqual(len(shard), 2)
+
+            messages = shard.process((os.path.join(fix.path, 'sub'),), [])
+            item = messages[0]['item']
+            self.assertEqual([item['data'][oid]['path'] for oid in item['deletes']], paths[1:])
+            self.assertEqual(len(shard), 1)
+            shard.close()
+
+    def test_shard_key(self):
+        """
+        With the directory key, paths below the same top-level subdirectory
+        are assigned to the same shard.
+        """
+        watch_set = WatchSet.from_specs([('default', '/data', '*.txt')])
+        pool = ShardPool(16, watch_set, None, None, {}, key='directory')
+        self.assertEqual(len(set(pool.shard('/data/x/{:d}/a.txt'.format(i)) for i in range(100))), 1)
+
+        pool = ShardPool(16, watch_set, None, None, {})
+        self.assertGreater(len(set(pool.shard('/data/x/{:d}/a.txt'.format(i)) for i in range(100))), 1)
+        self.assertEqual(pool.shard('/data/x/a.txt'), pool.shard('/data/x/a.txt'))
+        self.assertRaises(ValueError, ShardPool, 2, watch_set, None, None, {}, key='unknown')
@@ -10,6 +10,9 @@ from __future__ import division
 from __future__ import unicode_literals
 
 import copy
+import fixtures
+import os
+import time
 
 from bson import BSON
 from datetime import datetime
@@ -22,7 +25,8 @@ from testtools.twistedsupport import AsynchronousDeferredRunTest
 from spreadflow_core.scheduler import Scheduler
 from spreadflow_delta.test.matchers import MatchesSendDeltaItemInvocation
 
-from spreadflow_observer_fs.source import FilesystemObserverSource
+from spreadflow_observer_fs.source import FilesystemObserverSource, \
+    InProcessFilesystemObserverSource
 
 
 def _spawnProcess(processProtocol, executable, args=(), env={}, path=None, uid=None, gid=None, usePTY=0, childFDs=None):
@@ -70,3 +74,62 @@ class SpreadflowSourceIntegrationTestCase(TestCase):
         source.peer.dataReceived(BSON.encode(msg))
         self.assertEquals(scheduler.send.call_count, 1)
         self.assertThat(scheduler.send.call_args, matches)
+
+    @run_test_with(AsynchronousDeferredRunTest)
+    @defer.inlineCallbacks
+    def test_source_command(self):
+        """
+        Commands are written to the observer process as BSON documents.
+        """
+        source = FilesystemObserverSource('*.txt', '/some/directory')
+
+        reactor = Mock()
+        reactor.spawnProcess = Mock(spec=_spawnProcess)
+        scheduler = Mock()
+
+        yield source.attach(scheduler, reactor)
+        source.peer.transport = Mock()
+
+        source.rescan('/some/directory/sub')
+        source.snapshot()
+        self.assertEqual([args[0][0] for args in source.peer.transport.write.call_args_list], [
+            BSON.encode({'command': 'rescan', 'path': '/some/directory/sub'}),
+            BSON.encode({'command': 'snapshot'}),
+        ])
+
+    def test_inprocess_source(self):
+        """
+        In-process source hands delta items directly to the scheduler.
+        """
+        with fixtures.TempDir() as fix:
+            txtpath = os.path.join(fix.path, 'test.txt')
+            with open(txtpath, 'w') as stream:
+                stream.write('5WpWC30X')
+
+            source = InProcessFilesystemObserverSource('*.txt', fix.path)
+
+            reactor = Mock()
+            reactor.callFromThread = lambda f, *args: f(*args)
+
+            scheduler = Mock()
+            scheduler.send = Mock(spec=Scheduler.send)
+
+            source.attach(scheduler, reactor)
+            for _ in range(100):
+                if scheduler.send.call_count:
+                    break
+                time.sleep(0.05)
+
+            stopped = source.detach()
+            for _ in range(100):
+                if stopped.called:
+                    break
+                time.sleep(0.05)
+            self.assertTrue(stopped.called)
+
+            self.assertEqual(scheduler.send.call_count, 1)
+            item, port = scheduler.send.call_args[0]
+            self.assertIs(port, source)
+            self.assertEqual(item['type'], 'delta')
+            self.assertEqual(len(item['inserts']), 1)
+            self.assertEqual(item['data'][item['inserts'][0]]['path'], txtpath)
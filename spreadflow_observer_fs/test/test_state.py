@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the repository state file.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import fixtures
+import os
+import unittest
+
+from spreadflow_observer_fs.state import StateFile
+
+
+class StateFileTestCase(unittest.TestCase):
+    """
+    Unit tests for the repository state file.
+    """
+
+    def test_roundtrip(self):
+        """
+        Saved entries are restored for the same watches and oid strategy only.
+        """
+        with fixtures.TempDir() as fix:
+            path = os.path.join(fix.path, 'state')
+            watches = [('default', '/x', ['*/*.txt'], []), ('other', '/y', ['*/*.dat'], [])]
+            snapshots = {
+                'default': [('/x/a.txt', 'abc', (1, 2, 3)), ('/x/b.txt', 'def', None)],
+                'other': [('/y/c.dat', 'ghi', (4, 5, 6))],
+            }
+
+            self.assertEqual(StateFile(path, watches).load(), {})
+
+            StateFile(path, watches).save(snapshots)
+            loaded = StateFile(path, watches).load()
+            self.assertEqual(sorted(loaded), ['default', 'other'])
+            for port, entries in loaded.items():
+                self.assertEqual([(p, o, tuple(f) if f else f) for p, o, f in entries], snapshots[port])
+
+            self.assertEqual(StateFile(path, watches[:1]).load(), {})
+            self.assertEqual(StateFile(path, [('default', '/x', ['*/*.dat'], [])]).load(), {})
+            self.assertEqual(StateFile(path, watches, oid='content').load(), {})
+
+    def test_corrupt(self):
+        """
+        A corrupt state file is ignored.
+        """
+        with fixtures.TempDir() as fix:
+            path = os.path.join(fix.path, 'state')
+            with open(path, 'wb') as stream:
+                stream.write(b'\x10\x00\x00\x00garbage')
+            self.assertEqual(StateFile(path, [('default', '/x', ['*/*.txt'], [])]).load(), {})
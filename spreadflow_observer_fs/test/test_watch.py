@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for watches and routing of changes to ports.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import unittest
+
+from spreadflow_observer_fs.matcher import PatternMatcher
+from spreadflow_observer_fs.watch import Watch, WatchSet
+
+
+class WatchSetTestCase(unittest.TestCase):
+    """
+    Unit tests for a set of watches.
+    """
+
+    def setUp(self):
+        super(WatchSetTestCase, self).setUp()
+        self.watch_set = WatchSet([
+            Watch('text', '/data', PatternMatcher(['*/*.txt'], ['*/tmp'])),
+            Watch('images', '/data/img', PatternMatcher(['*/*.jpg', '*/*.txt'])),
+            Watch('logs', '/var/log', PatternMatcher(['*/*.log'])),
+        ])
+
+    def test_roots(self):
+        """
+        Nested directories are covered by their parent.
+        """
+        self.assertEqual(self.watch_set.roots(), ['/data', '/var/log'])
+
+    def test_prune(self):
+        """
+        Directories are pruned only if no watch is interested in them.
+        """
+        self.assertFalse(self.watch_set.prune('/data/img'))
+        self.assertFalse(self.watch_set.prune('/var'))
+        self.assertTrue(self.watch_set.prune('/data/tmp'))
+        self.assertFalse(self.watch_set.prune('/data/img/tmp'))
+
+    def test_route(self):
+        """
+        Changes are delivered to every port with a matching watch.
+        """
+        batches = self.watch_set.route(
+            ('/data/a.txt', '/data/img/b.jpg', '/data/img/c.txt', '/data/tmp/d.txt', '/var/log/e.log'),
+            ('/data/a.txt', '/data/img/c.txt', '/var/log/e.log'),
+            ({'stat': 1}, {'stat': 2}, {'stat': 3}))
+
+        self.assertEqual(batches, [
+            ('text', ('/data/a.txt', '/data/img/c.txt'), ('/data/a.txt', '/data/img/c.txt'), ({'stat': 1}, {'stat': 2})),
+            ('images', ('/data/img/b.jpg', '/data/img/c.txt'), ('/data/img/c.txt',), ({'stat': 2},)),
+            ('logs', ('/var/log/e.log',), ('/var/log/e.log',), ({'stat': 3},)),
+        ])
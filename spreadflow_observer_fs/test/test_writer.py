@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-many-public-methods
+
+"""
+Unit tests for the buffered output writer.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import io
+import threading
+import time
+import unittest
+
+from spreadflow_observer_fs.writer import BufferedWriter
+
+
+class RecordingStream(object):
+    """
+    Output stream recording each write, optionally blocking until released.
+    """
+
+    def __init__(self, blocked=False):
+        self.chunks = []
+        self.release = threading.Event()
+        if not blocked:
+            self.release.set()
+
+    def write(self, data):
+        self.release.wait()
+        self.chunks.append(data)
+
+    def flush(self):
+        pass
+
+
+class BufferedWriterTestCase(unittest.TestCase):
+    """
+    Unit tests for the buffered output writer.
+    """
+
+    def test_coalesce(self):
+        """
+        Messages are coalesced into a single write up to the size limit.
+        """
+        out = RecordingStream()
+        writer = BufferedWriter(out, max_bytes=10, max_delay=60)
+        writer.start()
+        for msg in (b'aaaa', b'bbbb', b'cccc', b'dd'):
+            writer.write(msg)
+        writer.close()
+
+        self.assertEqual(out.chunks, [b'aaaabbbbcccc', b'dd'])
+        self.assertEqual(writer.messages, 4)
+        self.assertEqual(writer.bytes, 14)
+
+    def test_deadline(self):
+        """
+        Buffered messages are written once the delay expires.
+        """
+        out = RecordingStream()
+        writer = BufferedWriter(out, max_bytes=1024, max_delay=0.01)
+        writer.start()
+        writer.write(b'abc')
+
+        for _ in range(100):
+            if out.chunks:
+                break
+            time.sleep(0.01)
+        self.assertEqual(out.chunks, [b'abc'])
+        writer.close()
+
+    def test_backpressure(self):
+        """
+        Stalls due to a slow reader are counted and reported.
+        """
+        out = RecordingStream(blocked=True)
+        err = io.StringIO()
+        writer = BufferedWriter(out, max_bytes=1, max_delay=0, max_queue=1, err=err)
+        writer.start()
+
+        threading.Timer(0.2, out.release.set).start()
+        for msg in (b'a', b'b', b'c', b'd'):
+            writer.write(msg)
+        writer.close()
+
+        self.assertEqual(b''.join(out.chunks), b'abcd')
+        self.assertGreaterEqual(writer.stalls, 1)
+        self.assertIn('Output backpressure', err.getvalue())
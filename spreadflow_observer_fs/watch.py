@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import os
+from spreadflow_observer_fs.matcher import PatternMatcher
+
+
+class Watch(object):
+    """
+    A directory observed for files matching a pattern, reported on a port.
+    """
+
+    def __init__(self, port, directory, matcher):
+        self.port = port
+        self.directory = os.path.abspath(directory)
+        self.matcher = matcher
+        self._prefix = os.path.join(self.directory, '')
+
+    def contains(self, path):
+        return path.startswith(self._prefix)
+
+    def matches(self, path):
+        return self.contains(path) and self.matcher.matches(path)
+
+    def wants(self, dirpath):
+        """
+        Return True if files below dirpath may be of interest.
+        """
+        if self.contains(dirpath):
+            return not self.matcher.prune(dirpath)
+        return dirpath == self.directory or self.directory.startswith(os.path.join(dirpath, ''))
+
+
+class WatchSet(object):
+    """
+    Combines multiple watches, possibly on overlapping directories, and routes
+    changes to the ports of the watches matching a path.
+    """
+
+    def __init__(self, watches):
+        self.watches = list(watches)
+        self.ports = list(collections.OrderedDict.fromkeys(w.port for w in self.watches))
+
+    @classmethod
+    def from_specs(cls, specs, native_query=False, include=None, exclude=None, exclude_dirs=None):
+        """
+        Build a watch set from (port, directory, pattern) triples. Unless
+        native_query is set, patterns are matched against the end of the path
+        (i.e., they are prefixed with '*/').
+        """
+        include = list(include or [])
+        exclude = list(exclude or [])
+        exclude_dirs = list(exclude_dirs or [])
+        if not native_query:
+            include = ['*/' + p for p in include]
+            exclude = ['*/' + p for p in exclude]
+            exclude_dirs = ['*/' + d for d in exclude_dirs]
+
+        watches = []
+        for port, directory, pattern in specs:
+            if not native_query:
+                pattern = '*/' + pattern
+            matcher = PatternMatcher([pattern] + include, exclude_dirs=exclude_dirs,
+                                     exclude_patterns=exclude)
+            watches.append(Watch(port, directory, matcher))
+
+        return cls(watches)
+
+    def roots(self):
+        """
+        Return the minimal list of directories covering all watches.
+        """
+        roots = []
+        for directory in sorted(set(w.directory for w in self.watches)):
+            if not roots or not directory.startswith(os.path.join(roots[-1], '')):
+                roots.append(directory)
+        return roots
+
+    def matches(self, path):
+        return any(w.matches(path) for w in self.watches)
+
+    def prune(self, dirpath):
+        return not any(w.wants(dirpath) for w in self.watches)
+
+    def route(self, deletable_paths, insertable_paths, insertable_meta):
+        """
+        Split a batch of changes by port. Returns a list of (port,
+        deletable_paths, insertable_paths, insertable_meta) tuples.
+        """
+        if len(self.watches) == 1:
+            watch = self.watches[0]
+            deletes = tuple(path for path in deletable_paths if watch.matches(path))
+            inserts = []
+            meta = []
+            for path, m in zip(insertable_paths, insertable_meta):
+                if watch.matches(path):
+                    inserts.append(path)
+                    meta.append(m)
+            return [(watch.port, deletes, tuple(inserts), tuple(meta))]
+
+        batches = collections.OrderedDict((port, ([], [], [])) for port in self.ports)
+
+        def ports(path):
+            return set(w.port for w in self.watches if w.matches(path))
+
+        for path in deletable_paths:
+            for port in ports(path):
+                batches[port][0].append(path)
+
+        for path, m in zip(insertable_paths, insertable_meta):
+            for port in ports(path):
+                batches[port][1].append(path)
+                batches[port][2].append(m)
+
+        return [(port, tuple(deletes), tuple(inserts), tuple(meta))
+                for port, (deletes, inserts, meta) in batches.items()]
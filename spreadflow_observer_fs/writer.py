@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import sys
+import threading
+import time
+
+
+class BufferedWriter(object):
+    """
+    Writes messages from a dedicated thread, coalescing them into larger
+    writes.
+
+    Messages are handed over through a bounded queue. The buffer is flushed
+    when it exceeds max_bytes or when the oldest buffered message is older
+    than max_delay seconds. If the queue is full (i.e., the reader on the
+    other end of the output stream does not keep up), write() blocks and the
+    stall is reported on the error stream.
+    """
+
+    REPORT_INTERVAL = 10
+
+    def __init__(self, out, max_bytes=65536, max_delay=0.01, max_queue=1024, err=None):
+        self._out = out
+        self._err = sys.stderr if err is None else err
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._queue = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._stop_sentinel = object()
+        self._error = None
+
+        self.messages = 0
+        self.bytes = 0
+        self.writes = 0
+        self.stalls = 0
+        self.stalled_time = 0
+
+        self._reported_at = 0
+
+    def start(self):
+        self._thread.start()
+
+    def _flush(self, buf):
+        data = b''.join(buf)
+        self._out.write(data)
+        self._out.flush()
+        self.writes += 1
+        self.bytes += len(data)
+
+    def _run(self):
+        buf = []
+        size = 0
+        deadline = None
+
+        try:
+            while True:
+                timeout = None if deadline is None else max(0, deadline - time.time())
+                try:
+                    msg = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    msg = None
+
+                if msg is self._stop_sentinel:
+                    break
+
+                if msg is not None:
+                    buf.append(msg)
+                    size += len(msg)
+                    self.messages += 1
+                    if deadline is None:
+                        deadline = time.time() + self.max_delay
+
+                if buf and (size >= self.max_bytes or time.time() >= deadline):
+                    self._flush(buf)
+                    buf = []
+                    size = 0
+                    deadline = None
+
+            if buf:
+                self._flush(buf)
+        except (IOError, OSError) as e:
+            self._error = e
+
+    def _report_stall(self, duration):
+        self.stalls += 1
+        self.stalled_time += duration
+
+        now = time.time()
+        if now - self._reported_at >= self.REPORT_INTERVAL:
+            self._err.write("Output backpressure: {:d} stalls, {:.2f}s blocked in total ({:d} messages queued)\n".format(
+                self.stalls, self.stalled_time, self._queue.qsize()))
+            self._err.flush()
+            self._reported_at = now
+
+    def write(self, msg):
+        """
+        Queue a message for output. Blocks while the queue is full.
+        """
+        if self._error is not None:
+            raise self._error
+
+        try:
+            self._queue.put_nowait(msg)
+            return
+        except queue.Full:
+            stalled = time.time()
+
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(msg, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+        self._report_stall(time.time() - stalled)
+
+    def close(self):
+        """
+        Flush all pending messages and stop the writer thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(self._stop_sentinel)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
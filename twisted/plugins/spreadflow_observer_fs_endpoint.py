@@ -43,7 +43,11 @@ class SpreadflowObserverFSProcessEndpoint(object):
         return executable
 
 
-    def _parse(self, reactor, directory, query, native_query=True, type=None, executable=None):
+    def _parse(self, reactor, directory, query, watches=(), native_query=True, type=None,
+               executable=None, chunk_size=None, chunk_bytes=None, oid=None,
+               detect_renames=False, poll_interval=None, poll_rate=None,
+               metrics_interval=None, metrics_port=None, shards=None, shard_key=None,
+               bulk_rate=None, fragment_cache=False):
         binary_name = self._binary_name(type)
 
         if not executable:
@@ -55,13 +59,44 @@ class SpreadflowObserverFSProcessEndpoint(object):
         args = (executable,)
         if ast.literal_eval(str(native_query)):
             args += ('-n',)
+        if chunk_size is not None:
+            args += ('--chunk-size', str(int(chunk_size)))
+        if chunk_bytes is not None:
+            args += ('--chunk-bytes', str(int(chunk_bytes)))
+        if oid is not None:
+            args += ('--oid', oid)
+        if ast.literal_eval(str(detect_renames)):
+            args += ('--detect-renames',)
+        if ast.literal_eval(str(fragment_cache)):
+            args += ('--fragment-cache',)
+        if poll_interval is not None:
+            args += ('--poll-interval', str(float(poll_interval)))
+        if poll_rate is not None:
+            args += ('--poll-rate', str(int(poll_rate)))
+        if metrics_interval is not None:
+            args += ('--metrics-interval', str(float(metrics_interval)))
+        if metrics_port is not None:
+            args += ('--metrics-port', metrics_port)
+        if shards is not None:
+            args += ('--shards', str(int(shards)))
+        if shard_key is not None:
+            args += ('--shard-key', shard_key)
+        if bulk_rate is not None:
+            args += ('--bulk-rate', str(int(bulk_rate)))
+        for port, watch_directory, watch_query in watches:
+            args += ('--watch', port, watch_directory, watch_query)
         args += (directory, query)
 
         return ProcessEndpoint(reactor, executable, args=list(map(fsencode, args)))
 
 
-    def parseStreamClient(self, reactor, *args, **kwargs):
-        return self._parse(reactor, *args, **kwargs)
+    def parseStreamClient(self, reactor, directory, query, *watches, **kwargs):
+        # Additional positional arguments are (port, directory, query) triples
+        # of further watches served by the same process.
+        if len(watches) % 3:
+            raise ValueError("Additional watches must be given as PORT:DIR:PATTERN")
+        watches = tuple(zip(watches[0::3], watches[1::3], watches[2::3]))
+        return self._parse(reactor, directory, query, watches, **kwargs)
 
 
 spreafllow_observer_fs_endpoint = SpreadflowObserverFSProcessEndpoint()